@@ -0,0 +1,142 @@
+from fastapi import Depends, APIRouter
+from pydantic import BaseModel
+from typing import List
+
+router = APIRouter()
+
+from .auth import logged_in_user, User
+
+from ..util import Database, cache
+
+
+class CounterDrift(BaseModel):
+    id: int
+    stored: int
+    actual: int
+
+
+class StatsDrift(BaseModel):
+    version_id: int
+    data_manager_id: int
+    file_type_id: int
+    stored: int
+    actual: int
+
+
+class CounterReport(BaseModel):
+    versions: List[CounterDrift]
+    collections: List[CounterDrift]
+    version_stats: List[StatsDrift] = []
+    repaired: bool = False
+
+
+version_drift_query = """
+    select version_id as id, stored, actual
+    from (
+        select
+            version_id,
+            file_count as stored,
+            (select count(*) from version_members(version_id)) as actual
+        from version
+    ) counts
+    where stored <> actual
+    order by version_id
+"""
+
+collection_drift_query = """
+    select collection_id as id, stored, actual
+    from (
+        select
+            collection.collection_id,
+            collection.collection_file_count as stored,
+            coalesce(sum(version.file_count), 0) as actual
+        from collection
+        left join version
+            on collection.collection_id = version.collection_id
+        group by collection.collection_id
+    ) counts
+    where stored <> actual
+    order by collection_id
+"""
+
+stats_drift_query = """
+    select version_id, data_manager_id, file_type_id, stored, actual
+    from (
+        select
+            version_id, data_manager_id, file_type_id,
+            coalesce(stored.stats_file_count, 0) as stored,
+            coalesce(actual.file_count, 0) as actual
+        from version_stats as stored
+        full join (
+            select version_id, data_manager_id, file_type_id, count(*) as file_count
+            from version
+            cross join version_members(version_id) as member(file_id)
+            join file on file.file_id = member.file_id
+            group by version_id, data_manager_id, file_type_id
+        ) actual using (version_id, data_manager_id, file_type_id)
+    ) counts
+    where stored <> actual
+    order by version_id, data_manager_id, file_type_id
+"""
+
+
+@router.get("/counters", response_model=CounterReport)
+async def check_counters(db: Database = Depends()) -> CounterReport:
+    """Compare the maintained file counters against a full recount
+
+    The collection check is made against the stored version counters, so
+    version drift should be repaired first.
+    """
+    return CounterReport(
+        versions=await db.fetch(version_drift_query),
+        collections=await db.fetch(collection_drift_query),
+        version_stats=await db.fetch(stats_drift_query),
+    )
+
+
+@router.post("/counters", response_model=CounterReport)
+async def repair_counters(
+    user: User = logged_in_user, db: Database = Depends()
+) -> CounterReport:
+    """Recompute every file counter, reporting the drift that was fixed"""
+    async with db.transaction() as conn:
+        # Writers are blocked while recounting so no increment is lost
+        await conn.execute("lock table version_file, version_delta in share mode")
+        versions = await conn.fetch(version_drift_query)
+        await conn.execute(
+            f"""
+            update version
+            set file_count = drift.actual
+            from ({version_drift_query}) drift
+            where version.version_id = drift.id
+            """
+        )
+        collections = await conn.fetch(collection_drift_query)
+        await conn.execute(
+            f"""
+            update collection
+            set collection_file_count = drift.actual
+            from ({collection_drift_query}) drift
+            where collection.collection_id = drift.id
+            """
+        )
+        version_stats = await conn.fetch(stats_drift_query)
+        await conn.execute(
+            f"""
+            insert into version_stats
+            (version_id, data_manager_id, file_type_id, stats_file_count)
+            select version_id, data_manager_id, file_type_id, actual
+            from ({stats_drift_query}) drift
+            on conflict (version_id, data_manager_id, file_type_id) do update
+            set stats_file_count = excluded.stats_file_count
+            """
+        )
+        await conn.execute("delete from version_stats where stats_file_count = 0")
+    # Every cached file_count may have been wrong
+    await cache.invalidate(db, "collection_response")
+    return CounterReport(
+        versions=versions,
+        collections=collections,
+        version_stats=version_stats,
+        repaired=True,
+    )
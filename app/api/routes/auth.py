@@ -2,6 +2,11 @@ from fastapi import Depends, APIRouter, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from starlette.status import HTTP_401_UNAUTHORIZED
+from typing import Optional
+import abc
+import hmac
+
+from ..util import tokens
 
 fake_users_db = {
     "admin": {
@@ -47,22 +52,55 @@ def get_user(db, username: str):
         return UserInDB(**user_dict)
 
 
-def fake_decode_token(token):
-    # This doesn't provide any security at all
-    # Check the next version
-    user = get_user(fake_users_db, token)
-    return user
+class UserStore(abc.ABC):
+    """Looks users up for /token; install another one with set_user_store()
+
+    Only /token consults the store. Authenticated requests are served from
+    the claims in their signed token, without a lookup.
+    """
+
+    @abc.abstractmethod
+    async def authenticate(self, username: str, password: str) -> Optional[UserInDB]:
+        """The user with these credentials, or None if they do not match"""
+
+
+class InMemoryUserStore(UserStore):
+    def __init__(self, users: dict):
+        self.users = users
+
+    async def authenticate(self, username: str, password: str) -> Optional[UserInDB]:
+        user = get_user(self.users, username)
+        if user is None:
+            return None
+        hashed = fake_hash_password(password).encode()
+        if not hmac.compare_digest(hashed, user.hashed_password.encode()):
+            return None
+        return user
+
+
+user_store: UserStore = InMemoryUserStore(fake_users_db)
+
+
+def set_user_store(store: UserStore):
+    global user_store
+    user_store = store
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    user = fake_decode_token(token)
-    if not user:
+    try:
+        claims = tokens.verify(token)
+    except tokens.InvalidToken as e:
         raise HTTPException(
             status_code=HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
+            detail=f"Invalid authentication credentials: {e}",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return user
+    return User(
+        username=claims["sub"],
+        email=claims.get("email"),
+        full_name=claims.get("name"),
+        disabled=False,
+    )
 
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -73,15 +111,20 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
 
 @router.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user_dict = fake_users_db.get(form_data.username)
-    if not user_dict:
-        raise HTTPException(status_code=400, detail="Incorrect username or password")
-    user = UserInDB(**user_dict)
-    hashed_password = fake_hash_password(form_data.password)
-    if not hashed_password == user.hashed_password:
+    user = await user_store.authenticate(form_data.username, form_data.password)
+    if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
+    # Tokens cannot be revoked, so disabled users never get one; disabling
+    # an account takes effect once its outstanding tokens expire.
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
 
-    return {"access_token": user.username, "token_type": "bearer"}
+    token = tokens.issue(user.username, email=user.email, name=user.full_name)
+    return {
+        "access_token": token,
+        "token_type": "bearer",
+        "expires_in": tokens.TOKEN_TTL,
+    }
 
 
 @router.get("/users/me")
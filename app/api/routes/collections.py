@@ -1,4 +1,4 @@
-from fastapi import Depends, APIRouter, HTTPException
+from fastapi import Depends, APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel
 from typing import List, Optional
 from asyncpg.exceptions import UniqueViolationError
@@ -8,7 +8,12 @@ router = APIRouter()
 
 from .auth import logged_in_user, User
 
-from ..util import Database
+from ..util import Database, cache
+from ..util.conditional import published_version
+from ..util.db import prepared
+from ..util.pagination import KeysetPage, keyset_page
+from ..util.response_cache import response_cache
+from ..util.serialization import json_records
 
 
 class CollectionSummary(BaseModel):
@@ -28,73 +33,232 @@ class CollectionInfo(BaseModel):
     collection_description: Optional[str] = None
 
 
+collection_ids = cache.shared_cache("collection_id")
+# Rendered responses of the hot per-collection reads, invalidated by
+# collection_slug whenever a write changes what they return
+collection_responses = response_cache("collection_response")
+collection_id_query = prepared(
+    "select collection_id from collection where collection_slug = $1"
+)
+
+
 async def get_collection_id_from_slug(collection_slug: str, db: Database):
-    query = "select collection_id from collection where collection_slug = $1"
-    collection = await db.fetch_one(query, [collection_slug])
+    collection_id = collection_ids.get(collection_slug)
+    if collection_id is not None:
+        return collection_id
+    generation = collection_ids.generation
+    collection = await db.fetch_one(collection_id_query, [collection_slug])
     if len(collection) < 1:
         raise HTTPException(
             detail=f"Invalid collection slug: {collection_slug}", status_code=422
         )
+    collection_ids.set(collection_slug, collection["collection_id"], generation)
     return collection["collection_id"]
 
 
-@router.get("/", response_model=List[CollectionSummary])
-async def get_all_collections(db: Database = Depends()) -> List[CollectionSummary]:
+async def get_collection_ids_from_slugs(collection_slugs: List[str], db: Database):
+    """Resolve several slugs in one query; unknown slugs are left out"""
+    found, missing = collection_ids.get_many(collection_slugs)
+    if not missing:
+        return found
+    generation = collection_ids.generation
     query = """
+        select collection_slug, collection_id
+        from collection
+        where collection_slug = any($1)
+    """
+    for row in await db.fetch(query, [missing]):
+        found[row["collection_slug"]] = row["collection_id"]
+        collection_ids.set(row["collection_slug"], row["collection_id"], generation)
+    return found
+
+
+@router.get("/", response_model=List[CollectionSummary])
+async def get_all_collections(
+    page: KeysetPage = Depends(keyset_page("collection_id")),
+    db: Database = Depends(),
+) -> List[CollectionSummary]:
+    parameters = []
+    query = f"""
         select
             collection_id, collection_slug,
             collection_name, collection_doi,
-            count(file_id) as file_count
+            collection_file_count as file_count
         from collection
-        natural join version
-        left join version_file
-            on version.version_id = version_file.version_id
-        group by collection_id
+        where {page.where(parameters)}
+        {page.order_limit(parameters)}
     """
 
-    return await db.fetch(query)
+    records = page.finish(await db.fetch(query, parameters))
+    return json_records(records, CollectionSummary, page.response)
+
+
+collection_version_query = """
+    select
+        collection.collection_id, collection_slug,
+        collection_name, collection_doi,
+        version.file_count
+    from collection
+    join version
+        on collection.collection_id = version.collection_id
+    where collection_slug = $1
+      and version.version_id = $2
+"""
 
 
 @router.get("/{collection_slug}/{version_id}", response_model=CollectionSummary)
 async def get_collection_version_info(
-    collection_slug: str, version_id: int, db: Database = Depends()
+    collection_slug: str,
+    version_id: int,
+    request: Request,
+    response: Response,
+    not_modified: Optional[Response] = Depends(published_version),
+    db: Database = Depends(),
 ) -> CollectionSummary:
-    query = """
-        select
-            collection_id, collection_slug,
-            collection_name, collection_doi,
-            count(file_id) as file_count
-        from collection
-        natural join version
-        left join version_file
-            on version.version_id = version_file.version_id
-        where collection_slug = $1
-          and version.version_id = $2
-        group by collection_id
+    if not_modified:
+        return not_modified
+
+    async def fetch():
+        return await db.fetch_one(
+            collection_version_query, [collection_slug, version_id]
+        )
+
+    return await collection_responses.respond(
+        collection_slug, request, response, db, fetch, CollectionSummary, many=False
+    )
+
+
+class MimeTypeCount(BaseModel):
+    mime_type: str
+    file_count: int
+
+
+class DataManagerCount(BaseModel):
+    data_manager_name: str
+    file_count: int
+
+
+class FileTypeGroupCount(BaseModel):
+    file_type_group_name: Optional[str] = None
+    file_count: int
+
+
+class VersionStats(BaseModel):
+    collection_slug: str
+    version_id: int
+    file_count: int
+    mime_types: List[MimeTypeCount]
+    data_managers: List[DataManagerCount]
+    file_type_groups: List[FileTypeGroupCount]
+
+
+version_file_count_query = prepared(
+    """
+    select file_count
+    from version
+    natural join collection
+    where collection_slug = $1
+      and version_id = $2
+    """
+)
+
+# One row per breakdown entry. The group join only feeds its own breakdown:
+# a file type in several groups would otherwise be counted more than once
+# by mime type and data manager.
+version_stats_query = prepared(
+    """
+    select 'mime_type' as breakdown, mime_type as name,
+        sum(stats_file_count) as file_count
+    from version_stats
+    natural join file_type
+    where version_id = $1
+    group by mime_type
+    union all
+    select 'data_manager_name', data_manager_name, sum(stats_file_count)
+    from version_stats
+    natural join data_manager
+    where version_id = $1
+    group by data_manager_name
+    union all
+    select 'file_type_group_name', file_type_group_name, sum(stats_file_count)
+    from version_stats
+    left join file_type_group
+        on version_stats.file_type_id = file_type_group.file_type_id
+    where version_id = $1
+    group by file_type_group_name
+    order by breakdown, file_count desc, name
+    """
+)
+
+
+@router.get("/{collection_slug}/{version_id}/stats", response_model=VersionStats)
+async def get_version_stats(
+    collection_slug: str,
+    version_id: int,
+    not_modified: Optional[Response] = Depends(published_version),
+    db: Database = Depends(),
+) -> VersionStats:
+    """File counts of a version by mime type, data manager and file type group
+
+    A file whose type is in several groups is counted in each of them;
+    files whose type has no group are counted under a null
+    file_type_group_name.
     """
+    if not_modified:
+        return not_modified
+    version = await db.fetch_one(
+        version_file_count_query, [collection_slug, version_id]
+    )
+    if len(version) < 1:
+        raise HTTPException(
+            detail=f"Version {version_id} is not a version of {collection_slug}",
+            status_code=422,
+        )
+    stats = VersionStats(
+        collection_slug=collection_slug,
+        version_id=version_id,
+        file_count=version["file_count"],
+        mime_types=[],
+        data_managers=[],
+        file_type_groups=[],
+    )
+    breakdowns = {
+        "mime_type": (stats.mime_types, MimeTypeCount),
+        "data_manager_name": (stats.data_managers, DataManagerCount),
+        "file_type_group_name": (stats.file_type_groups, FileTypeGroupCount),
+    }
+    for row in await db.fetch(version_stats_query, [version_id]):
+        counts, model = breakdowns[row["breakdown"]]
+        counts.append(
+            model(**{row["breakdown"]: row["name"]}, file_count=row["file_count"])
+        )
+    return stats
 
-    return await db.fetch_one(query, [collection_slug, version_id])
+
+collection_info_query = """
+    select
+        collection_id, collection_slug,
+        collection_name, collection_doi,
+        collection_file_count as file_count,
+        collection_description
+    from collection
+    where collection_slug = $1
+"""
 
 
 @router.get("/{collection_slug}", response_model=CollectionInfo)
 async def get_collection_info(
-    collection_slug: str, db: Database = Depends()
+    collection_slug: str,
+    request: Request,
+    response: Response,
+    db: Database = Depends(),
 ) -> CollectionSummary:
-    query = """
-        select
-            collection.collection_id, collection_slug,
-            collection_name, collection_doi,
-            count(file_id) as file_count,
-            collection_description
-        from collection
-        natural join version
-        left join version_file
-            on version.version_id = version_file.version_id
-        where collection_slug = $1
-        group by collection.collection_id
-    """
+    async def fetch():
+        return await db.fetch_one(collection_info_query, [collection_slug])
 
-    return await db.fetch_one(query, [collection_slug])
+    return await collection_responses.respond(
+        collection_slug, request, response, db, fetch, CollectionInfo, many=False
+    )
 
 
 @router.post("/")
@@ -102,6 +266,7 @@ async def create_collection(
     collection_slug: str,
     collection_name: str,
     collection_doi: str,
+    user: User = logged_in_user,
     db: Database = Depends(),
 ):
     slug_re = re.compile(r"[-_a-zA-Z0-9]+")
@@ -131,6 +296,7 @@ async def create_collection(
             ($1)
         """
         await db.fetch(query, [collection_id])
+        await cache.invalidate(db, "collection_id", collection_slug)
         return collection_id
     except UniqueViolationError:
         raise HTTPException(
@@ -145,7 +311,10 @@ class CollectionDescription(BaseModel):
 
 @router.post("/{collection_slug}", response_model=CollectionInfo)
 async def update_collection_description(
-    collection_slug: str, collection: CollectionDescription, db: Database = Depends()
+    collection_slug: str,
+    collection: CollectionDescription,
+    user: User = logged_in_user,
+    db: Database = Depends(),
 ) -> CollectionInfo:
     collection_id = await get_collection_id_from_slug(collection_slug, db)
     query = """
@@ -154,4 +323,5 @@ async def update_collection_description(
         where collection_id = $1
     """
     await db.fetch(query, [collection_id, collection.collection_description])
-    return await get_collection_info(collection_slug, db)
+    await cache.invalidate(db, "collection_response", collection_slug)
+    return await db.fetch_one(collection_info_query, [collection_slug])
@@ -7,7 +7,10 @@ router = APIRouter()
 
 from .auth import logged_in_user, User
 
-from ..util import Database
+from ..util import Database, cache
+from ..util.db import prepared
+from ..util.pagination import KeysetPage, keyset_page
+from ..util.serialization import json_records
 
 
 class DataManagerInfo(BaseModel):
@@ -15,20 +18,51 @@ class DataManagerInfo(BaseModel):
     data_manager_name: str
 
 
+data_manager_ids = cache.shared_cache("data_manager_id")
+data_manager_id_query = prepared(
+    "select data_manager_id from data_manager where data_manager_name = $1"
+)
+
+
 async def get_data_manager_id_from_name(data_manager_name: str, db: Database):
-    query = "select data_manager_id from data_manager where data_manager_name = $1"
-    data_manager = await db.fetch_one(query, [data_manager_name])
+    data_manager_id = data_manager_ids.get(data_manager_name)
+    if data_manager_id is not None:
+        return data_manager_id
+    generation = data_manager_ids.generation
+    data_manager = await db.fetch_one(data_manager_id_query, [data_manager_name])
     if len(data_manager) < 1:
         raise HTTPException(
             detail=f"Data_manager {data_manager_name}, not found. Ensure it exists in the data_manager manager.",
             status_code=422,
         )
+    data_manager_ids.set(data_manager_name, data_manager["data_manager_id"], generation)
     return data_manager["data_manager_id"]
 
 
+async def get_data_manager_ids_from_names(data_manager_names: List[str], db: Database):
+    """Resolve several names in one query; unknown names are left out"""
+    found, missing = data_manager_ids.get_many(data_manager_names)
+    if not missing:
+        return found
+    generation = data_manager_ids.generation
+    query = """
+        select data_manager_name, data_manager_id
+        from data_manager
+        where data_manager_name = any($1)
+    """
+    for row in await db.fetch(query, [missing]):
+        found[row["data_manager_name"]] = row["data_manager_id"]
+        data_manager_ids.set(
+            row["data_manager_name"], row["data_manager_id"], generation
+        )
+    return found
+
+
 @router.get("/", response_model=List[DataManagerInfo])
 async def get_datamanagers(
-    data_manager_name: str = None, db: Database = Depends()
+    data_manager_name: str = None,
+    page: KeysetPage = Depends(keyset_page("data_manager_id")),
+    db: Database = Depends(),
 ) -> List[DataManagerInfo]:
     if data_manager_name:
         query = """
@@ -40,17 +74,22 @@ async def get_datamanagers(
         """
         return await db.fetch(query, [data_manager_name])
 
-    query = """
+    parameters = []
+    query = f"""
         select
             data_manager_id, data_manager_name
         from data_manager
+        where {page.where(parameters)}
+        {page.order_limit(parameters)}
     """
-    return await db.fetch(query)
+    records = page.finish(await db.fetch(query, parameters))
+    return json_records(records, DataManagerInfo, page.response)
 
 
 @router.post("/")
 async def create_datamanager(
     data_manager_name: str,
+    user: User = logged_in_user,
     db: Database = Depends(),
 ):
     query = """
@@ -66,6 +105,7 @@ async def create_datamanager(
             raise HTTPException(
                 detail=f"Failed to create data manager", status_code=422
             )
+        await cache.invalidate(db, "data_manager_id", data_manager_name)
         return data_manager["data_manager_id"]
     except UniqueViolationError:
         raise HTTPException(
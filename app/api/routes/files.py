@@ -1,19 +1,37 @@
-from fastapi import Depends, APIRouter, HTTPException, Request
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi import Depends, APIRouter, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Tuple
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-import requests
+from fastapi.responses import StreamingResponse
+from asyncpg.exceptions import ObjectNotInPrerequisiteStateError
+import json
 import os
+import re
 
 router = APIRouter()
 
 from .auth import logged_in_user, User
-from .collections import get_collection_id_from_slug
-from .datamanagers import get_data_manager_id_from_name
-from .versions import get_latest_version, add_file_to_version
-from .filetypes import get_or_create_file_type
+from .collections import (
+    collection_responses,
+    get_collection_id_from_slug,
+    get_collection_ids_from_slugs,
+)
+from .datamanagers import get_data_manager_id_from_name, get_data_manager_ids_from_names
+from .versions import (
+    get_latest_version,
+    get_latest_versions,
+    add_file_to_version,
+    frozen_version_error,
+    version_members,
+)
+from .filetypes import get_or_create_file_type, get_or_create_file_types
 
-from ..util import Database
+from ..util import Database, cache, export, jobs, upstream
+from ..util.db import ReadDatabase
+from ..util.conditional import published_version
+from ..util.pagination import KeysetPage, keyset_page
+from ..util.serialization import FAST_JSON, RecordsResponse, project
+from ..util.streaming import stream_records
 
 security = HTTPBasic()
 PATH_DB_HOST = os.environ.get("PATH_DB_HOST", "http://pathdb.127.0.0.1.nip.io:8080")
@@ -22,6 +40,10 @@ NBIA_HOST = os.environ.get("NBIA_HOST", "http://nbia.127.0.0.1.nip.io:8080")
 NBIA_INTERNAL = os.environ.get(
     "NBIA_INTERNAL", "http://nbia.127.0.0.1.nip.io:8080/nbia-api"
 )
+PATH_DB_DATA_MANAGER = "pathDB"
+PATH_DB_MIME = os.environ.get("PATH_DB_MIME", "application/vnd.pathdb.image")
+# Most file_ids accepted by one POST /files/batch
+FILE_BATCH_MAX = int(os.environ.get("FILE_BATCH_MAX", 1000))
 
 
 class FileInfo(BaseModel):
@@ -40,6 +62,25 @@ class FileUpload(BaseModel):
     mime: str
 
 
+class ImportRowError(BaseModel):
+    index: int
+    detail: str
+
+
+class BulkImportResult(BaseModel):
+    file_ids: List[Optional[int]]
+    errors: List[ImportRowError] = []
+
+
+class FileBatch(BaseModel):
+    file_ids: List[int] = Field(..., max_items=FILE_BATCH_MAX)
+
+
+class FileBatchResult(BaseModel):
+    files: List[Optional[FileInfo]]
+    missing: List[int] = []
+
+
 class PathDBImage(BaseModel):
     image_id: str
     subject_id: str
@@ -47,25 +88,39 @@ class PathDBImage(BaseModel):
     external_id: str
 
 
-@router.get("/sync/pathdb/{collection_slug}", response_model=List[PathDBImage])
-def sync_pathdb(
-    collection_slug: str,
-    request: Request,
-    credentials: HTTPBasicCredentials = Depends(security),
-) -> List[PathDBImage]:
-    auth = request.headers["Authorization"]
+class PathDBFile(BaseModel):
+    file_id: int
+    external_id: str
+
+
+class PathDBChange(BaseModel):
+    file_id: int
+    external_id: str
+    upstream_external_id: str
+
+
+class PathDBSyncResult(BaseModel):
+    version_id: int
+    added: int
+    unchanged: int
+    changed: List[PathDBChange] = []
+    removed: List[PathDBFile] = []
+
+
+def pathdb_slide_id(external_id: str) -> str:
+    """The PathDB node id of a viewer URL, or the URL itself if it has none"""
+    match = re.search(r"[?&]slideId=([^&]+)", external_id)
+    return match.group(1) if match else external_id
+
+
+async def fetch_pathdb_images(auth: str) -> List[PathDBImage]:
     url = f"{PATH_DB_INTERNAL}/listofimages"
     querystring = {"_format": "json"}
     headers = {"Authorization": auth}
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    if response.ok == False:
-        raise HTTPException(
-            detail=response.text,
-            status_code=response.status_code,
-        )
+    images = await upstream.get_json(url, params=querystring, headers=headers)
 
     ret = []
-    for row in response.json():
+    for row in images:
         nid = row["nid"][0]["value"]
         subject_id = row["clinicaltrialsubjectid"][0]["value"]
         image_id = row["imageid"][0]["value"]
@@ -81,83 +136,690 @@ def sync_pathdb(
     return ret
 
 
+@router.get("/sync/pathdb/{collection_slug}", response_model=List[PathDBImage])
+async def sync_pathdb(
+    collection_slug: str,
+    request: Request,
+    credentials: HTTPBasicCredentials = Depends(security),
+) -> List[PathDBImage]:
+    return await fetch_pathdb_images(request.headers["Authorization"])
+
+
+def registered_files_query(parameters: list, version_id: int) -> str:
+    """The files of data manager $1 in a version"""
+    return f"""
+        select file_id, external_id
+        from {version_members(parameters, version_id)}
+        natural join file
+        where data_manager_id = $1
+    """
+
+
+def diff_pathdb_images(
+    images: List[PathDBImage], registered: dict
+) -> Tuple[List[PathDBImage], List[PathDBChange], int]:
+    """Match PathDB images to registered files by slide id
+
+    registered maps slide ids to file rows; matched rows are popped from
+    it. Returns the images not registered yet, the files whose viewer URL
+    differs from PathDB and the number of unchanged files.
+    """
+    new_images = []
+    changed = []
+    unchanged = 0
+    for image in images:
+        file = registered.pop(pathdb_slide_id(image.external_id), None)
+        if file is None:
+            new_images.append(image)
+        elif file["external_id"] != image.external_id:
+            changed.append(
+                PathDBChange(
+                    file_id=file["file_id"],
+                    external_id=file["external_id"],
+                    upstream_external_id=image.external_id,
+                )
+            )
+        else:
+            unchanged += 1
+    return new_images, changed, unchanged
+
+
+@router.post("/sync/pathdb/{collection_slug}", response_model=PathDBSyncResult)
+async def ingest_pathdb(
+    collection_slug: str,
+    request: Request,
+    mime: str = PATH_DB_MIME,
+    credentials: HTTPBasicCredentials = Depends(security),
+    db: Database = Depends(),
+) -> PathDBSyncResult:
+    """Register new PathDB images in the latest version of a collection
+
+    The PathDB image list is diffed by slide id against the pathDB files
+    already in the latest version. Only images not yet registered are
+    inserted; registered files whose viewer URL differs from PathDB
+    (changed) or that PathDB no longer lists (removed) are reported but
+    left untouched. Re-syncing an unchanged collection writes nothing.
+
+    For a large collection, submit the images GET /files/sync/pathdb
+    returns as a pathdb_sync job instead.
+    """
+    images = await fetch_pathdb_images(request.headers["Authorization"])
+    collection_id = await get_collection_id_from_slug(collection_slug, db)
+    version_id = await get_latest_version(collection_id, collection_slug, db)
+    data_manager_id = await get_data_manager_id_from_name(PATH_DB_DATA_MANAGER, db)
+
+    parameters = [data_manager_id]
+    query = registered_files_query(parameters, version_id)
+    registered = {
+        pathdb_slide_id(row["external_id"]): row
+        for row in await db.fetch(query, parameters)
+    }
+    new_images, changed, unchanged = diff_pathdb_images(images, registered)
+    removed = [PathDBFile(**file) for file in registered.values()]
+
+    if new_images:
+        file_type_id = await get_or_create_file_type(mime, db)
+        try:
+            async with db.transaction() as conn:
+                await insert_files(
+                    conn,
+                    [
+                        (version_id, data_manager_id, file_type_id, image.external_id)
+                        for image in new_images
+                    ],
+                )
+        except ObjectNotInPrerequisiteStateError as e:
+            raise frozen_version_error(e)
+        await cache.invalidate(db, "collection_response", collection_slug)
+
+    return PathDBSyncResult(
+        version_id=version_id,
+        added=len(new_images),
+        unchanged=unchanged,
+        changed=changed,
+        removed=removed,
+    )
+
+
 @router.get("/sync/nbia/{collection_slug}")
-def sync_nbia(collection_slug: str, request: Request):
+async def sync_nbia(collection_slug: str, request: Request):
     url = f"{NBIA_INTERNAL}/services/v1/getSeries"
     querystring = {"Collection": collection_slug}
     headers = {
         "Accept": "application/json",
     }
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    if response.ok == False:
-        raise HTTPException(
-            detail=response.text,
-            status_code=response.status_code,
-        )
-    return response.json()
+    return await upstream.get_json(url, params=querystring, headers=headers)
+
+
+# An already registered file keeps its file_id and is only linked to the
+# version; the no-op update makes returning yield the existing row.
+import_file_query = """
+    insert into file
+    (data_manager_id, file_type_id, external_id)
+    values
+    ($1, $2, $3)
+    on conflict (data_manager_id, external_id)
+    do update set external_id = excluded.external_id
+    returning file_id
+"""
 
 
 @router.post("/import")
 async def import_file(
     upload: FileUpload,
+    user: User = logged_in_user,
     db: Database = Depends(),
 ):
     collection_id = await get_collection_id_from_slug(upload.collection_slug, db)
     version_id = await get_latest_version(collection_id, upload.collection_slug, db)
     data_manager_id = await get_data_manager_id_from_name(upload.data_manager_name, db)
     file_type_id = await get_or_create_file_type(upload.mime, db)
-    query = """
-        insert into file
-        (data_manager_id, file_type_id, external_id)
-        values
-        ($1, $2, $3)
-        returning file_id
-    """
     file = await db.fetch_one(
-        query, [data_manager_id, file_type_id, upload.external_id]
+        import_file_query, [data_manager_id, file_type_id, upload.external_id]
     )
     file_id = file["file_id"]
-    await add_file_to_version(file_id, version_id, db)
+    await add_file_to_version(file_id, version_id, db, user)
     return file_id
 
 
-@router.get("/{collection_slug}/{version_id}", response_model=List[FileInfo])
-async def get_all_files(
-    collection_slug: str, version_id: int, db: Database = Depends()
-) -> List[FileInfo]:
-    query = """
+async def insert_files(conn, rows: list) -> List[int]:
+    """Load (version_id, data_manager_id, file_type_id, external_id) rows
+
+    Registers the files and links them to their versions on a connection
+    that is already inside a transaction, returning the file_ids in row
+    order. Files already registered under the same data manager and
+    external_id are reused, and links that already exist are skipped, so
+    importing the same rows twice changes nothing.
+    """
+    # COPY cannot upsert, so the rows are staged in a temporary table and
+    # merged from there.
+    await conn.execute(
+        """
+        create temporary table file_upload (
+            position integer,
+            version_id integer,
+            data_manager_id integer,
+            file_type_id integer,
+            external_id text
+        ) on commit drop
+        """
+    )
+    await conn.copy_records_to_table(
+        "file_upload",
+        columns=[
+            "position",
+            "version_id",
+            "data_manager_id",
+            "file_type_id",
+            "external_id",
+        ],
+        records=[(position, *row) for position, row in enumerate(rows)],
+    )
+    # The first row of a file repeated within the upload picks its type
+    await conn.execute(
+        """
+        insert into file (data_manager_id, file_type_id, external_id)
+        select distinct on (data_manager_id, external_id)
+            data_manager_id, file_type_id, external_id
+        from file_upload
+        order by data_manager_id, external_id, position
+        on conflict (data_manager_id, external_id) do nothing
+        """
+    )
+    uploaded = await conn.fetch(
+        """
+        select file.file_id
+        from file_upload
+        join file
+            on file.data_manager_id = file_upload.data_manager_id
+           and file.external_id = file_upload.external_id
+        order by position
+        """
+    )
+    await conn.execute(
+        """
+        select added.file_id
+        from (
+            select version_id, array_agg(distinct file.file_id) as file_ids
+            from file_upload
+            join file
+                on file.data_manager_id = file_upload.data_manager_id
+               and file.external_id = file_upload.external_id
+            group by version_id
+            order by version_id
+        ) upload,
+        lateral add_version_files(upload.version_id, upload.file_ids) as added(file_id)
+        """
+    )
+    return [row["file_id"] for row in uploaded]
+
+
+async def read_uploads(request: Request) -> list:
+    """Parse a JSON array or NDJSON request body
+
+    Returns one entry per upload, either a FileUpload or an error string
+    describing why that row could not be parsed.
+    """
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        rows = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:
+                rows.append(f"Invalid JSON: {e}")
+    else:
+        try:
+            rows = json.loads(body)
+        except ValueError as e:
+            raise HTTPException(detail=f"Invalid JSON: {e}", status_code=422)
+        if not isinstance(rows, list):
+            raise HTTPException(
+                detail="Expected a JSON array of uploads", status_code=422
+            )
+
+    uploads = []
+    for row in rows:
+        if isinstance(row, str):
+            uploads.append(row)
+            continue
+        try:
+            uploads.append(FileUpload.parse_obj(row))
+        except ValidationError as e:
+            uploads.append(
+                "; ".join(
+                    f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+                    for error in e.errors()
+                )
+            )
+    return uploads
+
+
+async def resolve_uploads(
+    uploads: list, db: Database
+) -> Tuple[list, List[ImportRowError]]:
+    """Resolve (index, FileUpload) pairs to rows for insert_files
+
+    Collection slugs, data managers and mime types are looked up once for
+    all of them. Returns (index, upload, row) triples and an error for
+    each upload that cannot be imported, including those for collections
+    whose latest version is published. The version_file trigger still
+    rejects the batch if one is published in the meantime.
+    """
+    collection_ids = await get_collection_ids_from_slugs(
+        {upload.collection_slug for _, upload in uploads}, db
+    )
+    latest_versions = await get_latest_versions(collection_ids.values(), db)
+    data_manager_ids = await get_data_manager_ids_from_names(
+        {upload.data_manager_name for _, upload in uploads}, db
+    )
+
+    resolved = []
+    errors = []
+    for index, upload in uploads:
+        collection_id = collection_ids.get(upload.collection_slug)
+        if collection_id is None:
+            detail = f"Invalid collection slug: {upload.collection_slug}"
+        elif collection_id not in latest_versions:
+            detail = f"No version exists for collection: {upload.collection_slug}"
+        elif latest_versions[collection_id].published_on is not None:
+            version_id = latest_versions[collection_id].version_id
+            detail = f"Version {version_id} of {upload.collection_slug} is published. Create a new version to make changes."
+        elif upload.data_manager_name not in data_manager_ids:
+            detail = f"Data_manager {upload.data_manager_name}, not found. Ensure it exists in the data_manager manager."
+        else:
+            resolved.append((index, upload))
+            continue
+        errors.append(ImportRowError(index=index, detail=detail))
+
+    if not resolved:
+        return [], errors
+    file_type_ids = await get_or_create_file_types(
+        {upload.mime for _, upload in resolved}, db
+    )
+    return [
+        (
+            index,
+            upload,
+            (
+                latest_versions[collection_ids[upload.collection_slug]].version_id,
+                data_manager_ids[upload.data_manager_name],
+                file_type_ids[upload.mime],
+                upload.external_id,
+            ),
+        )
+        for index, upload in resolved
+    ], errors
+
+
+# The bulk route reads its body itself to take NDJSON as well, so its
+# request body is described for the docs here
+bulk_import_body = {
+    "required": True,
+    "content": {
+        "application/json": {
+            "schema": {"type": "array", "items": FileUpload.schema()},
+        },
+        "application/x-ndjson": {
+            "schema": {
+                **FileUpload.schema(),
+                "description": "One upload per line",
+            },
+        },
+    },
+}
+
+
+@router.post(
+    "/import/bulk",
+    response_model=BulkImportResult,
+    openapi_extra={"requestBody": bulk_import_body},
+)
+async def import_files(
+    request: Request,
+    user: User = logged_in_user,
+    db: Database = Depends(),
+) -> BulkImportResult:
+    """Import many files at once from a JSON array or NDJSON body
+
+    Collection slugs, data managers and mime types are resolved once per
+    batch and the rows are loaded with COPY in a single transaction.
+    file_ids are returned in input order, rows that could not be imported
+    are null and described in errors.
+    """
+    uploads = await read_uploads(request)
+    file_ids = [None] * len(uploads)
+    errors = []
+
+    valid = []
+    for index, upload in enumerate(uploads):
+        if isinstance(upload, str):
+            errors.append(ImportRowError(index=index, detail=upload))
+        else:
+            valid.append((index, upload))
+
+    resolved, unresolved = await resolve_uploads(valid, db)
+    errors.extend(unresolved)
+    if resolved:
+        try:
+            async with db.transaction() as conn:
+                new_ids = await insert_files(conn, [row for *_, row in resolved])
+        except ObjectNotInPrerequisiteStateError as e:
+            raise frozen_version_error(e)
+        for collection_slug in {upload.collection_slug for _, upload, _ in resolved}:
+            await cache.invalidate(db, "collection_response", collection_slug)
+        for file_id, (index, *_) in zip(new_ids, resolved):
+            file_ids[index] = file_id
+
+    errors.sort(key=lambda error: error.index)
+    return BulkImportResult(file_ids=file_ids, errors=errors)
+
+
+class ImportJob(BaseModel):
+    uploads: List[FileUpload] = Field(..., min_items=1)
+
+
+# Row errors kept in an import job's result; the rest are only counted
+MAX_JOB_ERRORS = 100
+
+
+@jobs.register("import", ImportJob, total=lambda params: len(params.uploads))
+async def import_chunk(conn, job: jobs.Job, db: Database) -> jobs.Step:
+    """Import the next CHUNK_SIZE uploads of an import job
+
+    The result counts the imported rows and lists the first MAX_JOB_ERRORS
+    rows that could not be imported, by index into uploads.
+    """
+    position = job.cursor["position"] if job.cursor else 0
+    chunk = job.params.uploads[position : position + jobs.CHUNK_SIZE]
+    resolved, errors = await resolve_uploads(list(enumerate(chunk, position)), db)
+    if resolved:
+        await insert_files(conn, [row for *_, row in resolved])
+        for collection_slug in {upload.collection_slug for _, upload, _ in resolved}:
+            await cache.invalidate_on_commit(
+                conn, "collection_response", collection_slug
+            )
+
+    result = dict(job.result or {"imported": 0, "error_count": 0, "errors": []})
+    result["imported"] += len(resolved)
+    result["error_count"] += len(errors)
+    room = MAX_JOB_ERRORS - len(result["errors"])
+    result["errors"] = result["errors"] + [error.dict() for error in errors[:room]]
+    position += len(chunk)
+    return jobs.Step(
+        cursor={"position": position},
+        progress=position,
+        result=result,
+        done=position >= len(job.params.uploads),
+    )
+
+
+class PathDBSyncJob(BaseModel):
+    collection_slug: str
+    mime: str = PATH_DB_MIME
+    images: List[PathDBImage] = Field(..., min_items=1)
+
+
+# Changed and removed files listed in a pathdb_sync job's result; the rest
+# are only counted
+MAX_JOB_CHANGES = 100
+
+
+@jobs.register("pathdb_sync", PathDBSyncJob, total=lambda params: len(params.images))
+async def pathdb_sync_chunk(conn, job: jobs.Job, db: Database) -> jobs.Step:
+    """Register the next CHUNK_SIZE images of a pathdb_sync job
+
+    Does what POST /files/sync/pathdb does, in chunks, for images fetched
+    beforehand with the caller's PathDB credentials, which the job does
+    not keep. The version is the collection's latest when the job starts.
+    """
+    params = job.params
+    if job.cursor:
+        position, version_id = job.cursor["position"], job.cursor["version_id"]
+    else:
+        collection_id = await get_collection_id_from_slug(params.collection_slug, db)
+        position = 0
+        version_id = await get_latest_version(collection_id, params.collection_slug, db)
+    data_manager_id = await get_data_manager_id_from_name(PATH_DB_DATA_MANAGER, db)
+
+    parameters = [data_manager_id]
+    query = registered_files_query(parameters, version_id)
+    registered = {
+        pathdb_slide_id(row["external_id"]): row
+        for row in await conn.fetch(query, *parameters)
+    }
+    chunk = params.images[position : position + jobs.CHUNK_SIZE]
+    new_images, changed, unchanged = diff_pathdb_images(chunk, registered)
+    if new_images:
+        file_type_id = await get_or_create_file_type(params.mime, db)
+        await insert_files(
+            conn,
+            [
+                (version_id, data_manager_id, file_type_id, image.external_id)
+                for image in new_images
+            ],
+        )
+        await cache.invalidate_on_commit(
+            conn, "collection_response", params.collection_slug
+        )
+    position += len(chunk)
+    done = position >= len(params.images)
+
+    result = dict(
+        job.result
+        or {
+            "version_id": version_id,
+            "added": 0,
+            "unchanged": 0,
+            "changed_count": 0,
+            "changed": [],
+            "removed_count": 0,
+            "removed": [],
+        }
+    )
+    result["added"] += len(new_images)
+    result["unchanged"] += unchanged
+    result["changed_count"] += len(changed)
+    room = MAX_JOB_CHANGES - len(result["changed"])
+    result["changed"] = result["changed"] + [change.dict() for change in changed[:room]]
+    if done:
+        # Files matched by earlier chunks are still in registered
+        listed = {pathdb_slide_id(image.external_id) for image in params.images}
+        removed = [
+            PathDBFile(**file).dict()
+            for slide_id, file in registered.items()
+            if slide_id not in listed
+        ]
+        result["removed_count"] = len(removed)
+        result["removed"] = removed[:MAX_JOB_CHANGES]
+    return jobs.Step(
+        cursor={"position": position, "version_id": version_id},
+        progress=position,
+        result=result,
+        done=done,
+    )
+
+
+def files_page_query(parameters: list, version_id: int, page: KeysetPage) -> str:
+    """A page of the files of version $2 of the collection whose slug is $1"""
+    # The page is resolved inside version_members, in file_id order. A file
+    # whose type is in several groups has a row per group, so the page
+    # starts at the cursor's file, which may still have rows left, and
+    # takes one more file than rows in case all of those were sent already.
+    after = None if page.after is None else page.after - 1
+    rows = None if page.limit is None else page.limit + 2
+    members = version_members(parameters, version_id, after, rows)
+    return f"""
         select
             file_id, data_manager_id,
             mime_type, external_id,
             data_manager_name, file_type_group_name
         from version
-        natural join version_file
-        natural join file
         natural join collection
+        cross join {members}
+        natural join file
         natural join data_manager
         natural join file_type
         left join file_type_group
             on file_type.file_type_id = file_type_group.file_type_id
         where collection_slug = $1
             and version.version_id = $2
+            and {page.where(parameters)}
+        {page.order_limit(parameters)}
+    """
+
+
+@router.get("/{collection_slug}/{version_id}", response_model=List[FileInfo])
+async def get_all_files(
+    collection_slug: str,
+    version_id: int,
+    request: Request,
+    stream: Optional[str] = Query(
+        None,
+        regex="^(ndjson|json)$",
+        description="Stream all rows from a server-side cursor as NDJSON or as an incrementally written JSON array; cannot be combined with limit or after",
+    ),
+    page: KeysetPage = Depends(keyset_page("file_id", tiebreak="file_type_group_name")),
+    not_modified: Optional[Response] = Depends(published_version),
+    db: Database = Depends(),
+) -> List[FileInfo]:
+    if not_modified:
+        return not_modified
+    if stream and (page.limit is not None or page.after is not None):
+        raise HTTPException(
+            detail="stream returns the whole version and cannot be combined with limit or after",
+            status_code=422,
+        )
+    parameters = [collection_slug, version_id]
+    query = files_page_query(parameters, version_id, page)
+
+    if stream:
+        return stream_records(
+            db.iterate(query, parameters), stream, headers=page.response.headers
+        )
+
+    async def fetch():
+        return page.finish(await db.fetch(query, parameters))
+
+    return await collection_responses.respond(
+        collection_slug, request, page.response, db, fetch, FileInfo
+    )
+
+
+manifest_query = """
+    select
+        file_id, data_manager_id,
+        mime_type, external_id,
+        data_manager_name, file_type_group_name
+    from version
+    natural join collection
+    cross join version_members($2) as member(file_id)
+    natural join file
+    natural join data_manager
+    natural join file_type
+    left join file_type_group
+        on file_type.file_type_id = file_type_group.file_type_id
+    where collection_slug = $1
+        and version.version_id = $2
+    order by file_id
+"""
+
+
+@router.get(
+    "/{collection_slug}/{version_id}/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {export.CSV: {}, export.ARROW: {}}}},
+)
+async def export_files(
+    collection_slug: str,
+    version_id: int,
+    request: Request,
+    db: Database = Depends(),
+):
+    """Stream a version's manifest as CSV or as an Arrow IPC stream
+
+    The format is chosen from the Accept header: text/csv (the default) is
+    produced by Postgres with COPY, application/vnd.apache.arrow.stream is
+    written in record batches read from a server-side cursor. Either way
+    the manifest is never held in memory as a whole.
+    """
+    media_type = export.negotiate(request.headers.get("accept"))
+    if media_type is None:
+        raise HTTPException(
+            detail=f"Export is available as {', '.join(export.available())}",
+            status_code=406,
+        )
+
+    parameters = [collection_slug, version_id]
+    if media_type == export.CSV:
+        body = db.copy_out(manifest_query, parameters, format="csv", header=True)
+        filename = f"{collection_slug}-{version_id}.csv"
+    else:
+        body = export.arrow_stream(
+            db.batches(manifest_query, parameters), manifest_schema()
+        )
+        filename = f"{collection_slug}-{version_id}.arrows"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def manifest_schema():
+    pa = export.pyarrow
+    return pa.schema(
+        [
+            pa.field("file_id", pa.int32(), nullable=False),
+            pa.field("data_manager_id", pa.int32(), nullable=False),
+            pa.field("mime_type", pa.string(), nullable=False),
+            pa.field("external_id", pa.string(), nullable=False),
+            pa.field("data_manager_name", pa.string(), nullable=False),
+            pa.field("file_type_group_name", pa.string()),
+        ]
+    )
+
+
+file_info_query = """
+    select
+        file_id, data_manager_id,
+        mime_type, external_id,
+        data_manager_name, file_type_group_name
+    from file
+    natural join data_manager
+    natural join file_type
+    left join file_type_group
+        on file_type.file_type_id = file_type_group.file_type_id
+"""
+
+
+@router.post("/batch", response_model=FileBatchResult)
+async def get_files(batch: FileBatch, db: ReadDatabase = Depends()) -> FileBatchResult:
+    """Look up many files by file_id in one query
+
+    files follows the order of file_ids, with null for ids that do not
+    exist; those ids are also listed in missing. At most FILE_BATCH_MAX
+    ids are accepted per request.
     """
+    query = f"{file_info_query} where file_id = any($1)"
+    found = {}
+    for record in await db.fetch(query, [list(set(batch.file_ids))]):
+        found.setdefault(record["file_id"], record)
+    files = [found.get(file_id) for file_id in batch.file_ids]
+    missing = [file_id for file_id in batch.file_ids if file_id not in found]
+    if FAST_JSON:
+        row = project(FileInfo)
+        files = [None if record is None else row(record) for record in files]
+        return RecordsResponse({"files": files, "missing": missing})
+    return {"files": files, "missing": missing}
+
 
-    return await db.fetch(query, [collection_slug, version_id])
+file_by_id_query = f"{file_info_query} where file_id = $1"
 
 
 @router.get("/{file_id}", response_model=FileInfo)
 async def get_file(file_id: int, db: Database = Depends()) -> FileInfo:
-    query = """
-        select
-            file_id, data_manager_id,
-            mime_type, external_id,
-            data_manager_name, file_type_group_name
-        from file
-        natural join data_manager
-        natural join file_type
-        left join file_type_group
-            on file_type.file_type_group_id = file_type_group.file_type_group_id
-        where file_id = $1
-    """
-
-    return await db.fetch_one(query, [file_id])
+    return await db.fetch_one(file_by_id_query, [file_id])
@@ -7,7 +7,10 @@ router = APIRouter()
 
 from .auth import logged_in_user, User
 
-from ..util import Database
+from ..util import Database, cache
+from ..util.db import prepared
+from ..util.pagination import KeysetPage, keyset_page
+from ..util.serialization import json_records
 
 
 class FileTypeInfo(BaseModel):
@@ -21,9 +24,16 @@ class FileTypeGroupInfo(BaseModel):
     file_type_group_name: str
 
 
+file_type_ids = cache.shared_cache("file_type_id")
+file_type_id_query = prepared("select file_type_id from file_type where mime_type = $1")
+
+
 async def get_or_create_file_type(mime_type: str, db: Database):
-    query = "select file_type_id from file_type where mime_type = $1"
-    file_type = await db.fetch_one(query, [mime_type])
+    file_type_id = file_type_ids.get(mime_type)
+    if file_type_id is not None:
+        return file_type_id
+    generation = file_type_ids.generation
+    file_type = await db.fetch_one(file_type_id_query, [mime_type])
     if len(file_type) < 1:
         try:
             query = """
@@ -35,14 +45,42 @@ async def get_or_create_file_type(mime_type: str, db: Database):
             """
             file_type = await db.fetch_one(query, [mime_type])
         except UniqueViolationError:
-            query = "select file_type_id from file_type where mime_type = $1"
-            file_type = await db.fetch_one(query, [mime_type])
+            file_type = await db.fetch_one(file_type_id_query, [mime_type])
+    file_type_ids.set(mime_type, file_type["file_type_id"], generation)
     return file_type["file_type_id"]
 
 
+async def get_or_create_file_types(mime_types: List[str], db: Database):
+    """Batch version of get_or_create_file_type, returns {mime_type: file_type_id}"""
+    found, missing = file_type_ids.get_many(mime_types)
+    if not missing:
+        return found
+    generation = file_type_ids.generation
+    query = """
+        insert into file_type
+        (mime_type)
+        select unnest($1::text[])
+        on conflict do nothing
+    """
+    await db.execute(query, [missing])
+    query = """
+        select mime_type, file_type_id
+        from file_type
+        where mime_type = any($1)
+    """
+    for row in await db.fetch(query, [missing]):
+        found[row["mime_type"]] = row["file_type_id"]
+        file_type_ids.set(row["mime_type"], row["file_type_id"], generation)
+    return found
+
+
 @router.get("/", response_model=List[FileTypeInfo])
 async def get_filetypes(
-    mime_type: str = None, db: Database = Depends()
+    mime_type: str = None,
+    page: KeysetPage = Depends(
+        keyset_page("file_type.file_type_id", tiebreak="file_type_group_name")
+    ),
+    db: Database = Depends(),
 ) -> List[FileTypeInfo]:
     if mime_type:
         query = """
@@ -56,14 +94,18 @@ async def get_filetypes(
         """
         return await db.fetch(query, [mime_type])
 
-    query = """
+    parameters = []
+    query = f"""
         select
-            file_type_id, file_type_group_name, mime_type
+            file_type.file_type_id, file_type_group_name, mime_type
         from file_type
         left join file_type_group
             on file_type.file_type_id = file_type_group.file_type_id
+        where {page.where(parameters)}
+        {page.order_limit(parameters)}
     """
-    return await db.fetch(query)
+    records = page.finish(await db.fetch(query, parameters))
+    return json_records(records, FileTypeInfo, page.response)
 
 
 @router.get("/groups", response_model=List[FileTypeGroupInfo])
@@ -94,6 +136,7 @@ async def get_filetype_groups(
 @router.post("/groups")
 async def create_filetype_group(
     group_name: str,
+    user: User = logged_in_user,
     db: Database = Depends(),
 ):
     query = """
@@ -119,6 +162,7 @@ async def create_filetype_group(
 async def add_filetype_to_group(
     file_type_id: int,
     file_type_group_id: int,
+    user: User = logged_in_user,
     db: Database = Depends(),
 ):
     query = """
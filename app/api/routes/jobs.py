@@ -0,0 +1,188 @@
+from fastapi import Depends, APIRouter, HTTPException, Query
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional
+from datetime import datetime
+import json
+
+router = APIRouter()
+
+from .auth import logged_in_user, User
+
+from ..util import Database, jobs
+from ..util.pagination import KeysetPage, keyset_page
+
+
+class JobRequest(BaseModel):
+    kind: str
+    params: dict = {}
+
+
+class JobInfo(BaseModel):
+    job_id: int
+    kind: str
+    state: str
+    progress: int
+    total: Optional[int] = None
+    params_summary: dict
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    created_by: Optional[str] = None
+    created_on: datetime
+    started_on: Optional[datetime] = None
+    finished_on: Optional[datetime] = None
+
+
+# job_params can hold a whole upload list, so only a summary is returned:
+# arrays are replaced by their length
+job_columns = """
+    job_id, job_kind, job_state, job_progress, job_total,
+    (
+        select jsonb_object_agg(
+            key,
+            case
+                when jsonb_typeof(value) = 'array' then to_jsonb(jsonb_array_length(value))
+                else value
+            end
+        )
+        from jsonb_each(job_params)
+    ) as job_params_summary,
+    job_result, job_error, job_cancel_requested,
+    job_created_by, job_created_on, job_started_on, job_finished_on
+"""
+
+
+def job_info(record) -> JobInfo:
+    return JobInfo(
+        job_id=record["job_id"],
+        kind=record["job_kind"],
+        state=record["job_state"],
+        progress=record["job_progress"],
+        total=record["job_total"],
+        params_summary=json.loads(record["job_params_summary"] or "{}"),
+        result=json.loads(record["job_result"]) if record["job_result"] else None,
+        error=record["job_error"],
+        cancel_requested=record["job_cancel_requested"],
+        created_by=record["job_created_by"],
+        created_on=record["job_created_on"],
+        started_on=record["job_started_on"],
+        finished_on=record["job_finished_on"],
+    )
+
+
+async def get_job_record(job_id: int, db: Database):
+    job = await db.fetch_one(
+        f"select {job_columns} from job where job_id = $1", [job_id]
+    )
+    if len(job) < 1:
+        raise HTTPException(detail=f"Invalid job id: {job_id}", status_code=422)
+    return job
+
+
+@router.post("/", response_model=JobInfo, status_code=202)
+async def submit_job(
+    job: JobRequest, user: User = logged_in_user, db: Database = Depends()
+) -> JobInfo:
+    """Queue a long-running operation for the job workers
+
+    Kinds and their params:
+    - import: {"uploads": [...]} with the rows POST /files/import/bulk
+      takes; the result counts imported rows and lists row errors. The
+      NBIA series GET /files/sync/nbia returns are not such rows.
+    - clone_version: {"collection_slug", "parent_version_id", and
+      optionally "name", "description", "data_manager_name", "mime_type"}
+      as for POST /versions/{collection_slug}; the result holds the new
+      version_id.
+    - pathdb_sync: {"collection_slug", "images", and optionally "mime"}
+      with the images GET /files/sync/pathdb/{collection_slug} returns;
+      registers them like POST /files/sync/pathdb/{collection_slug}, and
+      the result has the same counts with at most 100 changed and removed
+      files listed.
+
+    Poll GET /jobs/{job_id} for state and progress. Jobs are reported
+    with a summary of their params, in which lists are replaced by their
+    length.
+    """
+    kind = jobs.kinds.get(job.kind)
+    if kind is None:
+        raise HTTPException(
+            detail=f"Unknown job kind: {job.kind}. Available: {', '.join(sorted(jobs.kinds))}",
+            status_code=422,
+        )
+    try:
+        params = kind.params.parse_obj(job.params)
+    except ValidationError as e:
+        raise HTTPException(detail=e.errors(), status_code=422)
+    query = f"""
+        insert into job
+        (job_kind, job_params, job_total, job_created_by)
+        values
+        ($1, $2, $3, $4)
+        returning {job_columns}
+    """
+    total = kind.total(params) if kind.total else None
+    record = await db.fetch_one(query, [job.kind, params.json(), total, user.username])
+    return job_info(record)
+
+
+@router.get("/", response_model=List[JobInfo])
+async def get_jobs(
+    state: Optional[str] = Query(
+        None, regex="^(queued|running|done|failed|cancelled)$"
+    ),
+    page: KeysetPage = Depends(keyset_page("job_id", descending=True)),
+    user: User = logged_in_user,
+    db: Database = Depends(),
+) -> List[JobInfo]:
+    """Jobs, most recent first"""
+    parameters = []
+    conditions = [page.where(parameters)]
+    if state is not None:
+        parameters.append(state)
+        conditions.append(f"job_state = ${len(parameters)}")
+    query = f"""
+        select {job_columns}
+        from job
+        where {" and ".join(conditions)}
+        {page.order_limit(parameters)}
+    """
+    records = page.finish(await db.fetch(query, parameters))
+    return [job_info(record) for record in records]
+
+
+@router.get("/{job_id}", response_model=JobInfo)
+async def get_job(
+    job_id: int, user: User = logged_in_user, db: Database = Depends()
+) -> JobInfo:
+    return job_info(await get_job_record(job_id, db))
+
+
+@router.post("/{job_id}/cancel", response_model=JobInfo)
+async def cancel_job(
+    job_id: int, user: User = logged_in_user, db: Database = Depends()
+) -> JobInfo:
+    """Cancel a job
+
+    A queued job is cancelled straight away. A running one stops before
+    its next chunk; the chunks it already committed are kept.
+    """
+    query = f"""
+        update job
+        set job_cancel_requested = true,
+            job_state = case
+                when job_state = 'queued' then 'cancelled'
+                else job_state
+            end,
+            job_finished_on = case
+                when job_state = 'queued' then now()
+                else job_finished_on
+            end
+        where job_id = $1
+          and job_state in ('queued', 'running')
+        returning {job_columns}
+    """
+    record = await db.fetch_one(query, [job_id])
+    if len(record) < 1:
+        # Finished already, or no such job
+        record = await get_job_record(job_id, db)
+    return job_info(record)
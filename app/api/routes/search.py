@@ -0,0 +1,177 @@
+from fastapi import Depends, APIRouter, Query
+from typing import List, Optional
+import os
+
+router = APIRouter()
+
+from .collections import CollectionInfo
+from .files import FileInfo
+
+from ..util import Database
+from ..util.pagination import RankedPage, ranked_page
+from ..util.serialization import json_records
+
+
+# Substring matches ranked per file search. A broad fragment can match
+# most of the file table, and ranking it all would cost seconds, so only
+# this many of the most similar matches, taken nearest first from the
+# trigram index, are ranked and X-Search-Truncated is set beyond it.
+MAX_FILE_CANDIDATES = int(os.environ.get("SEARCH_MAX_FILE_CANDIDATES", 10000))
+
+
+class CollectionMatch(CollectionInfo):
+    rank: float
+
+
+class FileMatch(FileInfo):
+    rank: float
+
+
+def like_pattern(text: str) -> str:
+    """ILIKE pattern matching text anywhere, with wildcards escaped"""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def collection_search_query(parameters: list, page: RankedPage) -> str:
+    """A page of the collections matching $1, best first"""
+    return f"""
+        select * from (
+            select
+                collection_id, collection_slug,
+                collection_name, collection_doi,
+                collection_file_count as file_count,
+                collection_description,
+                greatest(
+                    ts_rank(collection_tsv, terms),
+                    word_similarity($1, collection_name)
+                ) as rank
+            from collection, websearch_to_tsquery('english', $1) as terms
+            where collection_tsv @@ terms
+               or $1 <% collection_name
+        ) ranked
+        where {page.where(parameters)}
+        {page.order_limit(parameters)}
+    """
+
+
+@router.get("/collections", response_model=List[CollectionMatch])
+async def search_collections(
+    q: str = Query(..., min_length=1, description="Words or a fragment of a name"),
+    page: RankedPage = Depends(ranked_page("rank", "collection_id")),
+    db: Database = Depends(),
+) -> List[CollectionMatch]:
+    """Search collection names and descriptions
+
+    Full-text matches (websearch syntax: quoted phrases, OR, -word) and
+    fuzzy trigram matches against words of the name are ranked together.
+    """
+    parameters = [q]
+    query = collection_search_query(parameters, page)
+    records = page.finish(await db.fetch(query, parameters))
+    return json_records(records, CollectionMatch, page.response)
+
+
+def file_search_query(
+    parameters: list,
+    q: str,
+    data_manager_name: Optional[str],
+    mime_type: Optional[str],
+    collection_slug: Optional[str],
+    page: RankedPage,
+) -> str:
+    """A page of the files matching q, best first, with the number of
+    candidate files ranked in each row
+
+    Like the file listings, a file has a row per group of its file type.
+    """
+    parameters.extend([q, like_pattern(q)])
+    conditions = ["external_id ilike $2"]
+    if data_manager_name is not None:
+        parameters.append(data_manager_name)
+        conditions.append(f"data_manager_name = ${len(parameters)}")
+    if mime_type is not None:
+        parameters.append(mime_type)
+        conditions.append(f"mime_type = ${len(parameters)}")
+    if collection_slug is not None:
+        parameters.append(collection_slug)
+        conditions.append(
+            f"""file_id in (
+                select file_id
+                from version_file
+                natural join version
+                natural join collection
+                where collection_slug = ${len(parameters)}
+                union all
+                select file_id
+                from version_delta
+                natural join version
+                natural join collection
+                where collection_slug = ${len(parameters)}
+                  and delta_added
+            )"""
+        )
+    # Candidates are files: the group join comes after the limit, so a file
+    # in several groups is ranked and counted once
+    return f"""
+        select * from (
+            select candidate.*, file_type_group_name
+            from (
+                select
+                    *,
+                    similarity(external_id, $1) as rank,
+                    count(*) over () as candidates
+                from (
+                    select
+                        file_id, data_manager_id, file_type_id,
+                        mime_type, external_id, data_manager_name
+                    from file
+                    natural join data_manager
+                    natural join file_type
+                    where {" and ".join(conditions)}
+                    order by external_id <-> $1, file_id desc
+                    limit {MAX_FILE_CANDIDATES}
+                ) candidate_file
+            ) candidate
+            left join file_type_group
+                on candidate.file_type_id = file_type_group.file_type_id
+        ) ranked
+        where {page.where(parameters)}
+        {page.order_limit(parameters)}
+    """
+
+
+@router.get("/files", response_model=List[FileMatch])
+async def search_files(
+    q: str = Query(
+        ...,
+        min_length=3,
+        description="Fragment of the external_id, e.g. a PathDB slide id",
+    ),
+    data_manager_name: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    collection_slug: Optional[str] = Query(
+        None, description="Only files in some version of this collection"
+    ),
+    page: RankedPage = Depends(
+        ranked_page("rank", "file_id", tiebreak="file_type_group_name")
+    ),
+    db: Database = Depends(),
+) -> List[FileMatch]:
+    """Search file external_ids by substring
+
+    Matches are ranked by trigram similarity, so the closest external_ids
+    come first. The substring filter is served by a trigram index, which
+    is why at least three characters are required. Only the
+    MAX_FILE_CANDIDATES most similar matches are ranked; X-Search-Truncated:
+    true means there were more and the fragment should be narrowed.
+    """
+    parameters = []
+    query = file_search_query(
+        parameters, q, data_manager_name, mime_type, collection_slug, page
+    )
+    records = await db.fetch(query, parameters)
+    if records and records[0]["candidates"] >= MAX_FILE_CANDIDATES:
+        page.response.headers["X-Search-Truncated"] = "true"
+    records = page.finish(records)
+    return json_records(records, FileMatch, page.response)
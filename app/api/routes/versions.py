@@ -1,15 +1,31 @@
 from fastapi import Depends, APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 from datetime import datetime
-from asyncpg.exceptions import UniqueViolationError, ForeignKeyViolationError
+import os
+from asyncpg.exceptions import (
+    UniqueViolationError,
+    ForeignKeyViolationError,
+    ObjectNotInPrerequisiteStateError,
+)
 
 router = APIRouter()
 
 from .auth import logged_in_user, User
 from .collections import get_collection_id_from_slug
 
-from ..util import Database
+from ..util import Database, cache, jobs
+from ..util.db import prepared
+from ..util.pagination import KeysetPage, keyset_page
+from ..util.serialization import json_records
+
+
+# How a version cloned from a parent stores its files: "delta" records the
+# parent and the files added or removed, "full" copies every file row
+VERSION_STORAGE = os.environ.get("VERSION_STORAGE", "delta")
+# Every this many versions down a chain of deltas is stored in full again,
+# bounding the deltas a read has to resolve
+SNAPSHOT_INTERVAL = int(os.environ.get("VERSION_SNAPSHOT_INTERVAL", 10))
 
 
 class VersionInfo(BaseModel):
@@ -18,32 +34,182 @@ class VersionInfo(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     created_on: datetime
+    published_on: Optional[datetime] = None
+
+
+class LatestVersion(NamedTuple):
+    version_id: int
+    published_on: Optional[datetime]
+
+
+# collection_id -> LatestVersion, invalidated when a collection gains a
+# version or its latest version is published
+latest_versions = cache.shared_cache("latest_version")
+latest_version_query = prepared(
+    """
+    select version_id, published_on
+    from version
+    where version_id = (
+        select max(version_id) from version where collection_id = $1
+    )
+    """
+)
 
 
 async def get_latest_version(collection_id: id, collection_slug: str, db: Database):
-    query = "select max(version_id) as version_id from version where collection_id = $1"
-    version = await db.fetch_one(query, [collection_id])
+    latest = latest_versions.get(collection_id)
+    if latest is not None:
+        return latest.version_id
+    generation = latest_versions.generation
+    version = await db.fetch_one(latest_version_query, [collection_id])
     if len(version) < 1:
         raise HTTPException(
             detail=f"No version exists for collection: {collection_slug}",
             status_code=422,
         )
+    latest_versions.set(collection_id, LatestVersion(**version), generation)
     return version["version_id"]
 
 
-@router.get("/{collection_slug}", response_model=List[VersionInfo])
-async def get_filetypes(
-    collection_slug: str, db: Database = Depends()
-) -> List[VersionInfo]:
+async def get_latest_versions(collection_ids: List[int], db: Database):
+    """Batch version of get_latest_version, returns {collection_id: LatestVersion}"""
+    found, missing = latest_versions.get_many(collection_ids)
+    if not missing:
+        return found
+    generation = latest_versions.generation
     query = """
+        select distinct on (collection_id) collection_id, version_id, published_on
+        from version
+        where collection_id = any($1)
+        order by collection_id, version_id desc
+    """
+    for row in await db.fetch(query, [missing]):
+        latest = LatestVersion(row["version_id"], row["published_on"])
+        found[row["collection_id"]] = latest
+        latest_versions.set(row["collection_id"], latest, generation)
+    return found
+
+
+def versions_query(parameters: list, page: KeysetPage) -> str:
+    """A page of the versions of the collection whose slug is $1"""
+    return f"""
         select
-           version_id, collection_id, name, description, created_on 
+           version_id, collection_id, name, description, created_on, published_on
         from version
         natural join collection
         where collection_slug = $1
-        order by version_id desc
+          and {page.where(parameters)}
+        {page.order_limit(parameters)}
+    """
+
+
+@router.get("/{collection_slug}", response_model=List[VersionInfo])
+async def get_filetypes(
+    collection_slug: str,
+    page: KeysetPage = Depends(keyset_page("version_id", descending=True)),
+    db: Database = Depends(),
+) -> List[VersionInfo]:
+    parameters = [collection_slug]
+    query = versions_query(parameters, page)
+    records = page.finish(await db.fetch(query, parameters))
+    return json_records(records, VersionInfo, page.response)
+
+
+def version_members(
+    parameters: list,
+    version_id: int,
+    after: Optional[int] = None,
+    max_rows: Optional[int] = None,
+) -> str:
+    """FROM item named member listing the file_ids of a version
+
+    Resolves delta versions as well as snapshots. Only the file_ids above
+    after, at most max_rows of them, are resolved: page through a version
+    with these rather than with a WHERE and LIMIT on top. The values are
+    appended to parameters.
     """
-    return await db.fetch(query, [collection_slug])
+    arguments = []
+    for value in (version_id, after or 0, max_rows):
+        if value is None:
+            break
+        parameters.append(value)
+        arguments.append(f"${len(parameters)}")
+    return f"version_members({', '.join(arguments)}) as member(file_id)"
+
+
+def version_files(
+    parameters: list,
+    version_id: int,
+    data_manager_name: Optional[str] = None,
+    mime_type: Optional[str] = None,
+    after: Optional[int] = None,
+) -> str:
+    """FROM and WHERE clauses selecting the file_ids of a version
+
+    Optionally only those of one data manager and/or mime type, and those
+    above after. The values are appended to parameters.
+    """
+    members = version_members(parameters, version_id, after)
+    joins = ["natural join file"]
+    conditions = ["true"]
+    if data_manager_name is not None:
+        parameters.append(data_manager_name)
+        joins.append("natural join data_manager")
+        conditions.append(f"data_manager_name = ${len(parameters)}")
+    if mime_type is not None:
+        parameters.append(mime_type)
+        joins.append("natural join file_type")
+        conditions.append(f"mime_type = ${len(parameters)}")
+    return f"""
+        from {members}
+        {" ".join(joins)}
+        where {" and ".join(conditions)}
+    """
+
+
+async def store_as_delta(
+    conn,
+    version_id: int,
+    parent_version_id: int,
+    data_manager_name: Optional[str] = None,
+    mime_type: Optional[str] = None,
+) -> bool:
+    """Store a new, empty version cloned from its parent as a delta of it
+
+    The files left out by the data manager and mime type filters become
+    its removed files. Returns False, leaving the version to be filled in
+    full, when VERSION_STORAGE is "full", when the parent ends a chain of
+    SNAPSHOT_INTERVAL - 1 deltas, or when the filters leave out so many
+    files that the delta would not be smaller than half the copy.
+    """
+    if VERSION_STORAGE != "delta":
+        return False
+    parent = await conn.fetchrow(
+        "select delta_depth, file_count from version where version_id = $1",
+        parent_version_id,
+    )
+    if parent["delta_depth"] + 1 >= SNAPSHOT_INTERVAL:
+        return False
+    removed = []
+    if data_manager_name is not None or mime_type is not None:
+        parameters = []
+        every = version_files(parameters, parent_version_id)
+        kept = version_files(
+            parameters, parent_version_id, data_manager_name, mime_type
+        )
+        removed = await conn.fetchval(
+            f"select array(select file_id {every} except select file_id {kept})",
+            *parameters,
+        )
+        if len(removed) * 2 >= parent["file_count"] - len(removed):
+            return False
+    await conn.execute(
+        "select store_version_delta($1, $2, $3)",
+        version_id,
+        parent_version_id,
+        removed,
+    )
+    return True
 
 
 @router.post("/{collection_slug}")
@@ -51,36 +217,258 @@ async def create_version(
     collection_slug: str,
     name: str = None,
     description: str = None,
+    parent_version_id: int = None,
+    data_manager_name: str = None,
+    mime_type: str = None,
+    user: User = logged_in_user,
     db: Database = Depends(),
 ):
+    """Create a new version, optionally cloned from parent_version_id
+
+    When cloning, the version gets the parent's files, optionally only
+    those of one data manager and/or mime type. With VERSION_STORAGE
+    "delta" it usually only records the files the filters leave out;
+    otherwise the files are copied with a single INSERT ... SELECT in the
+    same transaction that creates the version.
+    """
     collection_id = await get_collection_id_from_slug(collection_slug, db)
     query = """
         insert into version
-        (collection_id, name, description)
+        (collection_id, name, description, parent_version_id)
         values
-        ($1, $2, $3)
+        ($1, $2, $3, $4)
         returning version_id
     """
-    version = await db.fetch_one(query, [collection_id, name, description])
+    if parent_version_id is None:
+        version = await db.fetch_one(query, [collection_id, name, description, None])
+        await cache.invalidate(db, "latest_version", collection_id)
+        await cache.invalidate(db, "collection_response", collection_slug)
+        return version["version_id"]
+
+    async with db.transaction() as conn:
+        parent = await conn.fetchrow(
+            "select collection_id from version where version_id = $1",
+            parent_version_id,
+        )
+        if parent is None or parent["collection_id"] != collection_id:
+            raise HTTPException(
+                detail=f"Version {parent_version_id} is not a version of {collection_slug}",
+                status_code=422,
+            )
+        version = await conn.fetchrow(
+            query, collection_id, name, description, parent_version_id
+        )
+        stored = await store_as_delta(
+            conn,
+            version["version_id"],
+            parent_version_id,
+            data_manager_name,
+            mime_type,
+        )
+        if not stored:
+            parameters = [version["version_id"]]
+            files = version_files(
+                parameters, parent_version_id, data_manager_name, mime_type
+            )
+            query = f"""
+                insert into version_file
+                (version_id, file_id)
+                select $1, file_id
+                {files}
+            """
+            await conn.execute(query, *parameters)
+    await cache.invalidate(db, "latest_version", collection_id)
+    await cache.invalidate(db, "collection_response", collection_slug)
     return version["version_id"]
 
 
+class CloneVersionJob(BaseModel):
+    collection_slug: str
+    parent_version_id: int
+    name: Optional[str] = None
+    description: Optional[str] = None
+    data_manager_name: Optional[str] = None
+    mime_type: Optional[str] = None
+
+
+@jobs.register("clone_version", CloneVersionJob)
+async def clone_version_chunk(conn, job: jobs.Job, db: Database) -> jobs.Step:
+    """create_version with a parent, as a job copying CHUNK_SIZE files at a time
+
+    The first chunk creates the version; its version_id is in the job's
+    result from then on. A version stored as a delta is done right there.
+    Cancelling leaves the files copied so far.
+    """
+    params = job.params
+    if job.cursor is None:
+        collection_id = await get_collection_id_from_slug(params.collection_slug, db)
+        parent = await conn.fetchrow(
+            "select collection_id from version where version_id = $1",
+            params.parent_version_id,
+        )
+        if parent is None or parent["collection_id"] != collection_id:
+            raise HTTPException(
+                detail=f"Version {params.parent_version_id} is not a version of {params.collection_slug}",
+                status_code=422,
+            )
+        version = await conn.fetchrow(
+            """
+            insert into version
+            (collection_id, name, description, parent_version_id)
+            values
+            ($1, $2, $3, $4)
+            returning version_id
+            """,
+            collection_id,
+            params.name,
+            params.description,
+            params.parent_version_id,
+        )
+        await cache.invalidate_on_commit(conn, "latest_version", collection_id)
+        await cache.invalidate_on_commit(
+            conn, "collection_response", params.collection_slug
+        )
+        stored = await store_as_delta(
+            conn,
+            version["version_id"],
+            params.parent_version_id,
+            params.data_manager_name,
+            params.mime_type,
+        )
+        if stored:
+            total = await conn.fetchval(
+                "select file_count from version where version_id = $1",
+                version["version_id"],
+            )
+            return jobs.Step(
+                cursor={"version_id": version["version_id"]},
+                progress=total,
+                total=total,
+                result={"version_id": version["version_id"]},
+                done=True,
+            )
+        parameters = []
+        files = version_files(
+            parameters,
+            params.parent_version_id,
+            params.data_manager_name,
+            params.mime_type,
+        )
+        total = await conn.fetchval(f"select count(*) {files}", *parameters)
+        return jobs.Step(
+            cursor={"version_id": version["version_id"], "after": 0},
+            progress=0,
+            total=total,
+            result={"version_id": version["version_id"]},
+            done=total == 0,
+        )
+
+    parameters = [job.cursor["version_id"]]
+    files = version_files(
+        parameters,
+        params.parent_version_id,
+        params.data_manager_name,
+        params.mime_type,
+        after=job.cursor["after"],
+    )
+    # The version is the collection's latest from the first chunk on, so an
+    # import may have linked some of the parent's files to it already
+    query = f"""
+        with chunk as (
+            select file_id
+            {files}
+            order by file_id
+            limit {jobs.CHUNK_SIZE}
+        ),
+        copied as (
+            insert into version_file
+            (version_id, file_id)
+            select $1, file_id
+            from chunk
+            on conflict (version_id, file_id) do nothing
+        )
+        select count(*) as chunk_size, max(file_id) as last_file_id
+        from chunk
+    """
+    chunk = await conn.fetchrow(query, *parameters)
+    await cache.invalidate_on_commit(
+        conn, "collection_response", params.collection_slug
+    )
+    return jobs.Step(
+        cursor={
+            "version_id": job.cursor["version_id"],
+            "after": chunk["last_file_id"] or job.cursor["after"],
+        },
+        progress=job.progress + chunk["chunk_size"],
+        done=chunk["chunk_size"] < jobs.CHUNK_SIZE,
+    )
+
+
+def frozen_version_error(e: ObjectNotInPrerequisiteStateError) -> HTTPException:
+    """422 for a write rejected because its version is published"""
+    return HTTPException(
+        detail=f"{e}. Create a new version to make changes.", status_code=422
+    )
+
+
+@router.post("/{collection_slug}/{version_id}/publish", response_model=VersionInfo)
+async def publish_version(
+    collection_slug: str,
+    version_id: int,
+    user: User = logged_in_user,
+    db: Database = Depends(),
+) -> VersionInfo:
+    """Freeze a version so its files can no longer change
+
+    Published versions are served with strong ETags and long-lived
+    Cache-Control. Publishing an already published version is a no-op.
+    """
+    query = """
+        update version
+        set published_on = coalesce(published_on, now())
+        from collection
+        where version.collection_id = collection.collection_id
+          and collection_slug = $1
+          and version_id = $2
+        returning
+            version_id, version.collection_id, name, description,
+            created_on, published_on
+    """
+    version = await db.fetch_one(query, [collection_slug, version_id])
+    if len(version) < 1:
+        raise HTTPException(
+            detail=f"Version {version_id} is not a version of {collection_slug}",
+            status_code=422,
+        )
+    await cache.invalidate(db, "latest_version", version["collection_id"])
+    return version
+
+
 @router.post("/{version_id}/{file_id}")
 async def add_file_to_version(
     file_id: int,
     version_id: int,
     db: Database = Depends(),
+    user: User = logged_in_user,
 ):
     query = """
-        insert into version_file
-        (version_id, file_id)
-        values
-        ($1, $2)
+        select collection_slug
+        from version
+        natural join collection
+        where version_id = $1
     """
     try:
-        await db.fetch_one(query, [version_id, file_id])
+        added = await db.fetch(
+            "select file_id from add_version_files($1, $2) as added(file_id)",
+            [version_id, [file_id]],
+        )
     except ForeignKeyViolationError as e:
         raise HTTPException(
             detail=f"Failed to add file to version. {e.detail}",
             status_code=422,
         )
+    except ObjectNotInPrerequisiteStateError as e:
+        raise frozen_version_error(e)
+    if added:
+        version = await db.fetch_one(query, [version_id])
+        await cache.invalidate(db, "collection_response", version["collection_slug"])
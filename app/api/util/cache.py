@@ -0,0 +1,166 @@
+import asyncio
+import asyncpg
+import json
+import os
+from collections import OrderedDict
+
+from . import db
+
+CHANNEL = "prism_cache"
+DEFAULT_SIZE = int(os.environ.get("CACHE_SIZE", 10000))
+RECONNECT_DELAY = 5
+
+caches = {}
+listener = None
+
+
+class LRUCache:
+    """A size bounded mapping that evicts the least recently used key"""
+
+    def __init__(self, maxsize: int = DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        try:
+            self.data.move_to_end(key)
+        except KeyError:
+            return default
+        return self.data[key]
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key):
+        self.data.pop(key, None)
+
+    def clear(self):
+        self.data.clear()
+
+
+class SharedCache(LRUCache):
+    """An LRUCache kept coherent across workers with LISTEN/NOTIFY
+
+    Lookups always miss while the listener connection is down, since
+    invalidations sent in the meantime would be lost. `generation` is
+    bumped on every invalidation; pass the value read before querying the
+    database to set() so a result that raced an invalidation is dropped
+    instead of cached.
+    """
+
+    def __init__(self, name: str, maxsize: int = DEFAULT_SIZE):
+        super().__init__(maxsize)
+        self.name = name
+        self.generation = 0
+
+    def get(self, key, default=None):
+        if listener is None:
+            return default
+        return super().get(key, default)
+
+    def get_many(self, keys):
+        """Split keys into a {key: value} dict of hits and a list of misses"""
+        found, missing = {}, []
+        for key in keys:
+            value = self.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def set(self, key, value, generation=None):
+        if listener is None:
+            return
+        if generation is not None and generation != self.generation:
+            return
+        super().set(key, value)
+
+    def pop(self, key):
+        self.generation += 1
+        super().pop(key)
+
+    def clear(self):
+        self.generation += 1
+        super().clear()
+
+
+def shared_cache(name: str, maxsize: int = DEFAULT_SIZE) -> SharedCache:
+    """Get or create the named SharedCache for this worker"""
+    if name not in caches:
+        caches[name] = SharedCache(name, maxsize)
+    return caches[name]
+
+
+async def invalidate(db: db.Database, name: str, key=None):
+    """Drop a key (or the whole cache if key is None) in every worker"""
+    cache = shared_cache(name)
+    if key is None:
+        cache.clear()
+    else:
+        cache.pop(key)
+    payload = json.dumps({"cache": name, "key": key})
+    await db.execute("select pg_notify($1, $2)", [CHANNEL, payload])
+
+
+async def invalidate_on_commit(conn, name: str, key=None):
+    """Drop a key (or the whole cache) in every worker once conn commits
+
+    The notification is part of conn's transaction, so nothing is dropped
+    if it rolls back, and nothing can be cached again from data older than
+    the commit. This worker applies it when its own notification arrives.
+    """
+    payload = json.dumps({"cache": name, "key": key})
+    await conn.execute("select pg_notify($1, $2)", CHANNEL, payload)
+
+
+def _on_notify(conn, pid, channel, payload):
+    message = json.loads(payload)
+    cache = shared_cache(message["cache"])
+    if message["key"] is None:
+        cache.clear()
+    else:
+        cache.pop(message["key"])
+
+
+def _on_terminate(conn):
+    global listener
+    listener = None
+    for cache in caches.values():
+        cache.clear()
+    asyncio.get_event_loop().create_task(_reconnect())
+
+
+async def _reconnect():
+    while listener is None:
+        await asyncio.sleep(RECONNECT_DELAY)
+        try:
+            await listen()
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+            print("cache listener reconnect failed:", e)
+
+
+async def listen():
+    """Open the connection that receives invalidations from other workers"""
+    global listener
+    conn = await db.connect()
+    await conn.add_listener(CHANNEL, _on_notify)
+    conn.add_termination_listener(_on_terminate)
+    # Anything cached before now may have missed an invalidation
+    for cache in caches.values():
+        cache.clear()
+    listener = conn
+
+
+async def close():
+    global listener
+    conn, listener = listener, None
+    if conn is not None:
+        conn.remove_termination_listener(_on_terminate)
+        await conn.close()
@@ -0,0 +1,82 @@
+import hashlib
+from datetime import datetime
+from typing import Optional
+from fastapi import Depends, Request, Response
+
+from .cache import LRUCache
+from .db import Database, prepared
+
+# Published versions never change, so their responses may be cached forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Publishing is one way, so a published_on once read can be kept for good;
+# unpublished versions are looked up again on every request.
+published_versions = LRUCache()
+published_on_query = prepared(
+    """
+    select published_on
+    from version
+    natural join collection
+    where collection_slug = $1
+      and version_id = $2
+    """
+)
+
+
+async def get_published_on(
+    collection_slug: str, version_id: int, db: Database
+) -> Optional[datetime]:
+    key = (collection_slug, version_id)
+    published_on = published_versions.get(key)
+    if published_on is not None:
+        return published_on
+    version = await db.fetch_one(published_on_query, [collection_slug, version_id])
+    if len(version) < 1 or version["published_on"] is None:
+        return None
+    published_versions.set(key, version["published_on"])
+    return version["published_on"]
+
+
+def version_etag(request: Request, version_id: int, published_on: datetime) -> str:
+    """Strong ETag for one representation of a published version
+
+    The path and query string are part of it, so every page and format of
+    a listing gets its own tag.
+    """
+    representation = f"{request.url.path}?{request.url.query}"
+    digest = hashlib.sha1(representation.encode()).hexdigest()[:16]
+    return f'"v{version_id}-{published_on:%Y%m%d%H%M%S%f}-{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses the weak comparison
+    return "*" in tags or etag in {
+        tag[2:] if tag.startswith("W/") else tag for tag in tags
+    }
+
+
+async def published_version(
+    collection_slug: str,
+    version_id: int,
+    request: Request,
+    response: Response,
+    db: Database = Depends(),
+) -> Optional[Response]:
+    """Dependency setting ETag and Cache-Control for published versions
+
+    Returns a 304 response for the route to return as is when the client
+    already holds the current representation, and None otherwise.
+    Unpublished versions get no validators.
+    """
+    published_on = await get_published_on(collection_slug, version_id, db)
+    if published_on is None:
+        return None
+    etag = version_etag(request, version_id, published_on)
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
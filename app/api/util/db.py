@@ -1,53 +1,452 @@
+import asyncio
 import asyncpg
+import itertools
+import os
+import time
 from asyncpg.exceptions import UniqueViolationError
+from contextlib import asynccontextmanager
+from starlette.requests import Request
+from typing import Callable, NamedTuple, Optional
 
 pool = None
-database = "collection_manager"
+replicas = []
+replica_turn = itertools.count()
+replica_monitor = None
+# Set once setup has opened the pool's connections and prepared statements
+warm = False
+database = os.environ.get("PRISM_DATABASE", "collection_manager")
+connect_kwargs = {}
+
+POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 10))
+POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+MAX_QUERIES = int(os.environ.get("DB_MAX_QUERIES", 50000))
+MAX_INACTIVE_CONNECTION_LIFETIME = float(
+    os.environ.get("DB_MAX_INACTIVE_CONNECTION_LIFETIME", 300)
+)
+SLOW_QUERY_MS = float(os.environ.get("DB_SLOW_QUERY_MS", 0))
+# Chunks of COPY output buffered ahead of a slow client before Postgres is
+# made to wait
+COPY_BUFFER_CHUNKS = 16
+
+# Read replicas as host names or postgresql:// DSNs, comma separated. Reads
+# made while serving GET and HEAD requests go to them round-robin; writes
+# and everything else use the primary.
+READ_REPLICAS = [
+    target.strip()
+    for target in os.environ.get("DB_READ_REPLICAS", "").split(",")
+    if target.strip()
+]
+# Seconds a replica that failed is skipped before it is tried again
+REPLICA_RETRY = float(os.environ.get("DB_REPLICA_RETRY", 10))
+# Replicas replaying more than this many seconds behind are skipped
+REPLICA_MAX_LAG = float(os.environ.get("DB_REPLICA_MAX_LAG", 30))
+REPLICA_CHECK_INTERVAL = 5
+# Seconds /readyz waits for a pool connection and a round trip
+READY_TIMEOUT = float(os.environ.get("DB_READY_TIMEOUT", 2))
+READ_METHODS = {"GET", "HEAD"}
+# Clients that must see their own writes straight away send this header
+# with any value to read from the primary
+READ_PRIMARY_HEADER = "X-Read-Primary"
+
+# A replica that raises one of these is marked down and the read retried
+# elsewhere: the connection is gone, the server is restarting, or the
+# query was cancelled by a conflict with WAL replay.
+REPLICA_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.AdminShutdownError,
+    asyncpg.CrashShutdownError,
+    asyncpg.SerializationError,
+)
+
+# Seconds since the last replayed transaction, unless everything received
+# has been replayed; after a restart the received position starts behind
+# the replayed one.
+replica_lag_query = """
+    select coalesce(
+        case
+            when pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() then 0
+            else extract(epoch from now() - pg_last_xact_replay_timestamp())
+        end,
+        0
+    )
+"""
+
+# Hot queries prepared on every pool connection when it is opened
+statements = set()
+query_hooks = []
 
 
 class NotFound(RuntimeError):
     pass
 
 
+class ReplicaUnavailable(RuntimeError):
+    """A read failed because its replica went away, and can be retried"""
+
+    pass
+
+
+class Replica:
+    def __init__(self, target: str):
+        self.target = target
+        self.pool = None
+        self.lag = 0.0
+        self.down_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return (
+            self.pool is not None
+            and self.lag <= REPLICA_MAX_LAG
+            and time.monotonic() >= self.down_until
+        )
+
+    def mark_down(self, reason):
+        if time.monotonic() >= self.down_until:
+            print(f"read replica {self.target} unavailable:", repr(reason))
+        self.down_until = time.monotonic() + REPLICA_RETRY
+
+    async def connect(self, **kwargs):
+        if "://" in self.target:
+            kwargs["dsn"] = self.target
+        else:
+            kwargs["host"] = self.target
+        self.pool = await create_pool(**kwargs)
+
+    async def check(self):
+        """Open the pool if it is missing and measure the replay lag"""
+        try:
+            if self.pool is None:
+                await self.connect(**connect_kwargs)
+            lag = await self.pool.fetchval(
+                replica_lag_query, timeout=REPLICA_CHECK_INTERVAL
+            )
+            self.lag = float(lag)
+        except REPLICA_ERRORS + (asyncpg.PostgresError,) as e:
+            self.mark_down(e)
+
+
+class QueryStats(NamedTuple):
+    query: str
+    acquire_wait: float
+    duration: float
+    rows: Optional[int]
+
+
+def prepared(query: str) -> str:
+    """Register a read-only query to be prepared once per pool connection
+
+    Returns the query unchanged so it can be assigned at module level and
+    passed to Database as usual; the statement is already in the
+    connection's statement cache, so even the first call skips the
+    parse/plan round trip.
+    """
+    if not query.lstrip().lower().startswith("select"):
+        raise ValueError("only select statements can be registered")
+    statements.add(query)
+    return query
+
+
+def add_query_hook(hook: Callable[[QueryStats], None]):
+    """Call hook with a QueryStats after every query run through Database
+
+    acquire_wait is the time spent waiting for a pool connection and
+    duration the time spent in Postgres, both in seconds.
+    """
+    query_hooks.append(hook)
+
+
+def record_query(query, acquire_wait, duration, rows=None):
+    stats = QueryStats(query, acquire_wait, duration, rows)
+    for hook in query_hooks:
+        hook(stats)
+
+
+def log_slow_query(stats: QueryStats):
+    if (stats.acquire_wait + stats.duration) * 1000 >= SLOW_QUERY_MS:
+        print(
+            f"slow query: waited {stats.acquire_wait * 1000:.1f}ms for a connection,"
+            f" ran {stats.duration * 1000:.1f}ms, {stats.rows} rows:",
+            " ".join(stats.query.split()),
+        )
+
+
+if SLOW_QUERY_MS > 0:
+    add_query_hook(log_slow_query)
+
+
+async def init_connection(conn):
+    for query in statements:
+        try:
+            # Running the statement once with NULL arguments puts it in
+            # asyncpg's per-connection statement cache, which fetch() uses;
+            # registered statements are selects, so this has no effect.
+            parameters = (await conn.prepare(query)).get_parameters()
+            await conn.fetch(query, *[None] * len(parameters))
+        except asyncpg.PostgresError as e:
+            # Leave it to the statement cache rather than failing the pool
+            print("failed to prepare statement:", e, " ".join(query.split()))
+
+
+def replicas_for_read():
+    """Available replicas, starting from the next one in round-robin order"""
+    start = next(replica_turn)
+    for offset in range(len(replicas)):
+        replica = replicas[(start + offset) % len(replicas)]
+        if replica.available:
+            yield replica
+
+
 class Database:
-    def __init__(self):
-        pass
+    def __init__(self, request: Request = None):
+        # Only a request that cannot write reads from the replicas; outside
+        # a request everything goes to the primary.
+        self.read_only = (
+            request is not None
+            and request.method in READ_METHODS
+            and READ_PRIMARY_HEADER not in request.headers
+        )
 
-    async def execute(self, query, parameters=[]):
+    @asynccontextmanager
+    async def acquire(self, read=False):
+        """Acquire a pool connection, yielding it and the time waited for it
+
+        Reads of a read-only request get a replica connection when one is
+        available, falling back to the primary. If the replica fails while
+        the connection is in use, ReplicaUnavailable is raised instead.
+        """
         global pool
 
+        start = time.perf_counter()
+        if read and self.read_only:
+            for replica in replicas_for_read():
+                try:
+                    conn = await replica.pool.acquire()
+                except REPLICA_ERRORS as e:
+                    replica.mark_down(e)
+                    continue
+                try:
+                    yield conn, time.perf_counter() - start
+                except REPLICA_ERRORS as e:
+                    replica.mark_down(e)
+                    raise ReplicaUnavailable(replica.target) from e
+                finally:
+                    await replica.pool.release(conn)
+                return
         async with pool.acquire() as conn:
-            return await conn.execute(query, *parameters)
+            yield conn, time.perf_counter() - start
+
+    async def execute(self, query, parameters=[]):
+        async with self.acquire() as (conn, waited):
+            start = time.perf_counter()
+            status = await conn.execute(query, *parameters)
+        record_query(query, waited, time.perf_counter() - start)
+        return status
 
     async def fetch(self, query, parameters=[]):
-        global pool
         # if pool is None:
         #     await setup(database=database)
 
-        async with pool.acquire() as conn:
+        try:
+            return await self._fetch(query, parameters, read=True)
+        except ReplicaUnavailable:
+            # Nothing was returned yet, so the read can be repeated
+            return await self._fetch(query, parameters, read=False)
+
+    async def _fetch(self, query, parameters, read):
+        async with self.acquire(read) as (conn, waited):
+            start = time.perf_counter()
             records = await conn.fetch(query, *parameters)
-            return records
+        record_query(query, waited, time.perf_counter() - start, len(records))
+        return records
 
     async def fetch_one(self, query, parameters=[]):
         """Execute query and return only the first result
 
         Raises NotFound if the query returns no matches
         """
-        global pool
         # if pool is None:
         #     await setup(database=database)
 
-        async with pool.acquire() as conn:
-            records = await conn.fetch(query, *parameters)
-            if len(records) < 1:
-                return []
-                # raise NotFound("no matching records found")
-            return records[0]
+        records = await self.fetch(query, parameters)
+        if len(records) < 1:
+            return []
+            # raise NotFound("no matching records found")
+        return records[0]
 
+    async def iterate(self, query, parameters=[], prefetch=1000):
+        """Yield records one at a time from a server-side cursor
 
-async def setup(*args, **kwargs):
-    global pool
-    pool = await asyncpg.create_pool(*args, **kwargs)
+        Rows are pulled from Postgres in batches of `prefetch` inside a
+        transaction, so the full result set is never held in memory.
+        """
+        rows = 0
+        async with self.acquire(read=True) as (conn, waited):
+            start = time.perf_counter()
+            async with conn.transaction():
+                async for record in conn.cursor(query, *parameters, prefetch=prefetch):
+                    rows += 1
+                    yield record
+        record_query(query, waited, time.perf_counter() - start, rows)
+
+    async def batches(self, query, parameters=[], size=10000):
+        """Yield lists of up to `size` records from a server-side cursor"""
+        rows = 0
+        async with self.acquire(read=True) as (conn, waited):
+            start = time.perf_counter()
+            async with conn.transaction():
+                cursor = await conn.cursor(query, *parameters)
+                while True:
+                    records = await cursor.fetch(size)
+                    if not records:
+                        break
+                    rows += len(records)
+                    yield records
+        record_query(query, waited, time.perf_counter() - start, rows)
+
+    async def copy_out(self, query, parameters=[], **options):
+        """Yield the output of COPY (query) TO STDOUT as Postgres sends it
+
+        options are passed to asyncpg's copy_from_query (format, header,
+        ...). At most COPY_BUFFER_CHUNKS chunks are held in memory; beyond
+        that the COPY waits for the consumer to catch up.
+        """
+        chunks = asyncio.Queue(maxsize=COPY_BUFFER_CHUNKS)
+        async with self.acquire(read=True) as (conn, waited):
+            start = time.perf_counter()
+
+            async def copy():
+                try:
+                    await conn.copy_from_query(
+                        query, *parameters, output=chunks.put, **options
+                    )
+                finally:
+                    await chunks.put(None)
+
+            task = asyncio.create_task(copy())
+            try:
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is None:
+                        break
+                    yield bytes(chunk)
+                await task
+            finally:
+                # The consumer went away (client disconnected) mid-COPY
+                if not task.done():
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+        record_query(query, waited, time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Acquire a connection and open a transaction on it
+
+        The raw connection is yielded so that several statements (and
+        COPY operations) can share the same transaction.
+        """
+        async with self.acquire() as (conn, waited):
+            start = time.perf_counter()
+            async with conn.transaction():
+                yield conn
+        record_query("transaction", waited, time.perf_counter() - start)
+
+
+class ReadDatabase(Database):
+    """Database for routes that only read but take a POST body
+
+    Their reads may go to a replica like those of a GET request.
+    """
+
+    def __init__(self, request: Request = None):
+        super().__init__(request)
+        self.read_only = (
+            request is not None and READ_PRIMARY_HEADER not in request.headers
+        )
+
+
+async def create_pool(**kwargs):
+    """Create a pool sized and tuned from the DB_* environment variables"""
+    return await asyncpg.create_pool(
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        max_queries=MAX_QUERIES,
+        max_inactive_connection_lifetime=MAX_INACTIVE_CONNECTION_LIFETIME,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+        init=init_connection,
+        **kwargs,
+    )
+
+
+async def setup(**kwargs):
+    """Create the primary pool and the DB_READ_REPLICAS pools
+
+    A replica that cannot be reached yet is retried by the replica monitor
+    instead of failing startup.
+    """
+    global pool, connect_kwargs, replicas, replica_monitor, warm
+    connect_kwargs = kwargs
+    # The pool opens its min_size connections, running init_connection on
+    # each, before it is returned
+    pool = await create_pool(**kwargs)
+    replicas = [Replica(target) for target in READ_REPLICAS]
+    if replicas:
+        await asyncio.gather(*[replica.check() for replica in replicas])
+        replica_monitor = asyncio.get_event_loop().create_task(monitor_replicas())
+    warm = True
+
+
+async def not_ready() -> Optional[str]:
+    """Why the primary cannot serve requests right now, or None if it can
+
+    The round trip goes through the pool, so a pool that stays exhausted
+    for READY_TIMEOUT also counts as not ready.
+    """
+    if not warm:
+        return "database pool not open yet"
+    try:
+        async with pool.acquire(timeout=READY_TIMEOUT) as conn:
+            await conn.fetchval("select 1", timeout=READY_TIMEOUT)
+    except (
+        OSError,
+        asyncio.TimeoutError,
+        asyncpg.PostgresError,
+        asyncpg.InterfaceError,
+    ) as e:
+        return f"database not reachable: {e!r}"
+    return None
+
+
+async def monitor_replicas():
+    while True:
+        await asyncio.sleep(REPLICA_CHECK_INTERVAL)
+        await asyncio.gather(*[replica.check() for replica in replicas])
+
+
+async def close():
+    global replica_monitor, warm
+    warm = False
+    if replica_monitor is not None:
+        replica_monitor.cancel()
+        replica_monitor = None
+    for replica in replicas:
+        if replica.pool is not None:
+            await replica.pool.close()
+    if pool is not None:
+        await pool.close()
+
+
+async def connect():
+    """Open a dedicated connection outside the pool with the same settings"""
+    return await asyncpg.connect(**connect_kwargs)
 
 
 async def fetch(query, parameters=[]):
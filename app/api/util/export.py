@@ -0,0 +1,93 @@
+from typing import Optional
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+CSV = "text/csv"
+ARROW = "application/vnd.apache.arrow.stream"
+
+# Media types export can produce, in order of preference for */*
+EXPORT_FORMATS = [CSV, ARROW]
+
+
+def available() -> list:
+    """Media types export can produce here; Arrow needs pyarrow"""
+    return [t for t in EXPORT_FORMATS if t != ARROW or pyarrow is not None]
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """Pick an export media type from an Accept header
+
+    No header, */* and text/* give CSV. Arrow is only offered when pyarrow
+    is installed. Returns None when nothing acceptable can be produced.
+    """
+    media_types = available()
+    if not accept:
+        return media_types[0]
+    ranges = []
+    for position, part in enumerate(accept.split(",")):
+        media_range, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((-quality, position, media_range.lower()))
+    # q=0 refuses a type outright, even when a wildcard would allow it
+    refused = {media_range for quality, _, media_range in ranges if quality == 0}
+    media_types = [t for t in media_types if t not in refused]
+    for negative_quality, _, media_range in sorted(ranges):
+        if negative_quality == 0:
+            break
+        for media_type in media_types:
+            kind = media_type.split("/")[0]
+            if media_range in (media_type, f"{kind}/*", "*/*"):
+                return media_type
+    return None
+
+
+class _Chunks:
+    """Write-only file object collecting what an Arrow writer emits"""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+async def arrow_stream(batches, schema):
+    """Encode lists of records as an Arrow IPC stream, one batch at a time
+
+    Records are matched to the schema's fields by position.
+    """
+    sink = _Chunks()
+    writer = pyarrow.ipc.new_stream(sink, schema)
+    yield sink.take()
+    async for records in batches:
+        columns = zip(*records)
+        arrays = [
+            pyarrow.array(column, type=field.type)
+            for column, field in zip(columns, schema)
+        ]
+        writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
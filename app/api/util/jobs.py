@@ -0,0 +1,266 @@
+import asyncio
+import asyncpg
+import json
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, NamedTuple, Optional, Type
+from pydantic import BaseModel
+
+from .db import Database
+
+# Job loops per API process; 0 leaves jobs to other processes
+WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+# Rows handled by one chunk, and so by one transaction
+CHUNK_SIZE = int(os.environ.get("JOB_CHUNK_SIZE", 1000))
+# Seconds without a committed chunk after which a running job is presumed
+# abandoned and taken over by another worker
+LEASE = float(os.environ.get("JOB_LEASE", 120))
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 2))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+kinds = {}
+tasks = []
+# job_id held by each running loop, released on shutdown
+current = {}
+
+
+class Job(NamedTuple):
+    job_id: int
+    kind: str
+    params: BaseModel
+    cursor: Optional[dict]
+    progress: int
+    total: Optional[int]
+    result: Optional[dict]
+
+
+class Step(NamedTuple):
+    """What a chunk did, committed with it
+
+    cursor is handed to the next chunk, progress and total replace the
+    job's counters. A step with done set finishes the job with result.
+    """
+
+    cursor: Optional[dict]
+    progress: int
+    total: Optional[int] = None
+    result: Optional[dict] = None
+    done: bool = False
+
+
+class JobKind(NamedTuple):
+    params: Type[BaseModel]
+    step: Callable[[asyncpg.Connection, Job, Database], Awaitable[Step]]
+    total: Optional[Callable[[BaseModel], Optional[int]]]
+
+
+class Cancelled(Exception):
+    pass
+
+
+def register(
+    kind: str,
+    params: Type[BaseModel],
+    total: Optional[Callable[[BaseModel], Optional[int]]] = None,
+):
+    """Decorator registering the chunk function of a job kind
+
+    The function gets a connection inside the chunk's transaction, the
+    Job and a Database for lookups outside it, and returns a Step. params
+    validates the parameters when the job is submitted; total, if given,
+    computes job_total from them.
+    """
+
+    def decorator(step):
+        kinds[kind] = JobKind(params, step, total)
+        return step
+
+    return decorator
+
+
+claim_query = """
+    update job
+    set job_state = 'running',
+        job_worker = $1,
+        job_started_on = coalesce(job_started_on, now()),
+        job_heartbeat_on = now()
+    where job_id = (
+        select job_id
+        from job
+        where job_state = 'queued'
+           or (
+               job_state = 'running'
+               and job_heartbeat_on < now() - make_interval(secs => $2)
+           )
+        order by job_id
+        limit 1
+        for update skip locked
+    )
+    returning
+        job_id, job_kind, job_params, job_cursor,
+        job_progress, job_total, job_result
+"""
+
+
+async def claim(db: Database) -> Optional[Job]:
+    """Take the oldest queued (or abandoned) job, if there is one"""
+    record = await db.fetch_one(claim_query, [WORKER_ID, LEASE])
+    if not record:
+        return None
+    kind = kinds.get(record["job_kind"])
+    if kind is None:
+        await finish(db, record["job_id"], "failed", error="Unknown job kind")
+        return None
+    return Job(
+        record["job_id"],
+        record["job_kind"],
+        kind.params.parse_raw(record["job_params"]),
+        json.loads(record["job_cursor"]) if record["job_cursor"] else None,
+        record["job_progress"],
+        record["job_total"],
+        json.loads(record["job_result"]) if record["job_result"] else None,
+    )
+
+
+async def finish(db: Database, job_id: int, state: str, error: str = None):
+    query = """
+        update job
+        set job_state = $2,
+            job_error = $3,
+            job_finished_on = now()
+        where job_id = $1
+          and job_worker = $4
+          and job_state = 'running'
+    """
+    await db.execute(query, [job_id, state, error, WORKER_ID])
+
+
+async def run_step(db: Database, job: Job) -> Job:
+    """Run and commit one chunk of job, returning the job as it now is
+
+    Raises Cancelled when a cancel was requested, after marking the job
+    cancelled; chunks already committed stay in place.
+    """
+    async with db.transaction() as conn:
+        # Holding the row lock keeps a worker that took the job over from
+        # committing a chunk at the same time
+        owner = await conn.fetchrow(
+            """
+            select job_worker, job_cancel_requested
+            from job
+            where job_id = $1
+            for update
+            """,
+            job.job_id,
+        )
+        if owner is None or owner["job_worker"] != WORKER_ID:
+            raise Cancelled("taken over by another worker")
+        cancelled = owner["job_cancel_requested"]
+        if cancelled:
+            await conn.execute(
+                """
+                update job
+                set job_state = 'cancelled', job_finished_on = now()
+                where job_id = $1
+                """,
+                job.job_id,
+            )
+        else:
+            step = await kinds[job.kind].step(conn, job, db)
+            total = job.total if step.total is None else step.total
+            result = job.result if step.result is None else step.result
+            await conn.execute(
+                """
+                update job
+                set job_cursor = $2,
+                    job_progress = $3,
+                    job_total = $4,
+                    job_result = $5,
+                    job_heartbeat_on = now(),
+                    job_state = case when $6 then 'done' else job_state end,
+                    job_finished_on = case when $6 then now() end
+                where job_id = $1
+                """,
+                job.job_id,
+                json.dumps(step.cursor),
+                step.progress,
+                total,
+                json.dumps(result),
+                step.done,
+            )
+    # Raised once the cancellation is committed
+    if cancelled:
+        raise Cancelled("cancel requested")
+    if step.done:
+        return None
+    return job._replace(
+        cursor=step.cursor, progress=step.progress, total=total, result=result
+    )
+
+
+async def run(db: Database, job: Job):
+    while job is not None:
+        try:
+            job = await run_step(db, job)
+        except Cancelled:
+            return
+        except (OSError, asyncpg.InterfaceError, asyncpg.PostgresConnectionError):
+            # The database went away mid-chunk; the chunk rolled back and
+            # the job is taken up again once its lease runs out
+            raise
+        except Exception as e:
+            print(f"job {job.job_id} ({job.kind}) failed:", repr(e))
+            await finish(db, job.job_id, "failed", getattr(e, "detail", None) or str(e))
+            return
+
+
+async def worker_loop(slot: int):
+    db = Database()
+    while True:
+        try:
+            job = await claim(db)
+            if job is None:
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            current[slot] = job.job_id
+            await run(db, job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("job worker error:", repr(e))
+            await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            current.pop(slot, None)
+
+
+def start():
+    """Start WORKERS job loops in this process"""
+    for slot in range(WORKERS):
+        tasks.append(asyncio.get_event_loop().create_task(worker_loop(slot)))
+
+
+async def stop():
+    """Stop the job loops and requeue the jobs they held
+
+    The chunk that was running rolls back, so another worker can pick the
+    job up straight away instead of waiting for the lease to run out.
+    """
+    held = list(current.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    tasks.clear()
+    if held:
+        query = """
+            update job
+            set job_state = 'queued', job_worker = null
+            where job_id = any($1)
+              and job_worker = $2
+              and job_state = 'running'
+        """
+        try:
+            await Database().execute(query, [held, WORKER_ID])
+        except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            print("could not requeue jobs:", repr(e))
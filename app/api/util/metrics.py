@@ -0,0 +1,130 @@
+import os
+import time
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from starlette.routing import Match
+
+from . import db
+
+# With several uvicorn workers each process writes its samples to
+# PROMETHEUS_MULTIPROC_DIR (set up by start.sh) and a scrape of any one
+# worker aggregates the files of all of them.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+REQUEST_LATENCY = Histogram(
+    "prism_request_duration_seconds",
+    "Time to serve a request, by route template",
+    ["method", "route", "status"],
+)
+IN_FLIGHT = Gauge(
+    "prism_requests_in_flight",
+    "Requests currently being served",
+    multiprocess_mode="livesum",
+)
+POOL_SIZE = Gauge(
+    "prism_db_pool_size",
+    "Open connections in the asyncpg pool",
+    multiprocess_mode="livesum",
+)
+POOL_IDLE = Gauge(
+    "prism_db_pool_idle",
+    "Idle connections in the asyncpg pool",
+    multiprocess_mode="livesum",
+)
+POOL_ACQUIRE_WAIT = Histogram(
+    "prism_db_pool_acquire_wait_seconds",
+    "Time spent waiting for a pool connection",
+)
+QUERY_DURATION = Histogram(
+    "prism_db_query_duration_seconds",
+    "Time spent executing queries once a connection was acquired",
+)
+RESPONSE_CACHE = Counter(
+    "prism_response_cache_requests",
+    "Cached read route requests, by hit, miss or coalesced into a miss",
+    ["result"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "prism_upstream_request_duration_seconds",
+    "Latency of outbound PathDB/NBIA requests",
+    ["host", "status"],
+)
+
+
+def update_pool_gauges():
+    if db.pool is not None:
+        POOL_SIZE.set(db.pool.get_size())
+        POOL_IDLE.set(db.pool.get_idle_size())
+
+
+def observe_query(stats: db.QueryStats):
+    POOL_ACQUIRE_WAIT.observe(stats.acquire_wait)
+    QUERY_DURATION.observe(stats.duration)
+    update_pool_gauges()
+
+
+db.add_query_hook(observe_query)
+
+
+def render() -> bytes:
+    update_pool_gauges()
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def mark_process_dead():
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def route_template(app, scope) -> str:
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Record latency per route template and the number of in-flight requests
+
+    Latency runs until the last body chunk is sent, so streamed responses
+    are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            IN_FLIGHT.dec()
+            REQUEST_LATENCY.labels(
+                scope["method"], route_template(scope["app"], scope), status
+            ).observe(time.perf_counter() - start)
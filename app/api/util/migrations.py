@@ -0,0 +1,121 @@
+import asyncio
+import os
+import re
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "migrations")
+
+# Arbitrary key for pg_advisory_lock, shared by every process running
+# migrations against the same database
+LOCK_KEY = 7_145_001
+# Seconds between attempts to take the lock while another run holds it
+LOCK_POLL_INTERVAL = 0.5
+
+# Migrations starting with this line run statement by statement outside a
+# transaction, which CREATE INDEX CONCURRENTLY requires
+NO_TRANSACTION = "-- no transaction"
+
+# An interrupted CREATE INDEX CONCURRENTLY leaves an invalid index behind,
+# which IF NOT EXISTS would then keep forever
+CREATE_INDEX_CONCURRENTLY = re.compile(
+    r"create\s+(?:unique\s+)?index\s+concurrently\s+if\s+not\s+exists\s+([\w.]+)",
+    re.IGNORECASE,
+)
+
+
+class Migration:
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as f:
+            self.sql = f.read()
+        self.transactional = not self.sql.startswith(NO_TRANSACTION)
+
+    def statements(self):
+        """Split on semicolons ending a line; only used without a transaction"""
+        for statement in re.split(r";\s*$", self.sql, flags=re.MULTILINE):
+            lines = [l for l in statement.splitlines() if not l.startswith("--")]
+            if "".join(lines).strip():
+                yield statement
+
+
+def available(directory: str = MIGRATIONS_DIR):
+    return [
+        Migration(os.path.join(directory, name))
+        for name in sorted(os.listdir(directory))
+        if name.endswith(".sql")
+    ]
+
+
+async def applied(conn):
+    await conn.execute(
+        """
+        create table if not exists schema_migration (
+            name text primary key,
+            applied_on timestamp not null default now()
+        )
+        """
+    )
+    rows = await conn.fetch("select name from schema_migration")
+    return {row["name"] for row in rows}
+
+
+async def pending(conn, directory: str = MIGRATIONS_DIR):
+    done = await applied(conn)
+    return [m for m in available(directory) if m.name not in done]
+
+
+async def lock(conn):
+    """Take the migration lock, polling while another run holds it
+
+    A session blocked in pg_advisory_lock() is inside a statement, and so
+    a transaction, which the other run's CREATE INDEX CONCURRENTLY would
+    wait for while it waits for the lock: a deadlock. Between polls this
+    one holds no transaction.
+    """
+    while not await conn.fetchval("select pg_try_advisory_lock($1)", LOCK_KEY):
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+
+async def drop_invalid_index(conn, statement: str, log=print):
+    """Drop the index statement creates concurrently if it was left invalid"""
+    match = CREATE_INDEX_CONCURRENTLY.search(statement)
+    if match is None:
+        return
+    invalid = await conn.fetchval(
+        "select not indisvalid from pg_index where indexrelid = to_regclass($1)",
+        match.group(1),
+    )
+    if invalid:
+        log(f"dropping invalid index {match.group(1)}")
+        await conn.execute(f"drop index concurrently {match.group(1)}")
+
+
+async def migrate(conn, directory: str = MIGRATIONS_DIR, log=print):
+    """Apply every pending migration in name order, returning their names
+
+    An advisory lock serialises concurrent runs (several pods starting at
+    once); each run re-reads what has been applied after taking it.
+    """
+    await lock(conn)
+    try:
+        names = []
+        for migration in await pending(conn, directory):
+            log(f"applying migration {migration.name}")
+            if migration.transactional:
+                async with conn.transaction():
+                    await conn.execute(migration.sql)
+                    await conn.execute(
+                        "insert into schema_migration (name) values ($1)",
+                        migration.name,
+                    )
+            else:
+                for statement in migration.statements():
+                    await drop_invalid_index(conn, statement, log)
+                    await conn.execute(statement)
+                await conn.execute(
+                    "insert into schema_migration (name) values ($1)", migration.name
+                )
+            names.append(migration.name)
+        return names
+    finally:
+        await conn.execute("select pg_advisory_unlock($1)", LOCK_KEY)
@@ -0,0 +1,254 @@
+import base64
+import binascii
+import json
+from typing import Optional
+from fastapi import HTTPException, Query, Request, Response
+
+MAX_PAGE_SIZE = 10000
+
+
+def encode_cursor(value) -> str:
+    raw = json.dumps({"k": value}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return json.loads(raw)["k"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(detail=f"Invalid cursor: {cursor}", status_code=422)
+
+
+def set_next_page(request: Request, response: Response, value):
+    """Point the X-Next-Cursor and Link headers at the page after value"""
+    cursor = encode_cursor(value)
+    next_url = request.url.include_query_params(after=cursor)
+    response.headers["X-Next-Cursor"] = cursor
+    response.headers["Link"] = f'<{next_url}>; rel="next"'
+
+
+class KeysetPage:
+    """One page of a listing ordered by a unique integer key
+
+    Pages are selected with `key > last_key` (or `<` when descending)
+    instead of OFFSET, so every page costs the same as the first one.
+    The cursor for the following page is returned in the X-Next-Cursor
+    header and as a Link rel="next" header.
+
+    When a join can repeat the key, a nullable text tiebreak column makes
+    the order unique: rows are ordered by (key, tiebreak nulls first) and
+    the cursor carries both values.
+    """
+
+    def __init__(
+        self,
+        column: str,
+        field: str,
+        descending: bool,
+        limit: Optional[int],
+        after: Optional[str],
+        request: Request,
+        response: Response,
+        tiebreak: Optional[str] = None,
+    ):
+        self.column = column
+        self.field = field
+        self.descending = descending
+        self.limit = limit
+        self.tiebreak = tiebreak
+        self.after = None if after is None else decode_cursor(after)
+        self.after_tiebreak = None
+        if tiebreak is not None and self.after is not None:
+            if not (
+                isinstance(self.after, list)
+                and len(self.after) == 2
+                and isinstance(self.after[1], (str, type(None)))
+            ):
+                raise HTTPException(detail=f"Invalid cursor: {after}", status_code=422)
+            self.after, self.after_tiebreak = self.after
+        if self.after is not None and not isinstance(self.after, int):
+            raise HTTPException(detail=f"Invalid cursor: {after}", status_code=422)
+        self.request = request
+        self.response = response
+
+    def where(self, parameters: list) -> str:
+        """SQL predicate selecting rows after the cursor, appends its parameters"""
+        if self.after is None:
+            return "true"
+        parameters.append(self.after)
+        op = "<" if self.descending else ">"
+        if self.tiebreak is None:
+            return f"{self.column} {op} ${len(parameters)}"
+        key = f"${len(parameters)}"
+        parameters.append(self.after_tiebreak)
+        tiebreak = f"${len(parameters)}::text"
+        if self.descending:
+            # Nulls come last: after a null there is nothing left for the key
+            rest = f"{tiebreak} is not null and ({self.tiebreak} < {tiebreak} or {self.tiebreak} is null)"
+        else:
+            # Nulls come first: after a null every other value follows
+            rest = f"case when {tiebreak} is null then {self.tiebreak} is not null else {self.tiebreak} > {tiebreak} end"
+        return f"""
+            {self.column} {op}= {key}
+            and ({self.column} {op} {key} or ({self.column} = {key} and {rest}))
+        """
+
+    def order_by(self) -> str:
+        direction = "desc" if self.descending else "asc"
+        if self.tiebreak is None:
+            return f"order by {self.column} {direction}"
+        nulls = "last" if self.descending else "first"
+        return f"order by {self.column} {direction}, {self.tiebreak} {direction} nulls {nulls}"
+
+    def order_limit(self, parameters: list, lookahead: bool = True) -> str:
+        """SQL order by / limit clause, appends its parameter
+
+        With lookahead one extra row is requested so finish() can tell
+        whether another page exists.
+        """
+        if self.limit is None:
+            return self.order_by()
+        parameters.append(self.limit + 1 if lookahead else self.limit)
+        return f"{self.order_by()} limit ${len(parameters)}"
+
+    def finish(self, records):
+        """Trim the lookahead row and set the next page headers"""
+        if self.limit is None or len(records) <= self.limit:
+            return records
+        records = records[: self.limit]
+        last = records[-1][self.field]
+        if self.tiebreak is not None:
+            last = [last, records[-1][self.tiebreak.split(".")[-1]]]
+        set_next_page(self.request, self.response, last)
+        return records
+
+
+def keyset_page(
+    column: str,
+    field: str = None,
+    descending: bool = False,
+    tiebreak: Optional[str] = None,
+):
+    """Build a dependency providing a KeysetPage over `column`"""
+
+    def dependency(
+        request: Request,
+        response: Response,
+        limit: Optional[int] = Query(
+            None, ge=1, le=MAX_PAGE_SIZE, description="Maximum rows per page"
+        ),
+        after: Optional[str] = Query(
+            None, description="Cursor from the X-Next-Cursor header of the last page"
+        ),
+    ) -> KeysetPage:
+        return KeysetPage(
+            column,
+            field or column.split(".")[-1],
+            descending,
+            limit,
+            after,
+            request,
+            response,
+            tiebreak,
+        )
+
+    return dependency
+
+
+class RankedPage:
+    """One page of search results ordered by descending rank
+
+    Ties are broken by a unique integer key, and the cursor carries both
+    values. `rank` must be a column of the query the page is applied to,
+    so rank expressions are computed in a subquery and paged outside it.
+
+    When a join can repeat the key, a nullable text tiebreak column makes
+    the order unique like KeysetPage's: rows of a key are ordered by
+    tiebreak descending, nulls last, and the cursor carries it too.
+    """
+
+    def __init__(
+        self,
+        rank: str,
+        key: str,
+        limit: int,
+        after: Optional[str],
+        request: Request,
+        response: Response,
+        tiebreak: Optional[str] = None,
+    ):
+        self.rank = rank
+        self.key = key
+        self.limit = limit
+        self.tiebreak = tiebreak
+        self.after = None if after is None else decode_cursor(after)
+        size = 2 if tiebreak is None else 3
+        if self.after is not None and not (
+            isinstance(self.after, list)
+            and len(self.after) == size
+            and isinstance(self.after[0], (int, float))
+            and isinstance(self.after[1], int)
+            and (tiebreak is None or isinstance(self.after[2], (str, type(None))))
+        ):
+            raise HTTPException(detail=f"Invalid cursor: {after}", status_code=422)
+        self.request = request
+        self.response = response
+
+    def where(self, parameters: list) -> str:
+        if self.after is None:
+            return "true"
+        parameters.extend(self.after[:2])
+        n = len(parameters)
+        before = f"({self.rank}, {self.key}) < (${n - 1}::real, ${n})"
+        if self.tiebreak is None:
+            return before
+        parameters.append(self.after[2])
+        tiebreak = f"${len(parameters)}::text"
+        # Nulls come last: after a null there is nothing left for the key
+        return f"""
+            ({self.rank}, {self.key}) <= (${n - 1}::real, ${n})
+            and ({before} or (
+                {self.rank} = ${n - 1}::real and {self.key} = ${n}
+                and {tiebreak} is not null
+                and ({self.tiebreak} < {tiebreak} or {self.tiebreak} is null)
+            ))
+        """
+
+    def order_limit(self, parameters: list) -> str:
+        parameters.append(self.limit + 1)
+        order = f"{self.rank} desc, {self.key} desc"
+        if self.tiebreak is not None:
+            order = f"{order}, {self.tiebreak} desc nulls last"
+        return f"order by {order} limit ${len(parameters)}"
+
+    def finish(self, records):
+        if len(records) <= self.limit:
+            return records
+        records = records[: self.limit]
+        last = records[-1]
+        value = [last[self.rank], last[self.key]]
+        if self.tiebreak is not None:
+            value.append(last[self.tiebreak])
+        set_next_page(self.request, self.response, value)
+        return records
+
+
+def ranked_page(
+    rank: str, key: str, default_limit: int = 50, tiebreak: Optional[str] = None
+):
+    """Build a dependency providing a RankedPage"""
+
+    def dependency(
+        request: Request,
+        response: Response,
+        limit: int = Query(
+            default_limit, ge=1, le=MAX_PAGE_SIZE, description="Maximum rows per page"
+        ),
+        after: Optional[str] = Query(
+            None, description="Cursor from the X-Next-Cursor header of the last page"
+        ),
+    ) -> RankedPage:
+        return RankedPage(rank, key, limit, after, request, response, tiebreak)
+
+    return dependency
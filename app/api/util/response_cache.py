@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, NamedTuple, Type
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+from . import cache, metrics
+from .db import Database
+from .serialization import dumps, json_records, project
+
+# Seconds a rendered response is served before it is rendered again. Writes
+# invalidate their collection straight away; the TTL bounds what they
+# cannot see, such as a read replica that was still catching up.
+TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 10))
+MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_SIZE", 10000))
+
+
+class CachedResponse(NamedTuple):
+    expires: float
+    size: int
+    body: bytes
+    headers: dict
+
+
+class ResponseCache(cache.SharedCache):
+    """Rendered JSON bodies of read routes, keyed per collection
+
+    Concurrent misses for the same representation share one query: the
+    first request renders it and the others wait for that result. Entries
+    expire after `ttl` seconds, and the least recently used are evicted
+    beyond `maxsize` entries or `max_bytes` of body.
+
+    Each collection has a generation that is part of the key. Invalidating
+    a collection_slug (cache.invalidate, from every worker) bumps it and
+    drops the collection's entries, so a render that raced the write is
+    not stored either.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int = MAX_ENTRIES,
+        max_bytes: int = MAX_BYTES,
+        ttl: float = TTL,
+    ):
+        super().__init__(name, maxsize)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.generations = {}
+        self.inflight = {}
+
+    def key(self, collection_slug: str, request: Request) -> tuple:
+        return (
+            collection_slug,
+            self.generation,
+            self.generations.get(collection_slug, 0),
+            request.url.path,
+            request.url.query,
+        )
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        if entry.expires <= time.monotonic():
+            self._drop(key)
+            return default
+        return entry
+
+    def set(self, key, entry: CachedResponse):
+        collection_slug, generation, collection_generation = key[:3]
+        if (
+            cache.listener is None
+            or generation != self.generation
+            or collection_generation != self.generations.get(collection_slug, 0)
+            or entry.size > self.max_bytes
+        ):
+            return
+        self._drop(key)
+        self.data[key] = entry
+        self.bytes += entry.size
+        while len(self.data) > self.maxsize or self.bytes > self.max_bytes:
+            _, evicted = self.data.popitem(last=False)
+            self.bytes -= evicted.size
+
+    def _drop(self, key):
+        entry = self.data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def pop(self, collection_slug):
+        self.generations[collection_slug] = self.generations.get(collection_slug, 0) + 1
+        for key in [key for key in self.data if key[0] == collection_slug]:
+            self._drop(key)
+
+    def clear(self):
+        super().clear()
+        self.bytes = 0
+
+    async def respond(
+        self,
+        collection_slug: str,
+        request: Request,
+        response: Response,
+        db: Database,
+        fetch: Callable[[], Awaitable],
+        model: Type[BaseModel],
+        many: bool = True,
+    ):
+        """Serve a read route from the cache, rendering it on a miss
+
+        fetch() runs the route's query and returns its records, or one
+        record when many is False. Requests that must read from the
+        primary bypass the cache, as does a single record that was not
+        found, which is returned as is.
+        """
+        if not db.read_only:
+            records = await fetch()
+            return json_records(records, model, response) if many else records
+
+        key = self.key(collection_slug, request)
+        entry = self.get(key)
+        if entry is not None:
+            metrics.RESPONSE_CACHE.labels("hit").inc()
+        else:
+            task = self.inflight.get(key)
+            if task is None:
+                metrics.RESPONSE_CACHE.labels("miss").inc()
+                task = asyncio.ensure_future(
+                    self._render(key, fetch, model, many, response)
+                )
+                self.inflight[key] = task
+                task.add_done_callback(lambda task: self._finished(key, task))
+            else:
+                metrics.RESPONSE_CACHE.labels("coalesced").inc()
+            # Shielded so a client going away does not cancel the query
+            # the other waiters share
+            entry = await asyncio.shield(task)
+            if not isinstance(entry, CachedResponse):
+                return entry
+        # The rendering request's headers (pagination links) first, then
+        # this request's own (validators)
+        headers = {**entry.headers, **dict(response.headers)}
+        return Response(entry.body, media_type="application/json", headers=headers)
+
+    async def _render(self, key, fetch, model, many, response):
+        records = await fetch()
+        row = project(model)
+        if many:
+            body = dumps([row(record) for record in records])
+        elif records:
+            body = dumps(row(records))
+        else:
+            return records
+        headers = dict(response.headers)
+        entry = CachedResponse(
+            time.monotonic() + self.ttl,
+            len(body) + sum(len(k) + len(v) for k, v in headers.items()),
+            body,
+            headers,
+        )
+        self.set(key, entry)
+        return entry
+
+    def _finished(self, key, task):
+        self.inflight.pop(key, None)
+        # Retrieve the exception so it is not reported as unhandled when
+        # every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+
+def response_cache(name: str, **kwargs) -> ResponseCache:
+    """Get or create the named ResponseCache for this worker"""
+    if name not in cache.caches:
+        cache.caches[name] = ResponseCache(name, **kwargs)
+    return cache.caches[name]
@@ -0,0 +1,58 @@
+from starlette.responses import StreamingResponse
+
+from .serialization import dumps
+
+# Number of rows encoded together before a chunk is handed to the server
+CHUNK_ROWS = 500
+
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+
+def encode_record(record) -> bytes:
+    return dumps(dict(record))
+
+
+async def ndjson_chunks(records):
+    chunk = []
+    async for record in records:
+        chunk.append(encode_record(record))
+        if len(chunk) >= CHUNK_ROWS:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+async def json_array_chunks(records):
+    chunk = []
+    separator = b"["
+    async for record in records:
+        chunk.append(separator + encode_record(record))
+        separator = b","
+        if len(chunk) >= CHUNK_ROWS:
+            yield b"".join(chunk)
+            chunk = []
+    if separator == b"[":
+        chunk.append(b"[")
+    chunk.append(b"]")
+    yield b"".join(chunk)
+
+
+def stream_records(records, format: str, headers=None) -> StreamingResponse:
+    """Wrap an async iterator of records in a StreamingResponse
+
+    format is one of STREAM_FORMATS: "ndjson" writes one object per line,
+    "json" writes a single JSON array incrementally.
+    """
+    if format == "ndjson":
+        body = ndjson_chunks(records)
+    else:
+        body = json_array_chunks(records)
+    return StreamingResponse(
+        body,
+        media_type=STREAM_FORMATS[format],
+        headers=None if headers is None else dict(headers),
+    )
@@ -0,0 +1,89 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+from .cache import LRUCache
+
+# Every worker and replica must share the secret, or tokens issued by one
+# are rejected by the others. Without it a random per-process secret is
+# used, which only suits a single worker in development.
+SECRET = os.environ.get("PRISM_TOKEN_SECRET", "").encode() or None
+TOKEN_TTL = int(os.environ.get("PRISM_TOKEN_TTL", 3600))
+VERIFIED_CACHE_SIZE = int(os.environ.get("PRISM_TOKEN_CACHE_SIZE", 1024))
+
+# JWT compatible header, so tokens can be inspected with the usual tools
+HEADER = {"alg": "HS256", "typ": "JWT"}
+
+if SECRET is None:
+    print("PRISM_TOKEN_SECRET is not set, using a random secret for this process")
+    SECRET = secrets.token_bytes(32)
+
+# token -> claims for tokens whose signature has already been checked
+verified = LRUCache(VERIFIED_CACHE_SIZE)
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _sign(signing_input: str) -> str:
+    return _encode(hmac.new(SECRET, signing_input.encode(), hashlib.sha256).digest())
+
+
+def issue(subject: str, ttl: int = TOKEN_TTL, **claims) -> str:
+    """Sign a token for subject that expires ttl seconds from now"""
+    now = int(time.time())
+    claims = {**claims, "sub": subject, "iat": now, "exp": now + ttl}
+    signing_input = ".".join(
+        _encode(json.dumps(part, separators=(",", ":")).encode())
+        for part in (HEADER, claims)
+    )
+    return f"{signing_input}.{_sign(signing_input)}"
+
+
+def verify(token: str) -> dict:
+    """Return the claims of a valid, unexpired token
+
+    Verification is in process only: an HMAC check and the expiry claim.
+    Tokens seen recently skip the HMAC and JSON decoding but are still
+    checked against their expiry on every call.
+    """
+    claims = verified.get(token)
+    if claims is None:
+        # Issued tokens are base64url, and compare_digest raises TypeError
+        # on a non-ASCII str
+        if not token.isascii():
+            raise InvalidToken("Malformed token")
+        try:
+            signing_input, signature = token.rsplit(".", 1)
+            header, payload = signing_input.split(".")
+        except ValueError:
+            raise InvalidToken("Malformed token")
+        if not hmac.compare_digest(signature, _sign(signing_input)):
+            raise InvalidToken("Invalid token signature")
+        try:
+            if json.loads(_decode(header)) != HEADER:
+                raise InvalidToken("Unsupported token header")
+            claims = json.loads(_decode(payload))
+        except (binascii.Error, ValueError):
+            raise InvalidToken("Malformed token")
+        if not isinstance(claims, dict) or "sub" not in claims or "exp" not in claims:
+            raise InvalidToken("Token is missing claims")
+        verified.set(token, claims)
+    if claims["exp"] <= time.time():
+        verified.pop(token)
+        raise InvalidToken("Token has expired")
+    return claims
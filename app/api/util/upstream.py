@@ -0,0 +1,93 @@
+import hashlib
+import httpx
+import os
+import time
+from fastapi import HTTPException
+
+from .cache import LRUCache
+from .metrics import UPSTREAM_LATENCY
+
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", 30))
+UPSTREAM_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", 20))
+UPSTREAM_CACHE_TTL = float(os.environ.get("UPSTREAM_CACHE_TTL", 60))
+UPSTREAM_CACHE_SIZE = int(os.environ.get("UPSTREAM_CACHE_SIZE", 64))
+
+client = None
+responses = LRUCache(UPSTREAM_CACHE_SIZE)
+
+
+class CachedResponse:
+    def __init__(self, data, etag: str, expires: float):
+        self.data = data
+        self.etag = etag
+        self.expires = expires
+
+
+async def setup():
+    global client
+    client = httpx.AsyncClient(
+        timeout=UPSTREAM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS,
+        ),
+    )
+
+
+async def close():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+def cache_key(url: str, params: dict, headers: dict) -> str:
+    # Headers (including Authorization) are part of the key since upstream
+    # responses depend on who is asking; hash them rather than keep them.
+    raw = repr((url, sorted(params.items()), sorted(headers.items())))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def get_json(url: str, params: dict = {}, headers: dict = {}):
+    """GET a JSON document from PathDB/NBIA through the shared client
+
+    Responses are cached for UPSTREAM_CACHE_TTL seconds. Once expired they
+    are revalidated with If-None-Match, so an unchanged upstream answers
+    with a 304 and no body. The returned data is shared between callers
+    and must not be modified.
+    """
+    key = cache_key(url, params, headers)
+    entry = responses.get(key)
+    now = time.monotonic()
+    if entry is not None and entry.expires > now:
+        return entry.data
+
+    request_headers = dict(headers)
+    if entry is not None and entry.etag:
+        request_headers["If-None-Match"] = entry.etag
+    host = httpx.URL(url).host
+    start = time.perf_counter()
+    try:
+        response = await client.get(url, params=params, headers=request_headers)
+    except httpx.TimeoutException:
+        UPSTREAM_LATENCY.labels(host, "timeout").observe(time.perf_counter() - start)
+        raise HTTPException(detail=f"Timed out waiting for {url}", status_code=504)
+    except httpx.RequestError as e:
+        UPSTREAM_LATENCY.labels(host, "error").observe(time.perf_counter() - start)
+        raise HTTPException(detail=f"Failed to reach {url}: {e}", status_code=502)
+    UPSTREAM_LATENCY.labels(host, response.status_code).observe(
+        time.perf_counter() - start
+    )
+
+    if response.status_code == 304 and entry is not None:
+        entry.expires = now + UPSTREAM_CACHE_TTL
+        return entry.data
+    if response.is_error:
+        raise HTTPException(detail=response.text, status_code=response.status_code)
+
+    data = response.json()
+    responses.set(
+        key,
+        CachedResponse(data, response.headers.get("etag"), now + UPSTREAM_CACHE_TTL),
+    )
+    return data
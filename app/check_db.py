@@ -1,14 +1,32 @@
 #!/usr/bin/env python3
 import asyncpg
 import asyncio
+import os
 import sys
+import time
+
+# How long to keep retrying before giving up, and the longest pause between
+# attempts; pauses start at half a second and double.
+STARTUP_TIMEOUT = float(os.environ.get("DB_STARTUP_TIMEOUT", 120))
+MAX_DELAY = 10
 
 async def run():
-    try:
-        conn = await asyncpg.connect()
-        await conn.close()
-    except:
-        sys.exit(1)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    delay = 0.5
+    while True:
+        try:
+            conn = await asyncpg.connect(timeout=MAX_DELAY)
+            await conn.close()
+            return
+        except Exception as e:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print("database not available:", e)
+                sys.exit(1)
+            delay = min(delay, remaining)
+            print(f"database not available yet ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_DELAY)
 
 loop = asyncio.get_event_loop()
 loop.run_until_complete(run())
@@ -1,29 +1,69 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Response
 
-from api.util import db
+from api.util import db, cache, jobs, metrics, upstream
 from api.routes import auth
+from api.routes import admin
 from api.routes import collections
 from api.routes import files
 from api.routes import datamanagers
 from api.routes import filetypes
 from api.routes import versions
+from api.routes import search
+from api.routes import jobs as job_routes
 
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 @app.on_event("startup")
 async def startup_event():
     print(20 * "#", "database connecting")
-    await db.setup(database="collection_manager")
+    await db.setup(database=db.database)
+    await cache.listen()
+    await upstream.setup()
+    jobs.start()
     print(20 * "#", "database connected")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await jobs.stop()
+    await cache.close()
+    await upstream.close()
+    metrics.mark_process_dead()
+    await db.close()
+
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the worker is up and its event loop is responsive"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz(response: Response):
+    """Readiness: the pool is warm and the database answers through it"""
+    reason = await db.not_ready()
+    if reason is not None:
+        response.status_code = 503
+        return {"status": "unavailable", "detail": reason}
+    return {"status": "ok"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
+
+
 router_v1 = APIRouter()
 router_v1.include_router(collections.router, prefix="/collections")
 router_v1.include_router(files.router, prefix="/files")
 router_v1.include_router(datamanagers.router, prefix="/datamanagers")
 router_v1.include_router(filetypes.router, prefix="/filetypes")
 router_v1.include_router(versions.router, prefix="/versions")
+router_v1.include_router(search.router, prefix="/search")
+router_v1.include_router(job_routes.router, prefix="/jobs")
+router_v1.include_router(admin.router, prefix="/admin")
 
 app.include_router(auth.router)
 app.include_router(router_v1, prefix="/v1")
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""Apply pending schema migrations from migrations/
+
+    ./migrate.py           apply everything pending
+    ./migrate.py --list    show which migrations are applied
+"""
+import argparse
+import asyncio
+import asyncpg
+
+from api.util import db
+from api.util import migrations
+
+
+async def run(args):
+    conn = await asyncpg.connect(database=args.database)
+    try:
+        if args.list:
+            done = await migrations.applied(conn)
+            for migration in migrations.available():
+                status = "applied" if migration.name in done else "pending"
+                print(f"{status:8} {migration.name}")
+        else:
+            names = await migrations.migrate(conn)
+            print(f"{len(names)} migration(s) applied")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default=db.database)
+    parser.add_argument("--list", action="store_true")
+    asyncio.run(run(parser.parse_args()))
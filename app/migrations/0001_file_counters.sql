@@ -0,0 +1,64 @@
+-- Maintained file counters on version and collection, so the collection
+-- endpoints no longer group over version_file on every read.
+
+alter table version add column if not exists file_count bigint not null default 0;
+alter table collection add column if not exists collection_file_count bigint not null default 0;
+
+comment on column version.file_count is 'Number of version_file rows for the version, maintained by the version_file_count triggers';
+comment on column collection.collection_file_count is 'Sum of file_count over the versions of the collection, maintained by the version_file_count triggers';
+
+create or replace function version_file_count() returns trigger as $$
+declare
+	sign integer := case when TG_OP = 'INSERT' then 1 else -1 end;
+begin
+	update version
+		set file_count = version.file_count + sign * delta.file_count
+		from (
+			select version_id, count(*) as file_count
+			from changed_rows
+			group by version_id
+		) delta
+		where version.version_id = delta.version_id;
+	update collection
+		set collection_file_count = collection.collection_file_count + sign * delta.file_count
+		from (
+			select collection_id, count(*) as file_count
+			from changed_rows
+			join version on version.version_id = changed_rows.version_id
+			group by collection_id
+		) delta
+		where collection.collection_id = delta.collection_id;
+	return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists version_file_count_insert on version_file;
+create trigger version_file_count_insert
+	after insert on version_file
+	referencing new table as changed_rows
+	for each statement execute function version_file_count();
+
+drop trigger if exists version_file_count_delete on version_file;
+create trigger version_file_count_delete
+	after delete on version_file
+	referencing old table as changed_rows
+	for each statement execute function version_file_count();
+
+-- Backfill the counters for data loaded before the triggers existed
+update version
+	set file_count = counts.file_count
+	from (
+		select version_id, count(*) as file_count
+		from version_file
+		group by version_id
+	) counts
+	where version.version_id = counts.version_id;
+
+update collection
+	set collection_file_count = counts.file_count
+	from (
+		select collection_id, sum(file_count) as file_count
+		from version
+		group by collection_id
+	) counts
+	where collection.collection_id = counts.collection_id;
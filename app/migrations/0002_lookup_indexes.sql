@@ -0,0 +1,15 @@
+-- no transaction
+-- Secondary indexes for the hot lookups. Built concurrently so a running
+-- deployment keeps serving writes while they are created.
+
+create index concurrently if not exists version_collection_id_idx
+	on version (collection_id, version_id);
+
+create index concurrently if not exists version_file_file_id_idx
+	on version_file (file_id);
+
+create index concurrently if not exists file_external_id_idx
+	on file (external_id);
+
+create index concurrently if not exists file_data_manager_id_idx
+	on file (data_manager_id);
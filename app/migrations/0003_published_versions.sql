@@ -0,0 +1,76 @@
+-- Published versions are frozen: their file list can no longer change, so
+-- their manifests can be served with strong ETags and cached indefinitely.
+-- Maintenance that must touch a frozen version can opt out per transaction
+-- with: set local prism.allow_frozen_edits = on
+
+alter table version add column if not exists published_on timestamp;
+
+comment on column version.published_on is 'When the version was published; published versions reject changes to their version_file rows';
+
+create or replace function frozen_edits_allowed() returns boolean as $$
+	select coalesce(current_setting('prism.allow_frozen_edits', true), '') = 'on';
+$$ language sql stable;
+
+create or replace function version_file_frozen() returns trigger as $$
+declare
+	frozen integer;
+begin
+	if frozen_edits_allowed() then
+		return null;
+	end if;
+	select version.version_id into frozen
+		from changed_rows
+		join version on version.version_id = changed_rows.version_id
+		where version.published_on is not null
+		limit 1;
+	if frozen is not null then
+		raise exception 'Version % is published and can no longer be changed', frozen
+			using errcode = 'object_not_in_prerequisite_state';
+	end if;
+	return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists version_file_frozen_insert on version_file;
+create trigger version_file_frozen_insert
+	after insert on version_file
+	referencing new table as changed_rows
+	for each statement execute function version_file_frozen();
+
+drop trigger if exists version_file_frozen_delete on version_file;
+create trigger version_file_frozen_delete
+	after delete on version_file
+	referencing old table as changed_rows
+	for each statement execute function version_file_frozen();
+
+-- version_file rows are only ever inserted or deleted, but an update could
+-- move a row into or out of a published version
+drop trigger if exists version_file_frozen_update_old on version_file;
+create trigger version_file_frozen_update_old
+	after update on version_file
+	referencing old table as changed_rows
+	for each statement execute function version_file_frozen();
+
+drop trigger if exists version_file_frozen_update_new on version_file;
+create trigger version_file_frozen_update_new
+	after update on version_file
+	referencing new table as changed_rows
+	for each statement execute function version_file_frozen();
+
+-- Publishing is one way
+create or replace function version_publish_once() returns trigger as $$
+begin
+	if not frozen_edits_allowed() then
+		raise exception 'Version % is published and can no longer be changed', old.version_id
+			using errcode = 'object_not_in_prerequisite_state';
+	end if;
+	return new;
+end;
+$$ language plpgsql;
+
+drop trigger if exists version_publish_once on version;
+create trigger version_publish_once
+	before update of published_on on version
+	for each row
+	when (old.published_on is not null and new.published_on is distinct from old.published_on)
+	execute function version_publish_once();
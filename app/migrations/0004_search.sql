@@ -0,0 +1,21 @@
+-- no transaction
+-- Indexes behind /v1/search: full-text over collection names and
+-- descriptions, trigram matching over collection names and file
+-- external_ids (PathDB slide ids and the like are substrings of the URL).
+
+create extension if not exists pg_trgm;
+
+alter table collection add column if not exists collection_tsv tsvector
+	generated always as (
+		setweight(to_tsvector('english', coalesce(collection_name, '')), 'A') ||
+		setweight(to_tsvector('english', coalesce(collection_description, '')), 'B')
+	) stored;
+
+create index concurrently if not exists collection_tsv_idx
+	on collection using gin (collection_tsv);
+
+create index concurrently if not exists collection_name_trgm_idx
+	on collection using gin (collection_name gin_trgm_ops);
+
+create index concurrently if not exists file_external_id_trgm_idx
+	on file using gin (external_id gin_trgm_ops);
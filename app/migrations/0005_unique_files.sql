@@ -0,0 +1,45 @@
+-- A file is identified by its data manager and external_id. Imports used
+-- to insert a new file row every time, so re-importing a collection
+-- duplicated its files. Merge the duplicates into the oldest row, point
+-- every version_file reference at it and enforce uniqueness from now on.
+--
+-- Published versions are rewritten too: their file lists stay the same
+-- external files, but duplicate file_ids are replaced by the kept one.
+
+set local prism.allow_frozen_edits = on;
+
+-- Keep imports out until the constraint is in place
+lock table file, version_file in share row exclusive mode;
+
+create temporary table file_duplicate on commit drop as
+	select file_id, kept_file_id
+	from (
+		select
+			file_id,
+			min(file_id) over (partition by data_manager_id, external_id) as kept_file_id
+		from file
+	) files
+	where file_id <> kept_file_id;
+
+-- Versions holding both a duplicate and the kept file end up with one row;
+-- the counter triggers see the delete and keep file_count in step.
+insert into version_file (version_id, file_id)
+	select distinct version_id, kept_file_id
+	from version_file
+	join file_duplicate on file_duplicate.file_id = version_file.file_id
+	on conflict do nothing;
+
+delete from version_file
+	using file_duplicate
+	where version_file.file_id = file_duplicate.file_id;
+
+delete from file
+	using file_duplicate
+	where file.file_id = file_duplicate.file_id;
+
+alter table file
+	add constraint file_data_manager_id_external_id_key
+	unique (data_manager_id, external_id);
+
+-- The unique index leads with data_manager_id and serves its lookups
+drop index if exists file_data_manager_id_idx;
@@ -0,0 +1,33 @@
+-- Queue for long-running operations (large imports, version clones) that
+-- the API's job workers process in chunks. Each chunk commits together
+-- with job_cursor and job_progress, so a restarted worker resumes after
+-- the last committed chunk. A running job whose job_heartbeat_on is older
+-- than the lease is taken over by another worker.
+
+create table if not exists job (
+	job_id serial primary key,
+	job_kind text not null,
+	job_params jsonb not null default '{}',
+	job_state text not null default 'queued'
+		check (job_state in ('queued', 'running', 'done', 'failed', 'cancelled')),
+	job_cursor jsonb,
+	job_progress bigint not null default 0,
+	job_total bigint,
+	job_result jsonb,
+	job_error text,
+	job_cancel_requested boolean not null default false,
+	job_worker text,
+	job_created_by text,
+	job_created_on timestamp not null default now(),
+	job_started_on timestamp,
+	job_heartbeat_on timestamp,
+	job_finished_on timestamp
+);
+
+comment on column job.job_cursor is 'Where the next chunk starts, written by the job kind in the same transaction as the chunk';
+comment on column job.job_worker is 'Worker holding the job; a chunk only commits while it still holds it';
+
+-- Workers only ever look for unfinished jobs
+create index if not exists job_unfinished_idx
+	on job (job_id)
+	where job_state in ('queued', 'running');
@@ -0,0 +1,63 @@
+-- File counts of each version per data manager and file type, so the
+-- breakdown endpoint reads a handful of rows instead of grouping over
+-- every file of the version. File type groups are joined in when reading:
+-- the table is small and regrouping a file type then needs no recount.
+
+create table if not exists version_stats (
+	version_id integer not null references version,
+	data_manager_id integer not null references data_manager,
+	file_type_id integer not null references file_type,
+	stats_file_count bigint not null,
+	primary key (version_id, data_manager_id, file_type_id)
+);
+
+comment on table version_stats is 'Number of version_file rows per version, data manager and file type, maintained by the version_file_stats triggers';
+
+create or replace function version_file_stats() returns trigger as $$
+declare
+	sign integer := case when TG_OP = 'INSERT' then 1 else -1 end;
+begin
+	-- Taken in key order so concurrent imports into one version do not
+	-- deadlock on each other's rows
+	insert into version_stats
+		(version_id, data_manager_id, file_type_id, stats_file_count)
+		select
+			changed_rows.version_id, file.data_manager_id, file.file_type_id,
+			sign * count(*)
+		from changed_rows
+		join file on file.file_id = changed_rows.file_id
+		group by changed_rows.version_id, file.data_manager_id, file.file_type_id
+		order by changed_rows.version_id, file.data_manager_id, file.file_type_id
+		on conflict (version_id, data_manager_id, file_type_id) do update
+			set stats_file_count = version_stats.stats_file_count + excluded.stats_file_count;
+	if TG_OP = 'DELETE' then
+		delete from version_stats
+			where version_id in (select version_id from changed_rows)
+			  and stats_file_count <= 0;
+	end if;
+	return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists version_file_stats_insert on version_file;
+create trigger version_file_stats_insert
+	after insert on version_file
+	referencing new table as changed_rows
+	for each statement execute function version_file_stats();
+
+drop trigger if exists version_file_stats_delete on version_file;
+create trigger version_file_stats_delete
+	after delete on version_file
+	referencing old table as changed_rows
+	for each statement execute function version_file_stats();
+
+-- Backfill. Creating the triggers locked out writes to version_file until
+-- this migration commits, so no link is counted twice or missed.
+delete from version_stats;
+
+insert into version_stats
+	(version_id, data_manager_id, file_type_id, stats_file_count)
+	select version_id, data_manager_id, file_type_id, count(*)
+	from version_file
+	join file on file.file_id = version_file.file_id
+	group by version_id, data_manager_id, file_type_id;
@@ -0,0 +1,301 @@
+-- Delta storage for version membership. Successive versions of a
+-- collection mostly share their files, yet version_file holds one row per
+-- file for every version. A version with delta_depth > 0 instead records
+-- its parent_version_id and, in version_delta, the files it added or
+-- removed relative to the parent. A version with delta_depth 0 is a
+-- snapshot whose files are all in version_file, as before. delta_depth
+-- counts the deltas between a version and its snapshot, so resolving a
+-- version never walks more than that many parents.
+--
+-- version_members() resolves the files of any version; membership writes
+-- go through add_version_files() so delta versions stay consistent.
+
+alter table version add column if not exists parent_version_id integer references version;
+alter table version add column if not exists delta_depth integer not null default 0;
+
+comment on column version.parent_version_id is 'Version this one was cloned from; its files are resolved through it when delta_depth > 0';
+comment on column version.delta_depth is 'Number of deltas between this version and the snapshot its files are resolved from; 0 when all its files are in version_file';
+
+create table if not exists version_delta (
+	version_id integer not null references version,
+	file_id integer not null references file,
+	delta_added boolean not null,
+	primary key (version_id, file_id)
+);
+
+comment on table version_delta is 'Files added to (delta_added) or removed from a delta version relative to its parent; added files are never members of the parent, removed files always are';
+
+create index if not exists version_delta_file_id_idx
+	on version_delta (file_id);
+
+-- Published delta versions are frozen like their version_file rows
+drop trigger if exists version_delta_frozen_insert on version_delta;
+create trigger version_delta_frozen_insert
+	after insert on version_delta
+	referencing new table as changed_rows
+	for each statement execute function version_file_frozen();
+
+drop trigger if exists version_delta_frozen_delete on version_delta;
+create trigger version_delta_frozen_delete
+	after delete on version_delta
+	referencing old table as changed_rows
+	for each statement execute function version_file_frozen();
+
+drop trigger if exists version_delta_frozen_update on version_delta;
+create trigger version_delta_frozen_update
+	after update on version_delta
+	referencing new table as changed_rows
+	for each statement execute function version_file_frozen();
+
+-- The version and its ancestors up to its snapshot, which comes last
+create or replace function version_chain(member_version_id integer) returns integer[] as $$
+	with recursive chain as (
+		select version_id, parent_version_id, delta_depth
+		from version
+		where version_id = member_version_id
+		union all
+		select version.version_id, version.parent_version_id, version.delta_depth
+		from chain
+		join version on version.version_id = chain.parent_version_id
+		where chain.delta_depth > 0
+	)
+	select array_agg(version_id order by delta_depth desc) from chain
+$$ language sql stable;
+
+-- The query listing the file_ids of a version above $1, in file_id order,
+-- at most max_rows of them. A file's nearest delta in the chain decides
+-- whether it is a member; files no delta mentions are members if the
+-- snapshot has them. Each version of the chain is read in file_id order
+-- from its primary key and the reads are merged, so a page of a listing
+-- reads about a page from each instead of every delta of the chain. The
+-- chain goes into the query as constants: with it as a parameter the
+-- planner cannot tell the reads apart and falls back to scanning all of
+-- version_delta.
+create or replace function version_members_query(
+	member_version_id integer,
+	max_rows bigint default null
+) returns text as $$
+declare
+	chain integer[] := version_chain(member_version_id);
+	depth integer := coalesce(cardinality(chain), 0);
+	changes text[] := '{}';
+begin
+	if depth = 0 then
+		return 'select null::integer where false';
+	end if;
+	if depth = 1 then
+		return format(
+			'select file_id from version_file'
+			' where version_id = %s and file_id > $1'
+			' order by file_id limit %s',
+			chain[1], coalesce(max_rows::text, 'all')
+		);
+	end if;
+	for distance in 1 .. depth - 1 loop
+		changes := changes || format(
+			'(select file_id, delta_added as member, %s as distance'
+			' from version_delta where version_id = %s and file_id > $1'
+			' order by file_id)',
+			distance, chain[distance]
+		);
+	end loop;
+	changes := changes || format(
+		'(select file_id, true, %s from version_file'
+		' where version_id = %s and file_id > $1'
+		' order by file_id)',
+		depth, chain[depth]
+	);
+	return format(
+		'select file_id from ('
+		' select distinct on (file_id) file_id, member from (%s) ranked'
+		' order by file_id, distance'
+		') resolved where member order by file_id limit %s',
+		array_to_string(changes, ' union all '), coalesce(max_rows::text, 'all')
+	);
+end;
+$$ language plpgsql stable;
+
+-- The file_ids of a version above after, in file_id order, at most
+-- max_rows of them
+create or replace function version_members(
+	member_version_id integer,
+	after integer default 0,
+	max_rows bigint default null
+) returns setof integer as $$
+begin
+	return query execute version_members_query(member_version_id, max_rows)
+		using after;
+end;
+$$ language plpgsql stable;
+
+-- Apply a change of file_ids (distinct, all gained or all lost) to the
+-- counters of a delta version. Snapshots are counted by the version_file
+-- triggers instead.
+create or replace function version_delta_counts(
+	counted_version_id integer,
+	file_ids integer[],
+	sign integer
+) returns void as $$
+begin
+	update version
+		set file_count = file_count + sign * cardinality(file_ids)
+		where version_id = counted_version_id;
+	update collection
+		set collection_file_count = collection_file_count + sign * cardinality(file_ids)
+		from version
+		where version.version_id = counted_version_id
+		  and collection.collection_id = version.collection_id;
+	insert into version_stats
+		(version_id, data_manager_id, file_type_id, stats_file_count)
+		select counted_version_id, data_manager_id, file_type_id, sign * count(*)
+		from file
+		where file_id = any(file_ids)
+		group by data_manager_id, file_type_id
+		order by data_manager_id, file_type_id
+		on conflict (version_id, data_manager_id, file_type_id) do update
+			set stats_file_count = version_stats.stats_file_count + excluded.stats_file_count;
+	delete from version_stats
+		where version_id = counted_version_id
+		  and stats_file_count <= 0;
+end;
+$$ language plpgsql;
+
+-- Turn an empty, just created version into a delta of parent, without
+-- removed_file_ids (distinct members of the parent)
+create or replace function store_version_delta(
+	delta_version_id integer,
+	parent integer,
+	removed_file_ids integer[] default '{}'
+) returns void as $$
+declare
+	parent_count bigint;
+begin
+	update version
+		set parent_version_id = parent,
+			delta_depth = parent_version.delta_depth + 1,
+			file_count = parent_version.file_count
+		from version as parent_version
+		where version.version_id = delta_version_id
+		  and parent_version.version_id = parent
+		returning parent_version.file_count into parent_count;
+	update collection
+		set collection_file_count = collection_file_count + parent_count
+		from version
+		where version.version_id = delta_version_id
+		  and collection.collection_id = version.collection_id;
+	insert into version_stats
+		(version_id, data_manager_id, file_type_id, stats_file_count)
+		select delta_version_id, data_manager_id, file_type_id, stats_file_count
+		from version_stats
+		where version_id = parent;
+	insert into version_delta (version_id, file_id, delta_added)
+		select delta_version_id, file_id, false
+		from unnest(removed_file_ids) as removed(file_id);
+	perform version_delta_counts(delta_version_id, removed_file_ids, -1);
+end;
+$$ language plpgsql;
+
+-- Add file_ids to a version however it is stored, returning those that
+-- were not members yet
+create or replace function add_version_files(
+	target_version_id integer,
+	file_ids integer[]
+) returns setof integer as $$
+declare
+	depth integer;
+	chain integer[];
+	added integer[];
+	restored integer[];
+	frozen_edits text;
+begin
+	-- The counter update locks the version row for the rest of the
+	-- transaction either way; taking it first keeps two imports from both
+	-- adding the same file to a delta
+	select delta_depth into depth
+		from version
+		where version_id = target_version_id
+		for no key update;
+
+	if depth > 0 then
+		chain := version_chain(target_version_id);
+		select coalesce(array_agg(new.file_id), '{}') into added
+			from (select distinct unnest(file_ids) as file_id) new
+			where not coalesce(
+				(
+					select delta_added
+					from version_delta
+					join unnest(chain) with ordinality as ancestor(version_id, distance)
+						on ancestor.version_id = version_delta.version_id
+					where version_delta.file_id = new.file_id
+					order by distance
+					limit 1
+				),
+				exists (
+					select
+					from version_file
+					where version_id = chain[cardinality(chain)]
+					  and version_file.file_id = new.file_id
+				)
+			);
+		-- Files this version had removed come back through the parent
+		with deleted as (
+			delete from version_delta
+			where version_id = target_version_id
+			  and file_id = any(added)
+			  and not delta_added
+			returning file_id
+		)
+		select coalesce(array_agg(file_id), '{}') into restored from deleted;
+		insert into version_delta (version_id, file_id, delta_added)
+			select target_version_id, file_id, true
+			from unnest(added) as new(file_id)
+			where file_id <> all(restored);
+		perform version_delta_counts(target_version_id, added, 1);
+	else
+		with inserted as (
+			insert into version_file (version_id, file_id)
+			select distinct target_version_id, unnest(file_ids)
+			on conflict do nothing
+			returning file_id
+		)
+		select coalesce(array_agg(file_id), '{}') into added from inserted;
+	end if;
+
+	if cardinality(added) = 0 then
+		return;
+	end if;
+
+	-- Delta versions of this one must not gain the files: they were not
+	-- members when the delta was taken. Added rows of theirs turn into
+	-- inherited files, the rest into removed rows. Their file lists stay the
+	-- same, so this applies to published ones too.
+	frozen_edits := coalesce(current_setting('prism.allow_frozen_edits', true), '');
+	perform set_config('prism.allow_frozen_edits', 'on', true);
+	with children as (
+		select version_id
+		from version
+		where parent_version_id = target_version_id
+		  and delta_depth > 0
+	),
+	inherited as (
+		delete from version_delta
+		using children
+		where version_delta.version_id = children.version_id
+		  and version_delta.file_id = any(added)
+		  and version_delta.delta_added
+		returning version_delta.version_id, version_delta.file_id
+	)
+	insert into version_delta (version_id, file_id, delta_added)
+		select children.version_id, new.file_id, false
+		from children, unnest(added) as new(file_id)
+		where not exists (
+			select
+			from inherited
+			where inherited.version_id = children.version_id
+			  and inherited.file_id = new.file_id
+		);
+	perform set_config('prism.allow_frozen_edits', frozen_edits, true);
+
+	return query select unnest(added);
+end;
+$$ language plpgsql;
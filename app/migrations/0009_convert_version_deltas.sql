@@ -0,0 +1,60 @@
+-- Store existing versions as deltas of the previous version of their
+-- collection, where that takes fewer rows than half their files and the
+-- chain of deltas stays under 10 (VERSION_SNAPSHOT_INTERVAL's default).
+-- The others stay snapshots. File lists do not change, so neither do the
+-- counters, and published versions are converted too.
+
+set local prism.allow_frozen_edits = on;
+
+-- Rows move from version_file to version_delta without any version
+-- gaining or losing a file: keep the counter and stats triggers from
+-- counting the move. This also keeps writers out until the commit.
+alter table version_file disable trigger user;
+
+do $$
+declare
+	converted record;
+	depth integer;
+	changed bigint;
+begin
+	for converted in
+		select
+			version_id, file_count,
+			lag(version_id) over (partition by collection_id order by version_id) as parent
+		from version
+		order by version_id
+	loop
+		continue when converted.parent is null;
+		select delta_depth + 1 into depth
+			from version
+			where version_id = converted.parent;
+		continue when depth >= 10;
+
+		-- The parent may have been converted already; its members are the same
+		insert into version_delta (version_id, file_id, delta_added)
+			select converted.version_id, coalesce(own.file_id, parent_files.file_id), own.file_id is not null
+			from (
+				select file_id
+				from version_file
+				where version_id = converted.version_id
+			) own
+			full join version_members(converted.parent) as parent_files(file_id)
+				on parent_files.file_id = own.file_id
+			where own.file_id is null
+			   or parent_files.file_id is null;
+		get diagnostics changed = row_count;
+		if changed * 2 >= converted.file_count then
+			delete from version_delta where version_id = converted.version_id;
+			continue;
+		end if;
+
+		update version
+			set parent_version_id = converted.parent,
+				delta_depth = depth
+			where version_id = converted.version_id;
+		delete from version_file where version_id = converted.version_id;
+	end loop;
+end;
+$$;
+
+alter table version_file enable trigger user;
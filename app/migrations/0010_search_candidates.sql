@@ -0,0 +1,11 @@
+-- no transaction
+-- File search ranks its first candidates by trigram similarity. A GIN
+-- index only finds the matches, in no particular order; a GiST index
+-- also returns them nearest first (external_id <-> query), so the best
+-- matches can be taken without ranking every match. It serves the ILIKE
+-- filter as well, so it replaces the GIN index.
+
+create index concurrently if not exists file_external_id_trgm_gist_idx
+	on file using gist (external_id gist_trgm_ops);
+
+drop index concurrently if exists file_external_id_trgm_idx;
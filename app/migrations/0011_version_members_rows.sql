@@ -0,0 +1,7 @@
+-- The planner takes a set returning function to return 1000 rows, so with
+-- a page of a version it joins file by walking file_pkey from the start
+-- up to the page's last file_id instead of looking the page's files up.
+-- Listings resolve a page of about 100 file_ids, so plan for that; whole
+-- version reads are looked up file by file either way.
+
+alter function version_members(integer, integer, bigint) rows 100;
@@ -1,10 +1,17 @@
 #!/bin/sh
 
+# Each uvicorn worker writes its metrics here so /metrics can aggregate them
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prism_metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Waits for the database with backoff, up to DB_STARTUP_TIMEOUT seconds
 ./check_db.py
-if [ $? -eq 0 ]
+if [ $? -ne 0 ]
 then
-  uvicorn --workers $API_WORKERS --host 0.0.0.0 --port $API_PORT main:app
-else
-  echo "The database is not available yet, exiting."
+  echo "The database did not become available, exiting."
   exit 1
 fi
+
+./migrate.py || exit 1
+uvicorn --workers $API_WORKERS --host 0.0.0.0 --port $API_PORT main:app
@@ -66,4 +66,7 @@ insert into data_manager
 insert into data_manager
 	(data_manager_name)
 	values
-	('pathDB');
\ No newline at end of file
+	('pathDB');
+
+-- Schema changes after this baseline live in migrations/ and are applied
+-- by migrate.py when the API starts.
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Check that the hot route queries are planned with indexes
+
+Runs EXPLAIN for the hot route queries, built by the route modules
+themselves, against a database seeded by seed.py, with sequential scans
+disabled so the planner only picks one when no index can serve the
+lookup. Exits with status 1 if a plan does not use the index
+expected for it, or still reads file, version_file, version_delta or version
+end to end, either sequentially or by walking a whole index.
+
+    ./check_plans.py --database prism_bench
+"""
+import argparse
+import asyncio
+import asyncpg
+import json
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+sys.path.insert(0, APP_DIR)
+
+from api.routes import collections, files, search, versions  # noqa: E402
+from api.util.pagination import KeysetPage, RankedPage  # noqa: E402
+
+TABLES = {"file", "version_file", "version_delta", "version"}
+
+PATHDB_URL = "http://pathdb.example/caMicroscope/apps/viewer/viewer.html?slideId=1-1"
+
+
+def first_page(column: str, descending: bool = False, tiebreak=None) -> KeysetPage:
+    return KeysetPage(column, column, descending, 100, None, None, None, tiebreak)
+
+
+def ranked_page(rank: str, key: str, tiebreak=None) -> RankedPage:
+    return RankedPage(rank, key, 100, None, None, None, tiebreak)
+
+
+def route_queries():
+    """(route, query, sample parameters, index the plan must use), with the
+    queries built by the routes themselves"""
+    queries = [
+        (
+            "latest version",
+            versions.latest_version_query,
+            [1],
+            "version_collection_id_idx",
+        ),
+        (
+            "collection by slug",
+            collections.collection_id_query,
+            ["bench-1"],
+            "collection_collection_slug_key",
+        ),
+        (
+            "GET /collections/{slug}/{version_id}",
+            collections.collection_version_query,
+            ["bench-1", 1],
+            "version_pkey",
+        ),
+        (
+            "GET /collections/{slug}/{version_id}/stats",
+            collections.version_stats_query,
+            [1],
+            "version_stats_pkey",
+        ),
+        (
+            "GET /files/{file_id}",
+            files.file_by_id_query,
+            [1],
+            "file_pkey",
+        ),
+        (
+            "POST /files/import",
+            files.import_file_query,
+            [1, 1, PATHDB_URL],
+            "file_data_manager_id_external_id_key",
+        ),
+        (
+            "GET /files/{slug}/{version_id}/export",
+            files.manifest_query,
+            ["bench-1", 2],
+            "file_pkey",
+        ),
+    ]
+
+    parameters = ["bench-1"]
+    query = versions.versions_query(
+        parameters, first_page("version_id", descending=True)
+    )
+    queries.append(
+        ("GET /versions/{slug}", query, parameters, "version_collection_id_idx")
+    )
+
+    parameters = ["bench-1", 2]
+    page = first_page("file_id", tiebreak="file_type_group_name")
+    query = files.files_page_query(parameters, 2, page)
+    queries.append(("GET /files/{slug}/{version_id}", query, parameters, "file_pkey"))
+
+    parameters = [1]
+    query = files.registered_files_query(parameters, 2)
+    queries.append(("POST /files/sync/pathdb/{slug}", query, parameters, "file_pkey"))
+
+    parameters = []
+    page = ranked_page("rank", "file_id", tiebreak="file_type_group_name")
+    query = search.file_search_query(
+        parameters, "slideId=3-4711", None, None, None, page
+    )
+    queries.append(
+        ("GET /search/files", query, parameters, "file_external_id_trgm_gist_idx")
+    )
+
+    parameters = ["synthetic"]
+    query = search.collection_search_query(
+        parameters, ranked_page("rank", "collection_id")
+    )
+    queries.append(("GET /search/collections", query, parameters, "collection_tsv_idx"))
+    return queries
+
+
+# version_members() plans the query from version_members_query() for each
+# call, so that query is checked on its own: (description, query picking a
+# version, index the plan must use). Skipped when no version qualifies.
+MEMBER_QUERIES = [
+    (
+        "version_members, snapshot",
+        "select max(version_id) from version where delta_depth = 0",
+        "version_file_pkey",
+    ),
+    (
+        "version_members, delta",
+        "select max(version_id) from version where delta_depth > 0",
+        "version_delta_pkey",
+    ),
+]
+
+
+def full_scans(node: dict):
+    """Tables read end to end: a seq scan, or an index walk without a condition"""
+    if node.get("Relation Name") in TABLES:
+        if node["Node Type"] == "Seq Scan" or (
+            node["Node Type"] in ("Index Scan", "Index Only Scan")
+            and "Index Cond" not in node
+        ):
+            yield node["Relation Name"]
+    for child in node.get("Plans", []):
+        yield from full_scans(child)
+
+
+def indexes(node: dict):
+    if "Index Name" in node:
+        yield node["Index Name"]
+    # The unique index an INSERT ... ON CONFLICT checks
+    yield from node.get("Conflict Arbiter Indexes", [])
+    for child in node.get("Plans", []):
+        yield from indexes(child)
+
+
+async def check_plan(conn, route, query, parameters, index) -> bool:
+    plan = await conn.fetchval(f"explain (format json) {query}", *parameters)
+    plan = json.loads(plan)[0]["Plan"]
+    scanned = sorted(set(full_scans(plan)))
+    if scanned:
+        print(f"FAIL {route}: full scan of {', '.join(scanned)}")
+        return False
+    if index not in set(indexes(plan)):
+        print(f"FAIL {route}: does not use {index}")
+        return False
+    print(f"ok   {route}")
+    return True
+
+
+async def check(args):
+    conn = await asyncpg.connect(database=args.database)
+    failures = 0
+    try:
+        await conn.execute("set enable_seqscan = off")
+        for route, query, parameters, index in route_queries():
+            if not await check_plan(conn, route, query, parameters, index):
+                failures += 1
+        for route, version_query, index in MEMBER_QUERIES:
+            version_id = await conn.fetchval(version_query)
+            if version_id is None:
+                print(f"skip {route}: no such version")
+                continue
+            query = await conn.fetchval(
+                "select version_members_query($1, 101)", version_id
+            )
+            if not await check_plan(conn, route, query, [0], index):
+                failures += 1
+    finally:
+        await conn.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="prism_bench")
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(check(args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
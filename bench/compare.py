@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Compare two load.py reports and flag latency regressions
+
+    ./compare.py results/before.json results/after.json --threshold 10
+
+Exits with status 1 if any scenario's p95 grew by more than threshold
+percent, or if it started returning errors.
+"""
+import argparse
+import json
+import sys
+
+METRICS = ["p50_ms", "p95_ms", "p99_ms", "throughput"]
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return 100 * (after - before) / before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    before = json.load(open(args.before))["scenarios"]
+    after = json.load(open(args.after))["scenarios"]
+
+    print(f"{'scenario':28}" + "".join(f"{metric:>22}" for metric in METRICS))
+    regressions = []
+    for name in sorted(set(before) & set(after)):
+        cells = []
+        for metric in METRICS:
+            delta = change(before[name][metric], after[name][metric])
+            text = (
+                f"{after[name][metric]:.1f}" if after[name][metric] is not None else "-"
+            )
+            if delta is not None:
+                text += f" ({delta:+.1f}%)"
+            cells.append(f"{text:>22}")
+        print(f"{name:28}" + "".join(cells))
+
+        p95 = change(before[name]["p95_ms"], after[name]["p95_ms"])
+        if p95 is not None and p95 > args.threshold:
+            regressions.append(f"{name}: p95 {p95:+.1f}%")
+        if after[name]["errors"] > before[name]["errors"]:
+            regressions.append(
+                f"{name}: errors {before[name]['errors']} -> {after[name]['errors']}"
+            )
+
+    for name in sorted(set(before) ^ set(after)):
+        print(f"{name:28} only in {'before' if name in before else 'after'}")
+
+    if regressions:
+        print("\nregressions:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
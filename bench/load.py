@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Drive the PRISM API at a fixed concurrency and report latency percentiles
+
+Targets are sampled from a database seeded by seed.py, so runs against the
+same seed and scale are comparable. Read and import paths are separate
+suites since imports change the data the reads see.
+
+    ./load.py --suite read --concurrency 16 --requests 500 \
+        --output results/read-$(git rev-parse --short HEAD).json
+"""
+import argparse
+import asyncio
+import asyncpg
+import httpx
+import json
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": len(latencies) / elapsed if elapsed else None,
+        "mean_ms": 1000 * sum(ordered) / len(ordered) if ordered else None,
+        "p50_ms": 1000 * percentile(ordered, 0.50) if ordered else None,
+        "p95_ms": 1000 * percentile(ordered, 0.95) if ordered else None,
+        "p99_ms": 1000 * percentile(ordered, 0.99) if ordered else None,
+        "max_ms": 1000 * ordered[-1] if ordered else None,
+    }
+
+
+async def sample_targets(database: str, rng: random.Random) -> dict:
+    conn = await asyncpg.connect(database=database)
+    try:
+        versions = await conn.fetch(
+            """
+            select collection_slug, version_id
+            from collection natural join version
+            where collection_slug like 'bench-%'
+            order by version_id
+            """
+        )
+        # The same seed samples the same pages of an unchanged table
+        files = await conn.fetch(
+            """
+            select file_id, external_id
+            from file tablesample system (1) repeatable ($1)
+            order by file_id
+            """,
+            rng.random(),
+        )
+    finally:
+        await conn.close()
+    if not versions:
+        raise SystemExit(f"{database} has no bench collections, run seed.py first")
+    files = rng.sample(list(files), min(len(files), 1000))
+    return {
+        "versions": [(row["collection_slug"], row["version_id"]) for row in versions],
+        "file_ids": [row["file_id"] for row in files] or [1],
+        "external_ids": [row["external_id"] for row in files] or ["slideId=1-1"],
+        "rng": rng,
+    }
+
+
+def read_scenarios(targets: dict) -> dict:
+    """The read routes in main.py that need no login, as request factories"""
+    rng = targets["rng"]
+
+    def version():
+        return rng.choice(targets["versions"])
+
+    def slide_id():
+        # The slide id fragment of a PathDB viewer URL seeded by seed.py
+        external_id = rng.choice(targets["external_ids"])
+        return external_id.split("slideId=")[-1].split("&")[0]
+
+    return {
+        "collections_list": lambda: ("GET", "/v1/collections/", {}),
+        "collections_page": lambda: ("GET", "/v1/collections/?limit=10", {}),
+        "collection_info": lambda: ("GET", f"/v1/collections/{version()[0]}", {}),
+        "collection_version_info": lambda: (
+            "GET",
+            "/v1/collections/{}/{}".format(*version()),
+            {},
+        ),
+        "collection_stats": lambda: (
+            "GET",
+            "/v1/collections/{}/{}/stats".format(*version()),
+            {},
+        ),
+        "versions_list": lambda: ("GET", f"/v1/versions/{version()[0]}", {}),
+        "files_list": lambda: ("GET", "/v1/files/{}/{}".format(*version()), {}),
+        "files_page": lambda: (
+            "GET",
+            "/v1/files/{}/{}?limit=100".format(*version()),
+            {},
+        ),
+        "files_stream": lambda: (
+            "GET",
+            "/v1/files/{}/{}?stream=ndjson".format(*version()),
+            {},
+        ),
+        "files_export_csv": lambda: (
+            "GET",
+            "/v1/files/{}/{}/export".format(*version()),
+            {"headers": {"Accept": "text/csv"}},
+        ),
+        "files_export_arrow": lambda: (
+            "GET",
+            "/v1/files/{}/{}/export".format(*version()),
+            {"headers": {"Accept": "application/vnd.apache.arrow.stream"}},
+        ),
+        "file": lambda: ("GET", f"/v1/files/{rng.choice(targets['file_ids'])}", {}),
+        # A viewer showing a selection of slides
+        "files_batch": lambda: (
+            "POST",
+            "/v1/files/batch",
+            {"json": {"file_ids": rng.choices(targets["file_ids"], k=500)}},
+        ),
+        "search_collections": lambda: (
+            "GET",
+            "/v1/search/collections",
+            {"params": {"q": f"collection {version()[0].split('-')[-1]}"}},
+        ),
+        "search_files": lambda: (
+            "GET",
+            "/v1/search/files",
+            {"params": {"q": slide_id()}},
+        ),
+        "datamanagers": lambda: ("GET", "/v1/datamanagers/", {}),
+        "filetypes": lambda: ("GET", "/v1/filetypes/", {}),
+        "filetype_groups": lambda: ("GET", "/v1/filetypes/groups", {}),
+    }
+
+
+def import_scenarios(targets: dict, batch_size: int) -> dict:
+    rng = targets["rng"]
+    run = f"{time.time():.0f}"
+    counter = iter(range(10**12))
+
+    def upload():
+        return {
+            "collection_slug": rng.choice(targets["versions"])[0],
+            "data_manager_name": rng.choice(["facet", "pathDB"]),
+            "external_id": f"bench-import-{run}-{next(counter)}",
+            "mime": "image/svs",
+        }
+
+    return {
+        "import_single": lambda: ("POST", "/v1/files/import", {"json": upload()}),
+        "import_bulk": lambda: (
+            "POST",
+            "/v1/files/import/bulk",
+            {"json": [upload() for _ in range(batch_size)]},
+        ),
+    }
+
+
+async def run_scenario(client, factory, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            method, url, kwargs = factory()
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                await response.aread()
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def login(client, username: str, password: str):
+    """Fetch a bearer token for the write routes"""
+    response = await client.post(
+        "/token", data={"username": username, "password": password}
+    )
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args):
+    targets = await sample_targets(args.database, random.Random(args.seed))
+    if args.suite == "read":
+        scenarios = read_scenarios(targets)
+    else:
+        scenarios = import_scenarios(targets, args.batch_size)
+    if args.scenario:
+        scenarios = {name: scenarios[name] for name in args.scenario}
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url, limits=limits, timeout=args.timeout
+    ) as client:
+        if args.suite == "import":
+            await login(client, args.username, args.password)
+        results = {}
+        for name, factory in scenarios.items():
+            if args.warmup:
+                await run_scenario(client, factory, args.warmup, args.concurrency)
+            results[name] = await run_scenario(
+                client, factory, args.requests, args.concurrency
+            )
+            print(
+                f"{name:28} p50 {results[name]['p50_ms']:9.1f}ms"
+                f"  p95 {results[name]['p95_ms']:9.1f}ms"
+                f"  p99 {results[name]['p99_ms']:9.1f}ms"
+                f"  {results[name]['throughput']:8.1f} req/s"
+                f"  {results[name]['errors']} errors"
+            )
+
+    report = {
+        "meta": {
+            "suite": args.suite,
+            "base_url": args.base_url,
+            "database": args.database,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "batch_size": args.batch_size,
+            "seed": args.seed,
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "started": datetime.now().isoformat(),
+        },
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8080")
+    parser.add_argument("--database", default="prism_bench")
+    parser.add_argument("--suite", choices=["read", "import"], default="read")
+    parser.add_argument("--scenario", action="append", help="run only this scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--username", default="admin", help="for the import suite")
+    parser.add_argument("--password", default="bluecheese2018")
+    parser.add_argument("--output", help="write the JSON report here")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""Seed a local Postgres with a synthetic PRISM dataset for benchmarking
+
+The schema comes from app/tables.sql plus app/migrations/; rows are
+generated server side with generate_series so millions of files load in
+seconds. Connection settings come from the usual PG* environment variables.
+
+    ./seed.py --database prism_bench --collections 20 --versions 5 \
+        --files-per-collection 100000
+"""
+import argparse
+import asyncio
+import asyncpg
+import json
+import os
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+TABLES_SQL = os.path.join(APP_DIR, "tables.sql")
+
+sys.path.insert(0, APP_DIR)
+from api.util import migrations  # noqa: E402
+
+MIME_TYPES = ["image/svs", "image/tiff", "application/dicom", "text/csv"]
+
+
+def schema_sql() -> str:
+    """tables.sql without the psql-only create database / \\connect lines"""
+    lines = []
+    for line in open(TABLES_SQL):
+        if line.startswith("\\") or line.lower().startswith("create database"):
+            continue
+        lines.append(line)
+    return "".join(lines)
+
+
+async def recreate_database(name: str):
+    conn = await asyncpg.connect(database="postgres")
+    try:
+        await conn.execute(f'drop database if exists "{name}"')
+        await conn.execute(f'create database "{name}"')
+    finally:
+        await conn.close()
+
+
+async def seed(args):
+    await recreate_database(args.database)
+    conn = await asyncpg.connect(database=args.database)
+    timings = {}
+    try:
+        start = time.perf_counter()
+        await conn.execute(schema_sql())
+        await migrations.migrate(conn, log=lambda message: None)
+        timings["schema"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await conn.execute(
+            "insert into file_type (mime_type) select unnest($1::text[])", MIME_TYPES
+        )
+        await conn.execute(
+            """
+            insert into collection
+            (collection_name, collection_slug, collection_doi, collection_description)
+            select
+                'Benchmark collection ' || n,
+                'bench-' || n,
+                'doi:bench/' || n,
+                'Synthetic collection number ' || n
+            from generate_series(1, $1) as n
+            """,
+            args.collections,
+        )
+        await conn.execute(
+            """
+            insert into version (collection_id, name)
+            select collection_id, 'v' || n
+            from collection, generate_series(1, $1) as n
+            where collection_slug like 'bench-%'
+            order by collection_id, n
+            """,
+            args.versions,
+        )
+        timings["collections"] = time.perf_counter() - start
+
+        # Files are numbered per collection; the external_id mimics a
+        # PathDB viewer URL so searches and dedup see realistic values.
+        start = time.perf_counter()
+        await conn.execute(
+            """
+            insert into file (data_manager_id, file_type_id, external_id)
+            select
+                1 + (n % 2),
+                1 + (n % $2),
+                'http://pathdb.example/caMicroscope/apps/viewer/viewer.html?slideId='
+                    || collection_id || '-' || n || '&mode=pathdb'
+            from collection, generate_series(1, $1) as n
+            where collection_slug like 'bench-%'
+            order by collection_id, n
+            """,
+            args.files_per_collection,
+            len(MIME_TYPES),
+        )
+        timings["files"] = time.perf_counter() - start
+
+        # Each version keeps all but a small, version dependent share of
+        # its collection's files, like successive releases would.
+        start = time.perf_counter()
+        await conn.execute(
+            """
+            insert into version_file (version_id, file_id)
+            select version.version_id, file.file_id
+            from file
+            join version
+                on version.collection_id = split_part(
+                    split_part(file.external_id, 'slideId=', 2), '-', 1
+                )::integer
+            where file.external_id like 'http://pathdb.example/%'
+              and (file.file_id + version.version_id) % 50 <> 0
+            """
+        )
+        timings["version_files"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await conn.execute("analyze")
+        timings["analyze"] = time.perf_counter() - start
+
+        counts = {
+            table: await conn.fetchval(f"select count(*) from {table}")
+            for table in ["collection", "version", "file", "version_file"]
+        }
+    finally:
+        await conn.close()
+    return {"database": args.database, "counts": counts, "seconds": timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="prism_bench")
+    parser.add_argument("--collections", type=int, default=10)
+    parser.add_argument("--versions", type=int, default=3)
+    parser.add_argument("--files-per-collection", type=int, default=10000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(seed(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
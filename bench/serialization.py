@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Measure per-row response encoding cost for GET /files/{slug}/{version_id}
+
+Fetches one page of the files listing from a database seeded by seed.py,
+then encodes it repeatedly both ways the route can: through FastAPI's
+response_model validation and JSONResponse (the default), and through
+json_records (PRISM_FAST_JSON=1). Reports microseconds per row.
+
+    ./serialization.py --database prism_bench --rows 10000
+"""
+import argparse
+import asyncio
+import asyncpg
+import json
+import os
+import sys
+import time
+from typing import List
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+sys.path.insert(0, APP_DIR)
+os.environ["PRISM_FAST_JSON"] = "1"
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+from api.routes.files import FileInfo  # noqa: E402
+from api.util import serialization  # noqa: E402
+
+QUERY = """
+    select
+        file_id, data_manager_id,
+        mime_type, external_id,
+        data_manager_name, file_type_group_name
+    from version
+    natural join collection
+    cross join version_members(version.version_id) as member(file_id)
+    natural join file
+    natural join data_manager
+    natural join file_type
+    left join file_type_group
+        on file_type.file_type_id = file_type_group.file_type_id
+    where collection_slug = 'bench-1'
+      and version.version_id = (
+        select min(version_id) from version natural join collection
+        where collection_slug = 'bench-1'
+      )
+    order by file_id
+    limit $1
+"""
+
+
+async def fetch_rows(args):
+    conn = await asyncpg.connect(database=args.database)
+    try:
+        return await conn.fetch(QUERY, args.rows)
+    finally:
+        await conn.close()
+
+
+async def pydantic_path(field, records) -> bytes:
+    content = await serialize_response(field=field, response_content=records)
+    return JSONResponse(content).body
+
+
+async def fast_path(field, records) -> bytes:
+    return serialization.json_records(records, FileInfo).body
+
+
+async def timed(encode, field, records, repeat: int) -> dict:
+    body = await encode(field, records)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await encode(field, records)
+    elapsed = time.perf_counter() - start
+    return {
+        "bytes": len(body),
+        "ms_per_response": 1000 * elapsed / repeat,
+        "us_per_row": 1e6 * elapsed / repeat / len(records),
+    }
+
+
+async def run(args):
+    records = await fetch_rows(args)
+    if not records:
+        raise SystemExit("no files found, run seed.py first")
+    field = create_response_field(name="files", type_=List[FileInfo])
+
+    default = await pydantic_path(field, records)
+    fast = await fast_path(field, records)
+    if json.loads(default) != json.loads(fast):
+        raise SystemExit("fast path output differs from response_model output")
+
+    report = {
+        "rows": len(records),
+        "encoder": "orjson" if serialization.orjson else "json",
+        "response_model": await timed(pydantic_path, field, records, args.repeat),
+        "fast_json": await timed(fast_path, field, records, args.repeat),
+    }
+    report["speedup"] = (
+        report["response_model"]["us_per_row"] / report["fast_json"]["us_per_row"]
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="prism_bench")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""Compare full and delta version storage on a database seeded by seed.py
+
+Clones the latest version of each bench collection --clones times in a
+row, each clone leaving out a version dependent share of its parent's
+files like seed.py's versions do: once copying the files into
+version_file (VERSION_STORAGE=full) and once storing deltas with
+store_version_delta() (VERSION_STORAGE=delta, snapshotting every
+--snapshot-interval versions). For each, reports the rows written per
+clone, the bytes they take at the table's average row footprint, and the
+median latency of listing the clones through version_members(): the
+first page, a page half way through and the whole version. Both runs are
+rolled back, leaving the database as it was.
+
+    ./version_storage.py --database prism_bench --clones 5
+"""
+import argparse
+import asyncio
+import asyncpg
+import json
+import statistics
+import time
+
+# The files listing of GET /files/{slug}/{version_id}, without the
+# collection check
+LISTING = """
+    select
+        file_id, data_manager_id,
+        mime_type, external_id,
+        data_manager_name, file_type_group_name
+    from version_members($1, $2, $3) as member(file_id)
+    natural join file
+    natural join data_manager
+    natural join file_type
+    left join file_type_group
+        on file_type.file_type_id = file_type_group.file_type_id
+    order by file_id
+"""
+
+TABLES = ["version_file", "version_delta"]
+
+
+async def clone(conn, parent_version_id: int, storage: str, interval: int) -> int:
+    version_id = await conn.fetchval(
+        """
+        insert into version
+        (collection_id, name, parent_version_id)
+        select collection_id, 'storage bench', version_id
+        from version
+        where version_id = $1
+        returning version_id
+        """,
+        parent_version_id,
+    )
+    depth = await conn.fetchval(
+        "select delta_depth from version where version_id = $1", parent_version_id
+    )
+    if storage == "delta" and depth + 1 < interval:
+        removed = await conn.fetchval(
+            """
+            select array(
+                select file_id
+                from version_members($2) as member(file_id)
+                where (file_id + $1) % 50 = 0
+            )
+            """,
+            version_id,
+            parent_version_id,
+        )
+        await conn.execute(
+            "select store_version_delta($1, $2, $3)",
+            version_id,
+            parent_version_id,
+            removed,
+        )
+    else:
+        await conn.execute(
+            """
+            insert into version_file (version_id, file_id)
+            select $1, file_id
+            from version_members($2) as member(file_id)
+            where (file_id + $1) % 50 <> 0
+            """,
+            version_id,
+            parent_version_id,
+        )
+    return version_id
+
+
+async def median_ms(conn, repeat: int, *parameters) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await conn.fetch(LISTING, *parameters)
+        timings.append(1000 * (time.perf_counter() - start))
+    return statistics.median(timings)
+
+
+async def measure(conn, args, storage: str) -> dict:
+    parents = await conn.fetch(
+        """
+        select max(version_id) as version_id
+        from version
+        natural join collection
+        where collection_slug like 'bench-%'
+        group by collection_id
+        """
+    )
+    if not parents:
+        raise SystemExit("no bench collections found, run seed.py first")
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        rows = {
+            table: await conn.fetchval(f"select count(*) from {table}")
+            for table in TABLES
+        }
+        start = time.perf_counter()
+        clones = []
+        for parent in parents:
+            version_id = parent["version_id"]
+            for _ in range(args.clones):
+                version_id = await clone(
+                    conn, version_id, storage, args.snapshot_interval
+                )
+                clones.append(version_id)
+        seconds = time.perf_counter() - start
+        written, footprint = {}, {}
+        for table, count in rows.items():
+            total = await conn.fetchval(f"select count(*) from {table}")
+            written[table] = (total - count) / len(clones)
+            # Measured with the clones in, so an empty table has a footprint
+            footprint[table] = await conn.fetchval(
+                "select pg_total_relation_size($1::regclass)::float8 / greatest($2, 1)",
+                table,
+                total,
+            )
+
+        first, middle, full = [], [], []
+        for version_id in clones:
+            file_count = await conn.fetchval(
+                "select file_count from version where version_id = $1", version_id
+            )
+            after = await conn.fetchval(
+                """
+                select file_id
+                from version_members($1) as member(file_id)
+                offset $2 limit 1
+                """,
+                version_id,
+                file_count // 2,
+            )
+            first.append(await median_ms(conn, args.repeat, version_id, 0, 100))
+            middle.append(
+                await median_ms(conn, args.repeat, version_id, after or 0, 100)
+            )
+            full.append(await median_ms(conn, 1, version_id, 0, None))
+    finally:
+        await transaction.rollback()
+    return {
+        "clones": len(clones),
+        "clone_ms": 1000 * seconds / len(clones),
+        "rows_per_clone": written,
+        "bytes_per_row": footprint,
+        "bytes_per_clone": sum(written[table] * footprint[table] for table in TABLES),
+        "first_page_ms": statistics.median(first),
+        "middle_page_ms": statistics.median(middle),
+        "full_listing_ms": statistics.median(full),
+    }
+
+
+async def run(args):
+    conn = await asyncpg.connect(database=args.database)
+    try:
+        report = {}
+        for storage in ["full", "delta"]:
+            report[storage] = await measure(conn, args, storage)
+    finally:
+        await conn.close()
+    report["storage_ratio"] = (
+        report["full"]["bytes_per_clone"] / report["delta"]["bytes_per_clone"]
+    )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database", default="prism_bench")
+    parser.add_argument("--clones", type=int, default=5)
+    parser.add_argument("--snapshot-interval", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Run from the repository root with
+
+    pip install -r tests/requirements.txt
+    python -m pytest -q tests
+
+Tests that need Postgres are skipped unless PRISM_TEST_DSN points at a
+server where they may create databases, e.g.
+
+    PRISM_TEST_DSN=postgresql://postgres@localhost/postgres
+"""
+import asyncio
+import asyncpg
+import os
+import sys
+import uuid
+
+import httpx
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(__file__), "..", "app")
+sys.path.insert(0, APP_DIR)
+
+from api.util import cache, db, jobs, migrations, upstream  # noqa: E402
+
+TABLES_SQL = os.path.join(APP_DIR, "tables.sql")
+TEST_DSN = os.environ.get("PRISM_TEST_DSN")
+TEMPLATE = f"prism_test_{uuid.uuid4().hex[:8]}"
+
+
+def schema_sql() -> str:
+    """tables.sql without the psql-only create database / \\connect lines"""
+    lines = []
+    for line in open(TABLES_SQL):
+        if line.startswith("\\") or line.lower().startswith("create database"):
+            continue
+        lines.append(line)
+    return "".join(lines)
+
+
+async def admin(*statements):
+    conn = await asyncpg.connect(TEST_DSN)
+    try:
+        for statement in statements:
+            await conn.execute(statement)
+    finally:
+        await conn.close()
+
+
+async def create_template():
+    await admin(f'create database "{TEMPLATE}"')
+    conn = await asyncpg.connect(TEST_DSN, database=TEMPLATE)
+    try:
+        await conn.execute(schema_sql())
+        await migrations.migrate(conn, log=lambda message: None)
+    finally:
+        await conn.close()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def template_database():
+    """A database with the schema and every migration, copied by each test"""
+    if TEST_DSN is None:
+        pytest.skip("PRISM_TEST_DSN is not set")
+    asyncio.run(create_template())
+    yield TEMPLATE
+    asyncio.run(admin(f'drop database if exists "{TEMPLATE}" with (force)'))
+
+
+@pytest.fixture
+def database(template_database):
+    """A fresh database of the name returned, dropped after the test"""
+    name = f"{template_database}_{uuid.uuid4().hex[:8]}"
+    asyncio.run(admin(f'create database "{name}" template "{template_database}"'))
+    yield name
+    asyncio.run(admin(f'drop database if exists "{name}" with (force)'))
+
+
+@pytest.fixture
+async def client(database, monkeypatch):
+    """An API client logged in as admin, served against database"""
+    import main
+
+    monkeypatch.setattr(db, "READ_REPLICAS", [])
+    monkeypatch.setattr(db, "POOL_MIN_SIZE", 1)
+    monkeypatch.setattr(db, "POOL_MAX_SIZE", 4)
+    monkeypatch.setattr(jobs, "POLL_INTERVAL", 0.05)
+    await db.setup(dsn=TEST_DSN, database=database)
+    await cache.listen()
+    await upstream.setup()
+    jobs.start()
+    try:
+        async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+            response = await client.post(
+                "/token", data={"username": "admin", "password": "bluecheese2018"}
+            )
+            token = response.json()["access_token"]
+            client.headers["Authorization"] = f"Bearer {token}"
+            yield client
+    finally:
+        await jobs.stop()
+        await cache.close()
+        await upstream.close()
+        await db.close()
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+
+from api.util import db
+
+pytestmark = pytest.mark.anyio
+
+
+def upload(collection_slug: str, n: int) -> dict:
+    return {
+        "collection_slug": collection_slug,
+        "data_manager_name": "facet",
+        "external_id": f"{collection_slug}-{n}",
+        "mime": "image/tiff",
+    }
+
+
+@pytest.fixture
+async def published(client):
+    """Publish the latest version of public and add an open collection"""
+    await db.Database().execute(
+        """
+        with open as (
+            insert into collection (collection_name, collection_slug, collection_doi)
+            values ('Open', 'open', 'doi:open')
+            returning collection_id
+        )
+        insert into version (collection_id) select collection_id from open
+        """
+    )
+    response = await client.post("/v1/versions/public/1/publish")
+    assert response.status_code == 200, response.text
+
+
+async def test_bulk_import_skips_rows_of_published_versions(client, published):
+    uploads = [upload("open", 0), upload("public", 1), upload("open", 2)]
+    response = await client.post("/v1/files/import/bulk", json=uploads)
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert result["file_ids"][0] is not None and result["file_ids"][2] is not None
+    assert result["file_ids"][1] is None
+    assert [error["index"] for error in result["errors"]] == [1]
+    assert "published" in result["errors"][0]["detail"]
+
+    listing = await client.get("/v1/files/open/2")
+    assert [file["external_id"] for file in listing.json()] == ["open-0", "open-2"]
+    assert (await client.get("/v1/files/public/1")).json() == []
+
+
+async def test_import_job_skips_rows_of_published_versions(client, published):
+    uploads = [upload("public", 0), upload("open", 1)]
+    response = await client.post(
+        "/v1/jobs/", json={"kind": "import", "params": {"uploads": uploads}}
+    )
+    assert response.status_code == 202, response.text
+    job_id = response.json()["job_id"]
+    for _ in range(100):
+        job = (await client.get(f"/v1/jobs/{job_id}")).json()
+        if job["state"] not in ("queued", "running"):
+            break
+        await asyncio.sleep(0.05)
+    assert job["state"] == "done", job
+    assert job["result"]["imported"] == 1
+    assert [error["index"] for error in job["result"]["errors"]] == [0]
+
+    listing = await client.get("/v1/files/open/2")
+    assert [file["external_id"] for file in listing.json()] == ["open-1"]
+
+
+async def test_publishing_reaches_cached_latest_versions(client):
+    response = await client.post("/v1/files/import/bulk", json=[upload("public", 0)])
+    assert response.json()["errors"] == []
+    await client.post("/v1/versions/public/1/publish")
+    response = await client.post("/v1/files/import/bulk", json=[upload("public", 1)])
+    assert response.json()["file_ids"] == [None]
+
+
+def test_bulk_import_body_is_documented():
+    import main
+
+    operation = main.app.openapi()["paths"]["/v1/files/import/bulk"]["post"]
+    content = operation["requestBody"]["content"]
+    assert content["application/json"]["schema"]["items"]["title"] == "FileUpload"
+    assert content["application/x-ndjson"]["schema"]["title"] == "FileUpload"
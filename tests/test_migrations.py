@@ -0,0 +1,77 @@
+import asyncio
+import asyncpg
+import uuid
+
+import pytest
+
+from api.util import migrations
+from conftest import TEST_DSN, admin, schema_sql
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def baseline():
+    """A database with tables.sql and no migrations applied"""
+    if TEST_DSN is None:
+        pytest.skip("PRISM_TEST_DSN is not set")
+    name = f"prism_test_{uuid.uuid4().hex[:8]}"
+    await admin(f'create database "{name}"')
+    conn = await asyncpg.connect(TEST_DSN, database=name)
+    try:
+        await conn.execute(schema_sql())
+    finally:
+        await conn.close()
+    yield name
+    await admin(f'drop database if exists "{name}" with (force)')
+
+
+async def connect(database: str):
+    return await asyncpg.connect(TEST_DSN, database=database)
+
+
+async def test_concurrent_runs_apply_each_migration_once(baseline, monkeypatch):
+    monkeypatch.setattr(migrations, "LOCK_POLL_INTERVAL", 0.05)
+    first, second = await connect(baseline), await connect(baseline)
+    try:
+        applied = await asyncio.wait_for(
+            asyncio.gather(
+                migrations.migrate(first, log=lambda message: None),
+                migrations.migrate(second, log=lambda message: None),
+            ),
+            timeout=60,
+        )
+        done = await migrations.applied(first)
+    finally:
+        await first.close()
+        await second.close()
+    names = [migration.name for migration in migrations.available()]
+    assert sorted(applied[0] + applied[1]) == names
+    assert done == set(names)
+
+
+async def test_invalid_index_is_rebuilt(baseline, tmp_path):
+    conn = await connect(baseline)
+    try:
+        await conn.execute("create table sample (n integer)")
+        await conn.execute("insert into sample values (1), (1)")
+        # Fails on the duplicate, leaving the index behind as invalid
+        with pytest.raises(asyncpg.UniqueViolationError):
+            await conn.execute(
+                "create unique index concurrently sample_n_idx on sample (n)"
+            )
+        await conn.execute(
+            "delete from sample where ctid = (select max(ctid) from sample)"
+        )
+
+        (tmp_path / "0001_sample.sql").write_text(
+            "-- no transaction\n"
+            "create unique index concurrently if not exists sample_n_idx\n"
+            "\ton sample (n);\n"
+        )
+        assert await migrations.migrate(conn, str(tmp_path), log=lambda message: None)
+        assert await conn.fetchval(
+            "select indisvalid from pg_index where indexrelid = 'sample_n_idx'::regclass"
+        )
+    finally:
+        await conn.close()
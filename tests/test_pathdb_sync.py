@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+
+from api.routes import files
+from api.util import jobs
+
+pytestmark = pytest.mark.anyio
+
+
+def viewer_url(nid: int, mode: str = "pathdb") -> str:
+    return f"{files.PATH_DB_HOST}/caMicroscope/apps/viewer/viewer.html?slideId={nid}&mode={mode}"
+
+
+def image(nid: int) -> dict:
+    return {
+        "image_id": f"image-{nid}",
+        "subject_id": "subject",
+        "study_id": "study",
+        "external_id": viewer_url(nid),
+    }
+
+
+@pytest.fixture
+async def registered(client):
+    """Slide 1 registered as PathDB lists it, 2 with another URL, 3 gone"""
+    uploads = [
+        {
+            "collection_slug": "public",
+            "data_manager_name": "pathDB",
+            "external_id": external_id,
+            "mime": files.PATH_DB_MIME,
+        }
+        for external_id in (viewer_url(1), viewer_url(2, "old"), viewer_url(3))
+    ]
+    response = await client.post("/v1/files/import/bulk", json=uploads)
+    assert response.json()["errors"] == []
+
+
+async def wait_for(client, job_id: int) -> dict:
+    for _ in range(100):
+        job = (await client.get(f"/v1/jobs/{job_id}")).json()
+        if job["state"] not in ("queued", "running"):
+            return job
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+async def test_pathdb_sync_job_registers_new_images(client, registered, monkeypatch):
+    monkeypatch.setattr(jobs, "CHUNK_SIZE", 2)
+    images = [image(nid) for nid in (1, 2, 4, 5, 6)]
+    response = await client.post(
+        "/v1/jobs/",
+        json={
+            "kind": "pathdb_sync",
+            "params": {"collection_slug": "public", "images": images},
+        },
+    )
+    assert response.status_code == 202, response.text
+    assert response.json()["params_summary"]["images"] == 5
+    job = await wait_for(client, response.json()["job_id"])
+    assert job["state"] == "done", job
+
+    result = job["result"]
+    assert (result["added"], result["unchanged"]) == (3, 1)
+    assert result["changed_count"] == 1
+    assert result["changed"][0]["upstream_external_id"] == viewer_url(2)
+    assert result["removed_count"] == 1
+    assert result["removed"][0]["external_id"] == viewer_url(3)
+
+    listing = (await client.get("/v1/files/public/1")).json()
+    assert {file["external_id"] for file in listing} == {
+        viewer_url(1),
+        viewer_url(2, "old"),
+        viewer_url(3),
+        viewer_url(4),
+        viewer_url(5),
+        viewer_url(6),
+    }
+
+
+async def test_pathdb_sync_job_matches_the_route(client, registered, monkeypatch):
+    images = [files.PathDBImage(**image(nid)) for nid in (1, 2, 4)]
+
+    async def fetch_pathdb_images(auth: str):
+        return images
+
+    monkeypatch.setattr(files, "fetch_pathdb_images", fetch_pathdb_images)
+    response = await client.post(
+        "/v1/files/sync/pathdb/public", auth=("pathdb", "secret")
+    )
+    assert response.status_code == 200, response.text
+    synced = response.json()
+
+    response = await client.post(
+        "/v1/jobs/",
+        json={
+            "kind": "pathdb_sync",
+            "params": {
+                "collection_slug": "public",
+                "images": [image.dict() for image in images],
+            },
+        },
+    )
+    job = await wait_for(client, response.json()["job_id"])
+    # The route registered slide 4 already, so the job finds nothing new
+    assert job["result"]["added"] == 0
+    assert job["result"]["unchanged"] == synced["unchanged"] + synced["added"]
+    assert job["result"]["changed"] == synced["changed"]
+    assert job["result"]["removed"] == synced["removed"]
@@ -0,0 +1,169 @@
+"""Read routing between a primary and read replicas
+
+Needs a Postgres server: PRISM_TEST_DSN is the primary and
+PRISM_TEST_REPLICA_DSN (by default the same server) the replica, e.g.
+a streaming standby of it. Connections are told apart by their
+application_name, so both may point at the same server.
+"""
+import asyncio
+import asyncpg
+import os
+import pytest
+from starlette.requests import Request
+
+from api.util import db
+
+pytestmark = pytest.mark.anyio
+
+PRIMARY_DSN = os.environ.get("PRISM_TEST_DSN")
+REPLICA_DSN = os.environ.get("PRISM_TEST_REPLICA_DSN", PRIMARY_DSN)
+# Nothing listens there, so connecting fails straight away
+UNREACHABLE_DSN = "postgresql://postgres@127.0.0.1:1/postgres"
+
+if PRIMARY_DSN is None:
+    pytest.skip("PRISM_TEST_DSN is not set", allow_module_level=True)
+
+# The application_name a connection reports for a server
+who = "select current_setting('application_name') as name"
+
+
+def named(dsn: str, name: str) -> str:
+    separator = "&" if "?" in dsn else "?"
+    return f"{dsn}{separator}application_name={name}"
+
+
+def request(method: str = "GET", headers: dict = {}) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "method": method,
+            "headers": [
+                (key.lower().encode(), value.encode()) for key, value in headers.items()
+            ],
+        }
+    )
+
+
+async def served_by(database: db.Database) -> str:
+    return (await database.fetch(who))[0]["name"]
+
+
+@pytest.fixture
+def start(monkeypatch):
+    """Start the pools with the given replica DSNs, closing them after"""
+    monkeypatch.setattr(db, "POOL_MIN_SIZE", 1)
+    monkeypatch.setattr(db, "POOL_MAX_SIZE", 2)
+    monkeypatch.setattr(db, "statements", set())
+
+    async def start(*replicas):
+        monkeypatch.setattr(db, "READ_REPLICAS", list(replicas))
+        await db.setup(dsn=named(PRIMARY_DSN, "prism-primary"))
+
+    yield start
+
+
+@pytest.fixture
+async def replica(start):
+    await start(named(REPLICA_DSN, "prism-replica"))
+    yield db.replicas[0]
+    await db.close()
+
+
+async def test_get_reads_go_to_the_replica(replica):
+    assert await served_by(db.Database(request("GET"))) == "prism-replica"
+    assert await served_by(db.Database(request("HEAD"))) == "prism-replica"
+    records = [record async for record in db.Database(request()).iterate(who)]
+    assert records[0]["name"] == "prism-replica"
+
+
+async def test_writes_and_own_writes_stay_on_the_primary(replica):
+    assert await served_by(db.Database(request("POST"))) == "prism-primary"
+    primary = db.Database(request("GET", {db.READ_PRIMARY_HEADER: "1"}))
+    assert await served_by(primary) == "prism-primary"
+    assert await served_by(db.Database()) == "prism-primary"
+    # execute() never reads from a replica, even within a GET
+    database = db.Database(request("GET"))
+    async with database.acquire() as (conn, waited):
+        assert await conn.fetchval(who) == "prism-primary"
+
+
+async def test_read_database_reads_from_the_replica_on_post(replica):
+    assert await served_by(db.ReadDatabase(request("POST"))) == "prism-replica"
+    primary = db.ReadDatabase(request("POST", {db.READ_PRIMARY_HEADER: "1"}))
+    assert await served_by(primary) == "prism-primary"
+
+
+async def test_replicas_take_turns(start):
+    await start(
+        named(REPLICA_DSN, "prism-replica-a"), named(REPLICA_DSN, "prism-replica-b")
+    )
+    try:
+        database = db.Database(request())
+        served = [await served_by(database) for _ in range(6)]
+    finally:
+        await db.close()
+    assert set(served) == {"prism-replica-a", "prism-replica-b"}
+    assert all(a != b for a, b in zip(served, served[1:]))
+
+
+async def test_unreachable_replica_is_skipped(start):
+    await start(UNREACHABLE_DSN, named(REPLICA_DSN, "prism-replica"))
+    try:
+        assert not db.replicas[0].available
+        database = db.Database(request())
+        served = {await served_by(database) for _ in range(4)}
+    finally:
+        await db.close()
+    assert served == {"prism-replica"}
+
+
+async def test_reads_fall_back_to_the_primary_without_replicas(start):
+    await start(UNREACHABLE_DSN)
+    try:
+        assert await served_by(db.Database(request())) == "prism-primary"
+    finally:
+        await db.close()
+
+
+async def terminate(dsn: str, application_name: str):
+    """Terminate the backends of application_name on the server of dsn once
+    one runs pg_sleep, as a restart of the server would"""
+    conn = await asyncpg.connect(dsn)
+    try:
+        while not await conn.fetchval(
+            """
+            select count(pg_terminate_backend(pid)) > 0
+            from pg_stat_activity
+            where application_name = $1
+              and query like '%pg_sleep%'
+            """,
+            application_name,
+        ):
+            await asyncio.sleep(0.01)
+    finally:
+        await conn.close()
+
+
+async def test_replica_failing_mid_read_fails_over(replica):
+    database = db.Database(request())
+    killer = asyncio.create_task(terminate(REPLICA_DSN, "prism-replica"))
+    records = await database.fetch(f"{who}, pg_sleep(0.5)")
+    await killer
+    assert records[0]["name"] == "prism-primary"
+    assert not replica.available
+    assert await served_by(database) == "prism-primary"
+
+    # Once the retry period is over the monitor's check brings it back
+    replica.down_until = 0
+    await replica.check()
+    assert replica.available
+    assert await served_by(database) == "prism-replica"
+
+
+async def test_lagging_replica_is_skipped(replica, monkeypatch):
+    monkeypatch.setattr(db, "REPLICA_MAX_LAG", 1)
+    replica.lag = 2
+    assert await served_by(db.Database(request())) == "prism-primary"
+    await replica.check()
+    assert replica.lag <= 1
+    assert await served_by(db.Database(request())) == "prism-replica"
@@ -0,0 +1,73 @@
+import pytest
+
+from api.routes import search
+from api.util import db
+
+pytestmark = pytest.mark.anyio
+
+
+def upload(n: int, mime: str) -> dict:
+    return {
+        "collection_slug": "public",
+        "data_manager_name": "pathDB",
+        "external_id": f"http://pathdb.test/viewer.html?slideId=2-471{n}",
+        "mime": mime,
+    }
+
+
+async def import_grouped_files(client) -> list:
+    """Ten matching files, the tiffs of which are in two file type groups"""
+    uploads = [upload(n, "image/tiff" if n % 2 else "image/svs") for n in range(10)]
+    response = await client.post("/v1/files/import/bulk", json=uploads)
+    assert response.status_code == 200, response.text
+    await db.Database().execute(
+        """
+        insert into file_type_group (file_type_id, file_type_group_name)
+        select file_type_id, name
+        from file_type, unnest(array['g1', 'g2']) as name
+        where mime_type = 'image/tiff'
+        """
+    )
+    return response.json()["file_ids"]
+
+
+async def search_pages(client, q: str, limit: int) -> list:
+    rows, after = [], None
+    while True:
+        params = {"q": q, "limit": limit}
+        if after is not None:
+            params["after"] = after
+        response = await client.get("/v1/search/files", params=params)
+        assert response.status_code == 200, response.text
+        rows += response.json()
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            return rows
+
+
+def keys(rows: list) -> list:
+    return [(row["file_id"], row["file_type_group_name"]) for row in rows]
+
+
+async def test_pages_cover_files_in_several_groups(client):
+    file_ids = await import_grouped_files(client)
+    everything = await search_pages(client, "slideId=2-471", 100)
+    assert sorted({row["file_id"] for row in everything}) == sorted(file_ids)
+    assert len(everything) == 15
+    for limit in (1, 2, 3, 4):
+        assert keys(await search_pages(client, "slideId=2-471", limit)) == keys(
+            everything
+        )
+
+
+async def test_candidates_are_counted_in_files(client, monkeypatch):
+    await import_grouped_files(client)
+    monkeypatch.setattr(search, "MAX_FILE_CANDIDATES", 11)
+    response = await client.get("/v1/search/files", params={"q": "slideId=2-471"})
+    assert "X-Search-Truncated" not in response.headers
+    assert len({row["file_id"] for row in response.json()}) == 10
+
+    monkeypatch.setattr(search, "MAX_FILE_CANDIDATES", 4)
+    response = await client.get("/v1/search/files", params={"q": "slideId=2-471"})
+    assert response.headers["X-Search-Truncated"] == "true"
+    assert len({row["file_id"] for row in response.json()}) == 4
@@ -0,0 +1,64 @@
+import pytest
+from fastapi import HTTPException
+
+from api.routes import auth
+from api.util import tokens
+
+pytestmark = pytest.mark.anyio
+
+
+def test_issued_token_verifies():
+    token = tokens.issue("admin", email="admin@example.com")
+    claims = tokens.verify(token)
+    assert claims["sub"] == "admin"
+    assert claims["email"] == "admin@example.com"
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "not a token",
+        "a.b.c",
+        "a.b.é",
+        "é.é.é",
+        "\udcff.a.b",
+    ],
+)
+def test_bad_tokens_are_invalid(token):
+    with pytest.raises(tokens.InvalidToken):
+        tokens.verify(token)
+
+
+def test_tampered_token_is_invalid():
+    header, payload, signature = tokens.issue("alice").split(".")
+    forged = tokens.issue("admin").split(".")[1]
+    with pytest.raises(tokens.InvalidToken):
+        tokens.verify(f"{header}.{forged}.{signature}")
+
+
+def test_expired_token_is_invalid():
+    token = tokens.issue("admin", ttl=-1)
+    with pytest.raises(tokens.InvalidToken):
+        tokens.verify(token)
+
+
+async def test_bad_token_is_a_401():
+    with pytest.raises(HTTPException) as e:
+        await auth.get_current_user("é.é.é")
+    assert e.value.status_code == 401
+
+
+async def test_user_store_checks_passwords():
+    store = auth.InMemoryUserStore(auth.fake_users_db)
+    assert (await store.authenticate("admin", "bluecheese2018")).username == "admin"
+    assert await store.authenticate("admin", "wrong") is None
+    assert await store.authenticate("admin", "blåcheese") is None
+    assert await store.authenticate("nobody", "bluecheese2018") is None
+
+
+def test_user_store_must_authenticate():
+    class Incomplete(auth.UserStore):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,157 @@
+"""The upstream client against a stub PathDB/NBIA served by httpx.MockTransport"""
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from api.routes import files
+from api.util import upstream
+
+pytestmark = pytest.mark.anyio
+
+URL = "http://pathdb.test/listofimages"
+
+
+class Stub:
+    """Answers each request with the next queued response or exception,
+    recording the requests"""
+
+    def __init__(self):
+        self.replies = []
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+@pytest.fixture
+async def stub(monkeypatch):
+    stub = Stub()
+    monkeypatch.setattr(upstream, "responses", upstream.LRUCache(8))
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(stub))
+    yield stub
+    await upstream.close()
+
+
+async def test_fresh_response_is_served_from_cache(stub):
+    stub.replies.append(httpx.Response(200, json=[1, 2], headers={"ETag": '"a"'}))
+    assert await upstream.get_json(URL, params={"_format": "json"}) == [1, 2]
+    assert await upstream.get_json(URL, params={"_format": "json"}) == [1, 2]
+    assert len(stub.requests) == 1
+
+
+async def test_cache_key_includes_params_and_headers(stub):
+    stub.replies.append(httpx.Response(200, json=["a"]))
+    stub.replies.append(httpx.Response(200, json=["b"]))
+    stub.replies.append(httpx.Response(200, json=["c"]))
+    assert await upstream.get_json(URL, params={"Collection": "a"}) == ["a"]
+    assert await upstream.get_json(URL, params={"Collection": "b"}) == ["b"]
+    assert await upstream.get_json(URL, headers={"Authorization": "x"}) == ["c"]
+    assert len(stub.requests) == 3
+
+
+async def test_expired_response_is_revalidated_with_etag(stub, monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_CACHE_TTL", 0)
+    stub.replies.append(httpx.Response(200, json=[1, 2], headers={"ETag": '"a"'}))
+    stub.replies.append(httpx.Response(304))
+    first = await upstream.get_json(URL)
+    assert await upstream.get_json(URL) is first
+    assert "If-None-Match" not in stub.requests[0].headers
+    assert stub.requests[1].headers["If-None-Match"] == '"a"'
+
+
+async def test_changed_response_replaces_cached_one(stub, monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_CACHE_TTL", 0)
+    stub.replies.append(httpx.Response(200, json=[1], headers={"ETag": '"a"'}))
+    stub.replies.append(httpx.Response(200, json=[1, 2], headers={"ETag": '"b"'}))
+    stub.replies.append(httpx.Response(304))
+    assert await upstream.get_json(URL) == [1]
+    assert await upstream.get_json(URL) == [1, 2]
+    assert await upstream.get_json(URL) == [1, 2]
+    assert stub.requests[2].headers["If-None-Match"] == '"b"'
+
+
+async def test_response_without_etag_is_fetched_again(stub, monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_CACHE_TTL", 0)
+    stub.replies.append(httpx.Response(200, json=[1]))
+    stub.replies.append(httpx.Response(200, json=[2]))
+    assert await upstream.get_json(URL) == [1]
+    assert await upstream.get_json(URL) == [2]
+    assert "If-None-Match" not in stub.requests[1].headers
+
+
+async def test_timeout_is_a_504(stub):
+    stub.replies.append(httpx.ReadTimeout("timed out"))
+    with pytest.raises(HTTPException) as e:
+        await upstream.get_json(URL)
+    assert e.value.status_code == 504
+
+
+async def test_unreachable_upstream_is_a_502(stub):
+    stub.replies.append(httpx.ConnectError("connection refused"))
+    with pytest.raises(HTTPException) as e:
+        await upstream.get_json(URL)
+    assert e.value.status_code == 502
+
+
+async def test_upstream_error_status_is_passed_on(stub):
+    stub.replies.append(httpx.Response(503, text="down for maintenance"))
+    with pytest.raises(HTTPException) as e:
+        await upstream.get_json(URL)
+    assert e.value.status_code == 503
+    assert e.value.detail == "down for maintenance"
+
+
+async def test_failures_are_not_cached(stub):
+    stub.replies.append(httpx.ReadTimeout("timed out"))
+    stub.replies.append(httpx.Response(500, text="oops"))
+    stub.replies.append(httpx.Response(200, json=[1]))
+    for status_code in (504, 500):
+        with pytest.raises(HTTPException) as e:
+            await upstream.get_json(URL)
+        assert e.value.status_code == status_code
+    assert await upstream.get_json(URL) == [1]
+    assert await upstream.get_json(URL) == [1]
+    assert len(stub.requests) == 3
+
+
+async def test_failed_revalidation_keeps_cached_response(stub, monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_CACHE_TTL", 0)
+    stub.replies.append(httpx.Response(200, json=[1], headers={"ETag": '"a"'}))
+    stub.replies.append(httpx.ConnectError("connection refused"))
+    stub.replies.append(httpx.Response(304))
+    assert await upstream.get_json(URL) == [1]
+    with pytest.raises(HTTPException):
+        await upstream.get_json(URL)
+    assert await upstream.get_json(URL) == [1]
+    assert stub.requests[2].headers["If-None-Match"] == '"a"'
+
+
+async def test_client_timeout_applies_to_requests(monkeypatch):
+    monkeypatch.setattr(upstream, "UPSTREAM_TIMEOUT", 0.5)
+    await upstream.setup()
+    try:
+        assert upstream.client.timeout == httpx.Timeout(0.5)
+    finally:
+        await upstream.close()
+
+
+async def test_pathdb_images_are_read_through_the_cache(stub):
+    row = {
+        "nid": [{"value": 7}],
+        "clinicaltrialsubjectid": [{"value": "subject"}],
+        "imageid": [{"value": "image"}],
+        "studyid": [{"value": "study"}],
+    }
+    stub.replies.append(httpx.Response(200, json=[row], headers={"ETag": '"a"'}))
+    images = await files.fetch_pathdb_images("Basic dXNlcjpwdw==")
+    assert await files.fetch_pathdb_images("Basic dXNlcjpwdw==") == images
+    assert [image.external_id for image in images] == [
+        f"{files.PATH_DB_HOST}/caMicroscope/apps/viewer/viewer.html?slideId=7&mode=pathdb"
+    ]
+    assert len(stub.requests) == 1
+    assert stub.requests[0].url.params["_format"] == "json"
+    assert stub.requests[0].headers["Authorization"] == "Basic dXNlcjpwdw=="